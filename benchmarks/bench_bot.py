@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import runpy
+import stat
+import sys
+import tempfile
+import time
+
+# Load-replay benchmark for the bot. The real handler table of linux_bot.py
+# is loaded without polling and thousands of synthetic updates are fed
+# through it. Telegram is FakeBotAPIServer, Docker is FakeDocker and the
+# commands the handlers run (sudo, systemctl, nc, apt) are small scripts
+# that are put first on the PATH, so nothing on the machine is touched.
+#
+#   python benchmarks/bench_bot.py --updates 5000 --threads 0,2,8
+#
+# Reports the dispatch overhead (finding the handler for an update), the
+# latency per handler and the throughput in updates per second, first one
+# update at a time and then through the thread pool of telebot.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT = os.path.join(ROOT, 'linux_bot', 'linux_bot.py')
+sys.path.insert(0, os.path.join(ROOT, 'fakes'))
+sys.path.insert(0, ROOT)
+
+OPERATOR_CHAT_ID = 1
+
+SERVICES = [f"service{number}" for number in range(5)]
+CONTAINERS = [f"container{number}" for number in range(5)]
+SERVERS = [f"server{number}" for number in range(3)]
+
+# (weight, text of the update). Reboot, wake up and send command are left out.
+UPDATE_MIX = [
+    (10, '/menu'),
+    (8, '📦 Services'),
+    (8, '🐳   Docker'),
+    (6, '🟫 Get status services'),
+    (6, '🟫 Get status containers'),
+    (4, '🔔 Check servers'),
+    (4, '📜       Logs'),
+    (4, '📈 History'),
+    (2, '/perf'),
+    (2, '📃 System info'),
+    (3, lambda: f"🔁 Restart service: {random.choice(SERVICES)}"),
+    (3, lambda: f"🔁 Restart container: {random.choice(CONTAINERS)}"),
+    (2, lambda: f"🔔 Ping: {random.choice(SERVERS)}"),
+    (1, '🟨🟨 Restart all services'),
+    (1, '📜 Log: {log_directory}'),
+    (6, 'hello there'),
+]
+
+# Stand-ins for the commands the handlers run
+SHIMS = {
+    'sudo': 'exec "$@"',
+    'systemctl': f'exec "{sys.executable}" "{os.path.join(ROOT, "fakes", "fake_systemctl.py")}" "$@"',
+    'nc': 'sleep "${FAKE_COMMAND_LATENCY:-0}"; echo "Connection to $3 port $4 [tcp/*] succeeded!" >&2',
+    'apt': 'sleep "${FAKE_COMMAND_LATENCY:-0}"; echo "Listing..."; echo "bash/stable 5.2 amd64 [upgradable]"',
+    'reboot': 'echo "fake reboot"',
+    'etherwake': 'echo "fake etherwake"',
+}
+
+
+# Function to create the directory layout the bot expects, with fake commands
+def prepare(directory):
+    bot_directory = os.path.join(directory, 'linux_bot')
+    monitoring_directory = os.path.join(directory, 'linux_monitoring')
+    shim_directory = os.path.join(directory, 'bin')
+    log_directory = os.path.join(directory, 'logs_to_send')
+    for path in (bot_directory, monitoring_directory, shim_directory, log_directory):
+        os.makedirs(path)
+
+    for name, script in SHIMS.items():
+        shim_path = os.path.join(shim_directory, name)
+        with open(shim_path, 'w') as shim_file:
+            shim_file.write(f"#!/bin/sh\n{script}\n")
+        os.chmod(shim_path, os.stat(shim_path).st_mode | stat.S_IEXEC)
+
+    with open(os.path.join(bot_directory, 'bot_services.txt'), 'w') as list_file:
+        list_file.write('\n'.join(SERVICES) + '\n')
+    with open(os.path.join(bot_directory, 'bot_servers.txt'), 'w') as list_file:
+        list_file.write('\n'.join(f"{server}=127.0.0.1:{22 + number}" for number, server in enumerate(SERVERS)) + '\n')
+    with open(os.path.join(bot_directory, 'bot_logfiles.txt'), 'w') as list_file:
+        list_file.write(f"{log_directory}\n")
+    with open(os.path.join(log_directory, 'app.log'), 'w') as log_file:
+        log_file.write(''.join(f"line {number}\n" for number in range(200)))
+    with open(os.path.join(directory, 'fake_systemctl.json'), 'w') as state_file:
+        json.dump({service: {'ActiveState': 'active', 'SubState': 'running', 'MainPID': 100} for service in SERVICES}, state_file)
+
+    # Some history for /history, written the way the monitoring does
+    from linux_common.timeseries import TimeSeriesStore
+    metrics_store = TimeSeriesStore(os.path.join(monitoring_directory, 'metrics.tsdb'))
+    now = time.time()
+    for name in ('cpu.percent', 'storage.percent', 'server.server0.latency_ms'):
+        for step in range(0, 86400, 300):
+            metrics_store.record(name, random.uniform(0, 100), now - step)
+    metrics_store.close()
+    return bot_directory, shim_directory, log_directory
+
+
+# Function to make the synthetic updates
+def make_updates(count, foreign_rate, log_directory):
+    from telebot import types
+
+    weights = [weight for weight, _ in UPDATE_MIX]
+    texts = [text for _, text in UPDATE_MIX]
+    updates = []
+    for number in range(count):
+        text = random.choices(texts, weights)[0]
+        text = text() if callable(text) else text.format(log_directory=log_directory)
+        chat_id = OPERATOR_CHAT_ID if random.random() >= foreign_rate else 1000 + number % 50
+        updates.append(types.Update.de_json({
+            'update_id': number + 1,
+            'message': {'message_id': number + 1, 'date': int(time.time()), 'text': text,
+                        'chat': {'id': chat_id, 'type': 'private'},
+                        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Operator'}},
+        }))
+    return updates
+
+
+# Function to measure how long it takes to find the handler of every update
+def measure_dispatch(router, updates):
+    started = time.perf_counter()
+    for update in updates:
+        router.resolve(update.message)
+    elapsed = time.perf_counter() - started
+    return elapsed / len(updates)
+
+
+# Counts the exceptions of handlers instead of stopping the replay
+class CountingExceptionHandler:
+    def __init__(self):
+        self.errors = {}
+
+    def handle(self, exception):
+        name = type(exception).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+        return True
+
+
+# Function to count the handled updates
+def handled(profiler):
+    return sum(timing.count for timing in profiler.timings())
+
+
+# Function to feed the updates through the bot and wait until all are handled, returns updates per second
+def replay(bot, profiler, updates, threads):
+    from telebot.util import ThreadPool
+
+    profiler.reset()
+    if threads:
+        bot.threaded = True
+        bot.worker_pool = ThreadPool(bot, num_threads=threads)
+    else:
+        bot.threaded = False
+
+    started = time.perf_counter()
+    bot.process_new_updates(updates)
+    while handled(profiler) < len(updates):
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+
+    if threads:
+        bot.worker_pool.close()
+    return len(updates) / elapsed
+
+
+def print_handlers(profiler):
+    print(f"  {'handler':<36} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for timing in profiler.timings():
+        print(f"  {timing.name[:36]:<36} {timing.count:>6} {timing.p50 * 1000:>8.2f} {timing.p95 * 1000:>8.2f} {timing.max * 1000:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay synthetic updates through the handlers of the bot.')
+    parser.add_argument('--updates', type=int, default=2000, help='number of updates (default 2000)')
+    parser.add_argument('--threads', default='0,2,8', help='worker threads to compare, 0 is one update at a time (default 0,2,8)')
+    parser.add_argument('--foreign-rate', type=float, default=0.1, help='part of the updates from chats that are not allowed (default 0.1)')
+    parser.add_argument('--telegram-latency', type=float, default=0, help='seconds every Telegram request takes')
+    parser.add_argument('--command-latency', type=float, default=0, help='seconds the fake nc and apt take')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the update mix')
+    parser.add_argument('--json', help='append the results to this file, one JSON object per line')
+    options = parser.parse_args()
+    random.seed(options.seed)
+
+    from fake_bot_api import FakeBotAPIServer
+    from fake_docker import FakeDocker, FakeDockerServer
+
+    with tempfile.TemporaryDirectory(prefix='bench_bot_') as directory:
+        bot_directory, shim_directory, log_directory = prepare(directory)
+        api = FakeBotAPIServer()
+        api.latency = options.telegram_latency
+        api.start()
+        docker_server = FakeDockerServer(os.path.join(directory, 'docker.sock'), FakeDocker(CONTAINERS))
+        docker_server.start()
+
+        os.environ.update(
+            SECRET_TOKEN='123456:benchmark', CHAT_ID_PERSON1=str(OPERATOR_CHAT_ID), TELEGRAM_API_URL=api.api_url,
+            SYSTEMCTL_BIN=os.path.join(shim_directory, 'systemctl'),
+            FAKE_SYSTEMCTL_STATE=os.path.join(directory, 'fake_systemctl.json'),
+            FAKE_SYSTEMCTL_JOURNAL=os.path.join(directory, 'fake_systemctl.journal'),
+            FAKE_COMMAND_LATENCY=str(options.command_latency),
+            DOCKER_SOCKET=os.path.join(directory, 'docker.sock'),
+            PATH=f"{shim_directory}{os.pathsep}{os.environ.get('PATH', '')}")
+        os.chdir(bot_directory)
+        linux_bot = runpy.run_path(BOT, run_name='linux_bot')
+        bot, router, profiler = linux_bot['bot'], linux_bot['router'], linux_bot['profiler']
+        bot.exception_handler = CountingExceptionHandler()
+        updates = make_updates(options.updates, options.foreign_rate, log_directory)
+
+        dispatch_seconds = measure_dispatch(router, updates)
+        print(f"{len(router.routes)} message handlers, {len(updates)} updates")
+        print(f"Dispatch: {dispatch_seconds * 1e6:.1f} µs per update")
+
+        results = {'updates': len(updates), 'handlers': len(router.routes),
+                   'dispatch_us': dispatch_seconds * 1e6, 'throughput': {}}
+        for threads in (int(threads) for threads in options.threads.split(',')):
+            if threads:
+                updates_per_second = replay(bot, profiler, updates, threads)
+                print(f"\n{threads} worker threads: {updates_per_second:.1f} updates per second")
+            else:
+                updates_per_second = replay(bot, profiler, updates, 0)
+                print(f"\nOne update at a time: {updates_per_second:.1f} updates per second")
+            print_handlers(profiler)
+            results['throughput'][threads] = updates_per_second
+            results.setdefault('handlers_ms', {})[threads] = {timing.name: {'count': timing.count, 'p50': timing.p50 * 1000, 'p95': timing.p95 * 1000}
+                                                              for timing in profiler.timings()}
+        print(f"\nTelegram requests: {api.requests}, handler errors: {bot.exception_handler.errors or 'none'}")
+        results['errors'] = bot.exception_handler.errors
+
+        api.shutdown()
+        docker_server.stop()
+
+    if options.json:
+        results.update(timestamp=time.time(), options={key: value for key, value in vars(options).items() if key != 'json'})
+        with open(options.json, 'a') as json_file:
+            json_file.write(json.dumps(results) + '\n')
+
+
+if __name__ == '__main__':
+    main()
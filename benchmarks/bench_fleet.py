@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+# Benchmark of fleet mode. A FleetAggregator runs in this process and
+# several local processes run FleetAgents against it, every agent with a
+# state like the monitoring reports (servers, services, containers, metrics).
+# Every round a part of the values changes and some agents raise an alert,
+# then every agent pushes.
+#
+#   python benchmarks/bench_fleet.py --processes 4 --agents 500 --rounds 10
+#
+# Prints the pushes per second, the latency of a push, the bytes of a delta
+# push against the whole state and whether the aggregator ended up with the
+# same state and every alert exactly once.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from linux_common.fleet import FleetAggregator, encode_batch, start_fleet_server  # noqa: E402
+from linux_common.profiling import percentile  # noqa: E402
+
+TOKEN = 'benchmark'
+
+
+# Function to make the state of one agent
+def make_state(targets):
+    state = {'cpu.percent': 12.5, 'storage.percent': 40, 'storage./.percent': 40}
+    for number in range(targets):
+        state[f"state.server.server{number}"] = 'online'
+        state[f"server.server{number}.online"] = 1
+        state[f"server.server{number}.latency_ms"] = round(random.uniform(0.2, 40), 1)
+        state[f"state.service.service{number}"] = 'active'
+        state[f"state.container.container{number}"] = 'running'
+    return state
+
+
+# Function to change a part of the values, like one check cycle does
+def change_state(agent, state, change_rate):
+    state['cpu.percent'] = round(random.uniform(0, 100), 1)
+    agent.set('cpu.percent', state['cpu.percent'])
+    for key in random.sample(sorted(state), max(1, int(len(state) * change_rate))):
+        if key.endswith('latency_ms'):
+            value = round(random.uniform(0.2, 40), 1)
+        elif key.startswith('state.server.'):
+            value = random.choice(['online', 'offline'])
+        else:
+            continue
+        state[key] = value
+        agent.set(key, value)
+
+
+# Runs the agents of one process, returns the push latencies, the final states and the sent alert count
+def run_agents(first, count, options, port, queue):
+    from linux_common.fleet import FleetAgent
+
+    random.seed(options.seed + first)
+    agents = []
+    for number in range(first, first + count):
+        agent = FleetAgent(f"http://127.0.0.1:{port}", f"host{number:04d}", TOKEN, timeout=30)
+        state = make_state(options.targets)
+        for key, value in state.items():
+            agent.set(key, value)
+        agents.append((agent, state))
+
+    latencies = []
+    alerts = 0
+    for _ in range(options.rounds):
+        for agent, state in agents:
+            change_state(agent, state, options.change_rate)
+            if random.random() < options.alert_rate:
+                agent.alert(f"⚠️ Server server{random.randrange(options.targets)} is offline!")
+                alerts += 1
+            started = time.perf_counter()
+            agent.push()
+            latencies.append(time.perf_counter() - started)
+
+    queue.put({'latencies': latencies, 'alerts': alerts, 'failed': sum(agent.failed_pushes for agent, _ in agents),
+               'bytes': sum(agent.bytes_sent for agent, _ in agents), 'pushes': sum(agent.pushes for agent, _ in agents),
+               'states': {agent.name: state for agent, state in agents}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fleet pushes from local agent processes to one aggregator.')
+    parser.add_argument('--processes', type=int, default=4, help='agent processes (default 4)')
+    parser.add_argument('--agents', type=int, default=200, help='agents in total (default 200)')
+    parser.add_argument('--targets', type=int, default=20, help='servers, services and containers per agent (default 20)')
+    parser.add_argument('--rounds', type=int, default=10, help='pushes per agent (default 10)')
+    parser.add_argument('--change-rate', type=float, default=0.05, help='part of the values that changes every round (default 0.05)')
+    parser.add_argument('--alert-rate', type=float, default=0.1, help='chance that an agent raises an alert in a round (default 0.1)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the changes')
+    parser.add_argument('--json', help='append the results to this file, one JSON object per line')
+    options = parser.parse_args()
+
+    received_alerts = []
+    aggregator = FleetAggregator(TOKEN, lambda name, message, parse_mode: received_alerts.append(name))
+    server = start_fleet_server(aggregator, 0, '127.0.0.1')
+    port = server.server_address[1]
+
+    queue = multiprocessing.Queue()
+    per_process = -(-options.agents // options.processes)
+    processes = []
+    started = time.perf_counter()
+    for first in range(0, options.agents, per_process):
+        process = multiprocessing.Process(target=run_agents, args=(first, min(per_process, options.agents - first), options, port, queue))
+        process.start()
+        processes.append(process)
+    results = [queue.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    server.shutdown()
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    pushes = sum(result['pushes'] for result in results)
+    sent_bytes = sum(result['bytes'] for result in results)
+    full_bytes = len(encode_batch({'changed': make_state(options.targets)}))
+    states = {name: state for result in results for name, state in result['states'].items()}
+    agents = {agent.name: agent for agent in aggregator.snapshot()}
+    mismatched = sum(1 for name, state in states.items()
+                     if name not in agents or any(agents[name].state.get(key) != value for key, value in state.items()))
+    sent_alerts = sum(result['alerts'] for result in results)
+
+    print(f"{options.agents} agents in {len(processes)} processes, {options.rounds} rounds, {options.targets} targets per agent")
+    print(f"Pushes: {pushes} in {elapsed:.2f} s, {pushes / elapsed:.0f} per second, {sum(result['failed'] for result in results)} failed")
+    print(f"Push latency: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    print(f"Bytes per push: {sent_bytes / pushes:.0f} (the whole state compressed is {full_bytes})")
+    print(f"Aggregator: {len(agents)} agents, {mismatched} with a different state, {aggregator.rejected} pushes asked for the whole state")
+    print(f"Alerts: {sent_alerts} sent, {len(received_alerts)} received")
+
+    if options.json:
+        result = {'agents': options.agents, 'processes': len(processes), 'pushes': pushes, 'pushes_per_second': pushes / elapsed,
+                  'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+                  'bytes_per_push': sent_bytes / pushes, 'full_state_bytes': full_bytes, 'mismatched': mismatched,
+                  'alerts_sent': sent_alerts, 'alerts_received': len(received_alerts), 'timestamp': time.time(),
+                  'options': {key: value for key, value in vars(options).items() if key != 'json'}}
+        with open(options.json, 'a') as json_file:
+            json_file.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import resource
+import runpy
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Benchmark of one monitoring cycle at fleet scale. For every size the
+# monitoring runs once ("monitoring.py --once") in a fresh directory against
+# the stand-ins in fakes/: fake_systemctl.py for the services, FakeDocker on a
+# unix socket for the containers, FakeBotAPIServer for Telegram and local TCP
+# ports for the servers (they are probed with sockets, so nc is not needed).
+#
+#   python benchmarks/bench_monitoring.py --sizes 10,100,1000 --failure-rate 0.1
+#
+# Prints the cycle time, the wall and CPU time of the process, the number of
+# started subprocesses and the peak RSS per size. With --json the results are
+# appended to a file, so runs can be compared over time.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MONITORING = os.path.join(ROOT, 'linux_monitoring', 'monitoring.py')
+sys.path.insert(0, os.path.join(ROOT, 'fakes'))
+sys.path.insert(0, ROOT)
+
+
+# Function to get a local port that nothing listens on
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Function to write the target lists and the fake state for one size, returns the names that are down
+def prepare(directory, size, failure_rate, restart_failure_rate, online_port, offline_port):
+    down = max(0, round(size * failure_rate))
+    stuck = round(down * restart_failure_rate)
+
+    services = [f"service{number}" for number in range(size)]
+    states = {}
+    for number, service in enumerate(services):
+        if number < down:
+            states[service] = {'ActiveState': 'failed', 'SubState': 'failed', 'FailRestart': number < stuck}
+        else:
+            states[service] = {'ActiveState': 'active', 'SubState': 'running', 'MainPID': 1000 + number}
+    with open(os.path.join(directory, 'fake_systemctl.json'), 'w') as state_file:
+        json.dump(states, state_file)
+
+    containers = [f"container{number}" for number in range(size)]
+    servers = [f"server{number}=127.0.0.1:{offline_port if number < down else online_port}" for number in range(size)]
+    for file_name, lines in (('monitoring_services.txt', services), ('monitoring_containers.txt', containers),
+                             ('monitoring_servers.txt', servers), ('monitoring_storage.txt', [])):
+        with open(os.path.join(directory, file_name), 'w') as list_file:
+            list_file.write('\n'.join(lines) + '\n')
+    return containers[:down], containers[:stuck]
+
+
+# Function to run one cycle of the monitoring in this process, started by run_cycle
+def child(result_path, checks):
+    from linux_common.metrics import Registry, add_process_metrics
+
+    spawns = add_process_metrics(Registry())
+    started = time.perf_counter()
+    sys.argv = [MONITORING, '--once'] + checks
+    monitoring = runpy.run_path(MONITORING, run_name='__main__')
+    wall = time.perf_counter() - started
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(result_path, 'w') as result_file:
+        json.dump({
+            'cycle_seconds': monitoring['cycle_seconds'],
+            'wall_seconds': wall,
+            'cpu_seconds': own.ru_utime + own.ru_stime,
+            'children_cpu_seconds': children.ru_utime + children.ru_stime,
+            'forks': sum(spawns.values.values()),
+            'peak_rss_mb': own.ru_maxrss / 1024,
+            'messages_sent': monitoring['notifier'].sent,
+        }, result_file)
+
+
+# Function to run the monitoring once for one size, returns the measurements
+def run_cycle(size, options):
+    from fake_bot_api import FakeBotAPIServer
+    from fake_docker import FakeDocker, FakeDockerServer
+
+    with tempfile.TemporaryDirectory(prefix='bench_monitoring_') as directory:
+        online = socket.socket()
+        online.bind(('127.0.0.1', 0))
+        online.listen(1024)
+        down_containers, stuck_containers = prepare(directory, size, options.failure_rate, options.restart_failure_rate,
+                                                    online.getsockname()[1], closed_port())
+
+        docker = FakeDocker([f"container{number}" for number in range(size)])
+        for name in down_containers:
+            docker.set_state(name, False)
+        docker.fail_start.update(stuck_containers)
+        docker.latency = options.docker_latency
+        docker_server = FakeDockerServer(os.path.join(directory, 'docker.sock'), docker)
+        docker_server.start()
+
+        api = FakeBotAPIServer()
+        api.latency = options.telegram_latency
+        api.start()
+
+        env = dict(os.environ,
+                   SECRET_TOKEN='123456:benchmark', CHAT_ID_PERSON1='1', TELEGRAM_API_URL=api.api_url,
+                   SYSTEMCTL_BIN=os.path.join(ROOT, 'fakes', 'fake_systemctl.py'),
+                   FAKE_SYSTEMCTL_STATE=os.path.join(directory, 'fake_systemctl.json'),
+                   FAKE_SYSTEMCTL_JOURNAL=os.path.join(directory, 'fake_systemctl.journal'),
+                   FAKE_SYSTEMCTL_LATENCY=str(options.systemctl_latency),
+                   DOCKER_SOCKET=os.path.join(directory, 'docker.sock'),
+                   ALERT_BATCH_SECONDS='1', REMEDIATION_TIMEOUT=str(options.remediation_timeout))
+        result_path = os.path.join(directory, 'result.json')
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--child', result_path, *options.checks.split(',')],
+                           cwd=directory, env=env, stdout=subprocess.DEVNULL, check=True)
+            with open(result_path, 'r') as result_file:
+                result = json.load(result_file)
+        finally:
+            api.shutdown()
+            docker_server.stop()
+            online.close()
+
+    result.update(size=size, failed=round(size * options.failure_rate))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark one monitoring cycle against local stand-ins.')
+    parser.add_argument('--sizes', default='10,100,1000', help='numbers of services, containers and servers (default 10,100,1000)')
+    parser.add_argument('--checks', default='services,containers,servers', help='checks to run (default services,containers,servers)')
+    parser.add_argument('--failure-rate', type=float, default=0.1, help='part of the targets that is down (default 0.1)')
+    parser.add_argument('--restart-failure-rate', type=float, default=0.2, help='part of the down targets that does not come back (default 0.2)')
+    parser.add_argument('--systemctl-latency', type=float, default=0, help='seconds every systemctl call takes')
+    parser.add_argument('--docker-latency', type=float, default=0, help='seconds every Docker API request takes')
+    parser.add_argument('--telegram-latency', type=float, default=0, help='seconds every Telegram request takes')
+    parser.add_argument('--remediation-timeout', type=int, default=5, help='seconds to wait for a restarted target (default 5)')
+    parser.add_argument('--json', help='append the results to this file, one JSON object per line')
+    parser.add_argument('--child', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        child(options.child[0], options.child[1:])
+        return
+
+    print(f"{'size':>6} {'failed':>6} {'cycle s':>8} {'wall s':>8} {'cpu s':>8} {'child cpu s':>11} {'forks':>6} {'peak RSS MB':>11} {'messages':>8}")
+    for size in (int(size) for size in options.sizes.split(',')):
+        result = run_cycle(size, options)
+        print(f"{result['size']:>6} {result['failed']:>6} {result['cycle_seconds']:>8.2f} {result['wall_seconds']:>8.2f} "
+              f"{result['cpu_seconds']:>8.2f} {result['children_cpu_seconds']:>11.2f} {result['forks']:>6} "
+              f"{result['peak_rss_mb']:>11.1f} {result['messages_sent']:>8}")
+        if options.json:
+            result.update(timestamp=time.time(), options={key: value for key, value in vars(options).items() if key not in ('json', 'child')})
+            with open(options.json, 'a') as json_file:
+                json_file.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
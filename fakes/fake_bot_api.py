@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Stand-in for the Telegram Bot API. Point the bots at it with
+# TELEGRAM_API_URL=http://127.0.0.1:<port>/bot{0}/{1}
+# Sent messages are kept in server.messages. Set server.flood_requests to
+# answer that many requests with 429 Too Many Requests, server.bad_requests
+# to answer that many with 400 Bad Request, server.latency to delay every
+# answer and server.down to refuse everything with a 502.
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body or '{}')
+        params = {key: values[0] for key, values in parse_qs(body).items()}
+        if '?' in self.path:
+            params.update({key: values[0] for key, values in parse_qs(self.path.split('?', 1)[1]).items()})
+        return params
+
+    def do_POST(self):
+        server = self.server
+        method = self.path.split('?')[0].rstrip('/').split('/')[-1]
+        params = self.read_params()
+        server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.down:
+            self.send_json(502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'})
+            return
+        with server.lock:
+            flooded = server.flood_requests > 0
+            if flooded:
+                server.flood_requests -= 1
+            rejected = not flooded and server.bad_requests > 0
+            if rejected:
+                server.bad_requests -= 1
+        if rejected:
+            self.send_json(400, {'ok': False, 'error_code': 400, 'description': "Bad Request: can't parse entities"})
+            return
+        if flooded:
+            self.send_json(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                                 'parameters': {'retry_after': server.retry_after}})
+            return
+
+        if method in ('sendMessage', 'sendDocument'):
+            chat_id = int(params.get('chat_id', 0))
+            with server.lock:
+                server.messages.append({'method': method, 'chat_id': chat_id, 'text': params.get('text'),
+                                        'parse_mode': params.get('parse_mode'), 'time': time.time()})
+                message_id = len(server.messages)
+            self.send_json(200, {'ok': True, 'result': {'message_id': message_id, 'date': int(time.time()),
+                                                        'chat': {'id': chat_id, 'type': 'private'},
+                                                        'text': params.get('text') or ''}})
+        elif method == 'getMe':
+            self.send_json(200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}})
+        elif method == 'getUpdates':
+            self.send_json(200, {'ok': True, 'result': []})
+        else:
+            self.send_json(200, {'ok': True, 'result': True})
+
+    do_GET = do_POST
+
+
+class FakeBotAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), FakeBotAPIHandler)
+        self.lock = threading.Lock()
+        self.messages = []
+        self.requests = 0
+        self.flood_requests = 0
+        self.retry_after = 1
+        self.bad_requests = 0
+        self.latency = 0
+        self.down = False
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/bot{{0}}/{{1}}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == '__main__':
+    server = FakeBotAPIServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8081)
+    print(f"Fake Bot API on {server.api_url}")
+    server.serve_forever()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import json
+import os
+import queue
+import re
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote, urlparse
+
+# Stand-in for the Docker Engine API on a unix socket. Containers live in
+# memory. Run it standalone with: fake_docker.py /tmp/docker.sock name1 name2
+# and point DOCKER_SOCKET at the socket.
+# docker.fail_start makes starting a container fail, docker.latency delays
+# every request.
+
+
+class FakeDocker:
+    def __init__(self, names=(), running=True):
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.fail_start = set()
+        self.latency = 0  # seconds added to every API request
+        self.subscribers = []
+        for name in names:
+            self.add(name, running)
+
+    def add(self, name, running=True):
+        with self.lock:
+            self.containers[name] = {
+                'Id': f"{abs(hash(name)):064x}"[:64],
+                'Names': [f"/{name}"],
+                'State': 'running' if running else 'exited',
+                'Status': 'Up 1 minute' if running else 'Exited (1) 1 minute ago',
+                'Created': int(time.time()),
+            }
+
+    def set_state(self, name, running):
+        with self.lock:
+            container = self.containers[name]
+            was_running = container['State'] == 'running'
+            container['State'] = 'running' if running else 'exited'
+            container['Status'] = 'Up Less than a second' if running else 'Exited (0) Less than a second ago'
+        if was_running and not running:
+            self.emit(name, 'die')
+        elif running and not was_running:
+            self.emit(name, 'start')
+
+    # Function to publish an event to everyone streaming /events
+    def emit(self, name, action):
+        event = {'Type': 'container', 'Action': action, 'status': action, 'time': int(time.time()),
+                 'Actor': {'ID': self.containers[name]['Id'], 'Attributes': {'name': name}}}
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.put(event)
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # Stream events with chunked encoding until the client or the server goes away
+    def stream_events(self):
+        docker = self.server.docker
+        subscriber = queue.Queue()
+        with docker.lock:
+            docker.subscribers.append(subscriber)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.flush()
+        try:
+            while not self.server.stopping:
+                try:
+                    event = subscriber.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                data = json.dumps(event).encode() + b'\n'
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with docker.lock:
+                docker.subscribers.remove(subscriber)
+        self.close_connection = True
+
+    def do_GET(self):
+        docker = self.server.docker
+        path = urlparse(self.path).path
+        if path == '/events':
+            self.stream_events()
+            return
+        time.sleep(docker.latency)
+        if path == '/containers/json':
+            with docker.lock:
+                self.send_json(200, list(docker.containers.values()))
+            return
+        match = re.fullmatch(r'/containers/([^/]+)/json', path)
+        if match:
+            name = unquote(match.group(1))
+            with docker.lock:
+                container = docker.containers.get(name)
+            if container is None:
+                self.send_json(404, {'message': f"No such container: {name}"})
+            else:
+                self.send_json(200, {'Name': f"/{name}", 'State': {'Status': container['State'], 'Running': container['State'] == 'running'}})
+            return
+        self.send_json(404, {'message': 'page not found'})
+
+    def do_POST(self):
+        docker = self.server.docker
+        time.sleep(docker.latency)
+        match = re.fullmatch(r'/containers/([^/]+)/(start|stop|restart)', urlparse(self.path).path)
+        if not match:
+            self.send_json(404, {'message': 'page not found'})
+            return
+        name, action = unquote(match.group(1)), match.group(2)
+        if name not in docker.containers:
+            self.send_json(404, {'message': f"No such container: {name}"})
+            return
+        if action in ('start', 'restart') and name in docker.fail_start:
+            self.send_json(500, {'message': f"Cannot start container {name}"})
+            return
+        running = docker.containers[name]['State'] == 'running'
+        if (action == 'start' and running) or (action == 'stop' and not running):
+            self.send_empty(304)
+            return
+        docker.set_state(name, action != 'stop')
+        self.send_empty(204)
+
+
+class FakeDockerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, docker=None):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.docker = docker or FakeDocker()
+        self.stopping = False
+        super().__init__(socket_path, FakeDockerHandler)
+
+    # BaseHTTPRequestHandler expects a (host, port) client address
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('fake-docker', 0)
+
+    def stop(self):
+        self.stopping = True
+        self.shutdown()
+        self.server_close()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == '__main__':
+    server = FakeDockerServer(sys.argv[1], FakeDocker(sys.argv[2:]))
+    print(f"Fake docker listening on {sys.argv[1]}")
+    server.serve_forever()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+import time
+
+# Stand-in for "journalctl --follow --output=json". Follows the journal file
+# written by fakes/fake_systemctl.py and prints the entries matching the
+# FIELD=value arguments (values of the same field are OR'd, like journalctl).
+
+JOURNAL_FILE = os.environ.get('FAKE_SYSTEMCTL_JOURNAL', 'fake_systemctl.journal')
+
+
+def main(argv):
+    matches = {}
+    for arg in argv:
+        if not arg.startswith('-') and '=' in arg:
+            field, value = arg.split('=', 1)
+            matches.setdefault(field, set()).add(value)
+
+    open(JOURNAL_FILE, 'a').close()
+    with open(JOURNAL_FILE, 'r') as journal_file:
+        journal_file.seek(0, os.SEEK_END)
+        while True:
+            line = journal_file.readline()
+            if not line:
+                time.sleep(0.05)
+                continue
+            entry = json.loads(line)
+            if all(entry.get(field) in values for field, values in matches.items()):
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv[1:])
+    except KeyboardInterrupt:
+        pass
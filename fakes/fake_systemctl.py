@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+import time
+
+# Stand-in for systemctl. Unit states live in the JSON file pointed to by
+# FAKE_SYSTEMCTL_STATE: {"unit": {"ActiveState": "active", "SubState": "running"}}.
+# Units that are not in the file are reported as not-found and inactive.
+# Set FAKE_SYSTEMCTL_FAIL_RESTART=1 to make start/restart leave units failed,
+# or "FailRestart": true in the state of a unit for only that unit. Like
+# systemctl, a start or restart that fails exits with 1 and a message on stderr.
+# FAKE_SYSTEMCTL_LATENCY adds a delay in seconds to every call.
+# Every state change is appended to FAKE_SYSTEMCTL_JOURNAL as a journal entry,
+# which fakes/fake_journalctl.py follows. "fake_systemctl.py kill unit" makes a
+# unit fail, like a crash would.
+
+STATE_FILE = os.environ.get('FAKE_SYSTEMCTL_STATE', 'fake_systemctl.json')
+JOURNAL_FILE = os.environ.get('FAKE_SYSTEMCTL_JOURNAL', 'fake_systemctl.journal')
+
+
+def load_states():
+    try:
+        with open(STATE_FILE, 'r') as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_states(states):
+    temp_file = f"{STATE_FILE}.tmp"
+    with open(temp_file, 'w') as state_file:
+        json.dump(states, state_file)
+    os.replace(temp_file, STATE_FILE)
+
+
+def unit_id(unit):
+    return unit if '.' in unit else f"{unit}.service"
+
+
+def journal(unit, message):
+    with open(JOURNAL_FILE, 'a') as journal_file:
+        journal_file.write(json.dumps({'_PID': '1', 'UNIT': unit_id(unit), 'MESSAGE': message}) + '\n')
+
+
+def show(units, properties):
+    states = load_states()
+    blocks = []
+    for unit in units:
+        state = states.get(unit)
+        values = {
+            'Id': unit_id(unit),
+            'LoadState': 'loaded' if state is not None else 'not-found',
+            'ActiveState': (state or {}).get('ActiveState', 'inactive'),
+            'SubState': (state or {}).get('SubState', 'dead'),
+            'MainPID': str((state or {}).get('MainPID', 0)),
+            'StateChangeTimestamp': (state or {}).get('StateChangeTimestamp', ''),
+            'ActiveEnterTimestamp': '',
+            'InactiveEnterTimestamp': '',
+        }
+        blocks.append('\n'.join(f"{key}={values.get(key, '')}" for key in properties))
+    print('\n\n'.join(blocks))
+
+
+def action(name, units):
+    states = load_states()
+    fail = os.environ.get('FAKE_SYSTEMCTL_FAIL_RESTART') == '1'
+    failed = []
+    for unit in units:
+        if name in ('start', 'restart') and (states.get(unit) or {}).get('FailRestart'):
+            states[unit] = {'ActiveState': 'failed', 'SubState': 'failed', 'FailRestart': True}
+            failed.append(unit)
+        elif name == 'kill' or fail:
+            states[unit] = {'ActiveState': 'failed', 'SubState': 'failed'}
+            if name in ('start', 'restart'):
+                failed.append(unit)
+        elif name == 'stop':
+            states[unit] = {'ActiveState': 'inactive', 'SubState': 'dead'}
+        else:
+            states[unit] = {'ActiveState': 'active', 'SubState': 'running', 'MainPID': 4242}
+    save_states(states)
+    for unit in units:
+        journal(unit, f"{unit_id(unit)}: {states[unit]['ActiveState']}")
+    for unit in failed:
+        print(f"Job for {unit_id(unit)} failed because the control process exited with error code.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv):
+    args = [arg for arg in argv if arg not in ('--no-pager', '--')]
+    properties = ['Id', 'ActiveState', 'SubState']
+    for arg in list(args):
+        if arg.startswith('--property='):
+            properties = arg.split('=', 1)[1].split(',')
+            args.remove(arg)
+    if not args:
+        return 1
+    time.sleep(float(os.environ.get('FAKE_SYSTEMCTL_LATENCY') or 0))
+    command, units = args[0], args[1:]
+    if command == 'show':
+        show(units, properties)
+    elif command in ('start', 'stop', 'restart', 'kill'):
+        return action(command, units)
+    else:
+        print(f"fake_systemctl: unsupported command {command}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,7 +1,6 @@
 import telebot
 from telebot import types
 import logging
-from logging.handlers import TimedRotatingFileHandler
 import time
 from dotenv import load_dotenv
 import os
@@ -9,7 +8,26 @@ import subprocess
 from glob import glob
 import html
 import textwrap
-import json
+from datetime import datetime
+import shutil
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linux_common import host_metrics
+from linux_common.config import ConfigFile, parse_paths, parse_servers
+from linux_common.docker_api import DockerClient, DockerError
+from linux_common.fleet import FleetAggregator, format_agent, format_fleet, start_fleet_server
+from linux_common.logs import setup_logging
+from linux_common.notifier import Notifier
+from linux_common.metrics import Registry, add_process_metrics, instrument_telebot, start_metrics_server
+from linux_common.processes import container_names, format_top, sample_processes
+from linux_common.probes import format_latencies, load_latencies
+from linux_common.profiling import Profiler, format_timings, load_timings, request_profile
+from linux_common.routing import Router
+from linux_common.state_store import StateStore
+from linux_common.timeseries import TimeSeriesStore
+from linux_common.systemd_units import format_unit_state, query_units
 
 # ENV VARIABLES
 # Load environment variables from .env
@@ -22,29 +40,72 @@ ALLOWED_USERS = [CHAT_ID_PERSON1]
 wol_address = os.environ.get('WOL_ADDRESS')
 wol_hostname = os.environ.get('WOL_HOSTNAME')
 
+# Served on http://127.0.0.1:BOT_METRICS_PORT/metrics when BOT_METRICS_PORT is set
+BOT_METRICS_PORT = int(os.environ.get('BOT_METRICS_PORT') or 0)
+
+# With FLEET_PORT set the bot receives the state and alerts of the monitoring agents of other
+# hosts (FLEET_URL there) on FLEET_HOST:FLEET_PORT. Agents have to send FLEET_TOKEN.
+FLEET_PORT = int(os.environ.get('FLEET_PORT') or 0)
+FLEET_HOST = os.environ.get('FLEET_HOST', '0.0.0.0')
+FLEET_TOKEN = os.environ.get('FLEET_TOKEN')
+
 # LOGGING
 log_directory = './logs/'
 log_file_path = os.path.join(log_directory, 'linux_bot.log')
-server_states_json = "../linux_monitoring/server_states.json"
+state_store_path = "../linux_monitoring/state.db"
+metrics_store_path = "../linux_monitoring/metrics.tsdb"
+perf_snapshot_path = "../linux_monitoring/perf.json"
+latency_snapshot_path = "../linux_monitoring/latency.json"
+profile_request_path = "../linux_monitoring/profile_request"
+profile_dump_path = "../linux_monitoring/profile.txt"
+
+# One writer thread writes the log as JSON lines, see linux_common/logs.py. LOG_LEVEL is the
+# default level, LOG_LEVELS sets it per component (like "bot=DEBUG,telebot=WARNING"), and
+# LOG_CONSOLE=true writes the log to stdout as well.
+log_handler = setup_logging(log_file_path, os.environ.get('LOG_LEVEL', 'INFO'), os.environ.get('LOG_LEVELS', ''),
+                            console=os.environ.get('LOG_CONSOLE', 'false').lower() == 'true',
+                            debug_per_minute=int(os.environ.get('LOG_DEBUG_PER_MINUTE', 10)))
+logger = logging.getLogger('bot')
+
+if os.environ.get('TELEGRAM_API_URL'):
+    # For example a local Bot API server, see fakes/fake_bot_api.py
+    telebot.apihelper.API_URL = os.environ.get('TELEGRAM_API_URL')
+bot = telebot.TeleBot(SECRET_TOKEN, parse_mode="HTML")
 
-# Ensure the log directory exists
-os.makedirs(log_directory, exist_ok=True)
+# Finds the handler of a text message, see linux_common/routing.py
+router = Router(ALLOWED_USERS)
 
-# Use TimedRotatingFileHandler to create a new log file every day
-handler = TimedRotatingFileHandler(log_file_path, when="midnight", interval=1, backupCount=7)
-handler.suffix = "%Y-%m-%d.log"  # Add a suffix with the date format
+# State shared with the monitoring, like whether a server is online
+state_store = StateStore(state_store_path)
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
+# Docker Engine API client, talks to /var/run/docker.sock
+docker_client = DockerClient()
 
-# Set the logging level
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+# METRICS
+metrics_registry = Registry()
+if BOT_METRICS_PORT:
+    add_process_metrics(metrics_registry)
+    instrument_telebot(metrics_registry)
 
-# Add the handler to the logger
-logger.addHandler(handler)
+# Timings of the message handlers, for /perf
+profiler = Profiler()
 
-bot = telebot.TeleBot(SECRET_TOKEN, parse_mode="HTML")
+# FLEET
+# Function to deliver an alert of an agent to Telegram, raises when it fails so the notifier can retry
+def deliver_fleet_alert(message, parse_mode=None):
+    bot.send_message(CHAT_ID_PERSON1, message, parse_mode=parse_mode)
+
+# Function to forward an alert of an agent, with the name of its host
+def forward_fleet_alert(agent_name, message, parse_mode=None):
+    if parse_mode == 'HTML':
+        fleet_notifier.submit(f"🖥 <b>{html.escape(agent_name)}</b>\n{message}", 'HTML')
+    else:
+        fleet_notifier.submit(f"🖥 {agent_name}\n{message}", parse_mode)
+
+fleet_aggregator = None
+if FLEET_PORT:
+    fleet_notifier = Notifier(deliver_fleet_alert, 'fleet_spool')
+    fleet_aggregator = FleetAggregator(FLEET_TOKEN, forward_fleet_alert)
 
 # Variables
 commands_telegram = """
@@ -69,6 +130,22 @@ commands_telegram = """
 <b>System info - Get system info</b>
 /sysinfo
 
+<b>History - Get the measurements of the monitoring</b>
+/history
+
+<b>Top - Get the processes that use the most CPU or memory</b>
+/top
+/top mem - Sorted by memory
+
+<b>Fleet - Get the state of the hosts that report to this bot</b>
+/fleet
+/fleet host - Get everything a host reported
+
+<b>Perf - Get the slowest handlers and checks</b>
+/perf
+/perf bot 20 - Profile the next 20 messages
+/perf monitoring 5 - Profile the next 5 checks
+
 <b>Start - Start the bot</b>
 /start
 
@@ -76,20 +153,15 @@ commands_telegram = """
 /reboot
 """
 
-# Read service and container lists from files
-with open('bot_services.txt', 'r') as services_file:
-    services_list = services_file.read().splitlines()
+# Service, log file and server lists, read again when a file changes
+services_config = ConfigFile('bot_services.txt')
+log_files_config = ConfigFile('bot_logfiles.txt', parse_paths)
+servers_config = ConfigFile('bot_servers.txt', parse_servers)
 
-with open('bot_logfiles.txt', 'r') as log_files_file:
-    log_files = log_files_file.read().splitlines()
-    
-with open('bot_servers.txt', 'r') as servers_file:
-    servers_list = servers_file.read().splitlines()
 
-
-@bot.message_handler(commands=['start'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('start')
 def send_start(message):
-    logging.info(f"User {message.from_user.first_name} started the bot")
+    logger.info(f"User {message.from_user.first_name} started the bot")
     global commands_telegram
     welcome_message = f"""Hey {message.from_user.first_name}, I'm a Linux Bot.
 
@@ -102,7 +174,7 @@ These are the commands I listen to:
 
 
 # MENUS
-@bot.message_handler(commands=['menu'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('menu')
 def send_handle_menu(message):
     markup_menu = types.ReplyKeyboardMarkup(
         row_width=4, one_time_keyboard=True)
@@ -114,21 +186,22 @@ def send_handle_menu(message):
     button_sendcommand = types.InlineKeyboardButton("📤 Send command")
     button_checkservers = types.InlineKeyboardButton("🔔 Check servers")
     button_systeminfo = types.InlineKeyboardButton("📃 System info")
+    button_history = types.InlineKeyboardButton("📈 History")
     button_reboot = types.InlineKeyboardButton("🔁 Reboot")
 
-    markup_menu.add(button_services, button_docker, button_logs, button_sendcommand, button_checkservers, button_systeminfo, button_reboot)
+    markup_menu.add(button_services, button_docker, button_logs, button_sendcommand, button_checkservers, button_systeminfo, button_history, button_reboot)
     option_selection_text = "Choose one of the following options:"
 
     bot.send_message(message.chat.id, option_selection_text,
                      reply_markup=markup_menu)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🔙 Go back to main")
+@router.exact("🔙 Go back to main")
 def handle_go_back(message):
     send_handle_menu(message)
 
 # SEND CUSTOM COMMAND
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "📤 Send command")
+@router.exact("📤 Send command")
 # Reply that the next message will be sent as a command to the server
 def handle_send_command(message):
     bot.reply_to(
@@ -137,9 +210,9 @@ def handle_send_command(message):
 
 
 def handle_command(message):
-    logging.info(f"User {message.from_user.first_name} sent a command: {message.text}")
+    logger.info(f"User {message.from_user.first_name} sent a command: {message.text}")
     command = message.text
-    logging.debug(f"Sending command: {command}")
+    logger.debug(f"Sending command: {command}")
     bot.reply_to(message, f"Sending command: {command}")
     
     if command.lower() == "/cancel" or command.lower() == "cancel":
@@ -165,7 +238,7 @@ def handle_command(message):
         chunks = [textwrap.dedent('\n'.join(lines[i:i+10]))
                   for i in range(0, len(lines), 10)]
         
-        logging.debug(f"Command output: {command_stdout_escaped}")
+        logger.debug(f"Command output: {command_stdout_escaped}")
 
         # If the output is empty, send a message indicating that
         if not chunks:
@@ -177,92 +250,221 @@ def handle_command(message):
 
         handle_send_command(message)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Sending command failed. Error: {e}")
+        logger.error(f"Sending command failed. Error: {e}")
         bot.reply_to(message, f"Sending command failed. Error: {e}")
 
 
-@bot.message_handler(commands=['command'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('command')
 def send_handle_command(message):
     handle_send_command(message)
 
 # SYSTEM INFO
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "📃 System info")
+# Function to count the available package updates
+def count_available_updates():
+    if shutil.which('apt'):
+        command = "apt list --upgradable 2>/dev/null | grep -c '/'"
+    elif shutil.which('yum'):
+        command = "yum list updates 2>/dev/null | grep -c '\\.'"
+    else:
+        return "Unsupported package manager"
+    return subprocess.run(f"sudo {command}", shell=True, capture_output=True, text=True).stdout.strip()
+
+
+@router.exact("📃 System info")
 def handle_system_info(message):
-    logging.info(f"User {message.from_user.first_name} requested the system info")
+    logger.info(f"User {message.from_user.first_name} requested the system info")
     bot.reply_to(message, "Getting system info.")
-    command = """
-    echo "CPU Usage:"
-    top -b -n 1 | awk '/^%Cpu/ {print "Usage: " 100 - $8 "%"}'
-    
-    echo "\nMemory Usage:"
-    free -m | awk '/^Mem/ {print "Total: " $2 "MB\tUsed: " $3 "MB\tFree: " $4 "MB\tCache: " $6 "MB"}'
 
-    echo "\nLargest Disk Usage (Quantity and Percentage):"
-    df -h | grep '/dev/' | sort -rh -k4 | head -n 1 | awk '{print "Quantity: " $3 "\tPercentage: " $5}'
+    reply_message = "<b>System info:</b>\n"
+    try:
+        # Swap activity is counted over the same half second as the CPU usage
+        vmstat_before = host_metrics.read_vmstat()
+        vmstat_read_at = time.monotonic()
+        cpu_usage = host_metrics.cpu_usage()
+        vmstat = host_metrics.read_vmstat()
+        vmstat_seconds = time.monotonic() - vmstat_read_at
+        memory = host_metrics.read_memory()
+        pressures = host_metrics.read_pressures()
+        disks = host_metrics.mounted_disk_usage()
+        load = host_metrics.read_loadavg()
+        uptime = host_metrics.format_uptime(host_metrics.read_uptime())
+
+        reply_message += f"CPU Usage:\nUsage: {cpu_usage}%\n"
+        reply_message += f"\nMemory Usage:\nTotal: {memory.total_mb}MB\tUsed: {memory.used_mb}MB\tFree: {memory.free_mb}MB\tCache: {memory.cache_mb}MB\tAvailable: {memory.available_mb}MB\n"
+        swap_in, swap_out = ((vmstat[counter] - vmstat_before[counter]) / vmstat_seconds for counter in ('pswpin', 'pswpout'))
+        reply_message += (f"Swap: {memory.swap_used_mb}MB of {memory.swap_total_mb}MB\tPages in: {swap_in:.0f}/s\tOut: {swap_out:.0f}/s\t"
+                          f"OOM kills since boot: {vmstat['oom_kill']}\n")
+        if pressures:
+            reply_message += f"\nPressure (% of time stalled, 10s/60s/5m):\n{host_metrics.format_pressures(pressures)}\n"
+        if disks:
+            reply_message += "\nDisk Usage (Used, Size, Percentage, Inodes):\n"
+            for disk in disks:
+                inodes = f"{disk.inodes_percent}%" if disk.inodes_percent is not None else "-"
+                reply_message += (f"{html.escape(disk.mount)}: {host_metrics.format_bytes(disk.used_bytes)} of "
+                                  f"{host_metrics.format_bytes(disk.total_bytes)}\t{disk.percent}%\tInodes: {inodes}\n")
+        reply_message += f"\nAvailable Updates:\n{html.escape(count_available_updates())}\n"
+        reply_message += f"\nSystem Uptime:\n{uptime}, load average: {load.load1:.2f}, {load.load5:.2f}, {load.load15:.2f}"
+
+        logger.debug(f"System info: {reply_message}")
+        bot.send_message(message.chat.id, reply_message)
+
+        send_handle_menu(message)
+    except OSError as e:
+        logger.error(f"Getting system info failed. Error: {e}")
+        bot.reply_to(message, f"Getting system info failed. Error: {e}")
+        # Go back to the main menu
+        send_handle_menu(message)
 
-    echo "\nAvailable Updates:"
-    if command -v apt &> /dev/null; then
-      sudo apt list --upgradable 2>/dev/null | grep -c '/'
-    elif command -v yum &> /dev/null; then
-      sudo yum list updates 2>/dev/null | grep -c '\\.'
-    else
-      echo "Unsupported package manager"
-    fi
+@router.command('sysinfo')
+def send_handle_system_info(message):
+    handle_system_info(message)
 
-    echo "\nSystem Uptime:"
-    uptime
-    """
+# HISTORY
+# Function to format a value of a metric, None when there is no data
+def format_metric(sample, attribute):
+    if sample is None:
+        return "-"
+    return f"{getattr(sample, attribute):.1f}"
 
 
-    logging.debug(f"Sending command: {command}")
-    reply_message = "<b>System info:</b>\n"
+@router.exact("📈 History")
+def handle_history(message):
+    logger.info(f"User {message.from_user.first_name} requested the history")
     try:
-        command_output = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True
-        )
+        metrics_store = TimeSeriesStore(metrics_store_path, readonly=True)
+    except (OSError, ValueError) as e:
+        logger.error(f"Opening the metrics store failed. Error: {e}")
+        bot.reply_to(message, "No history yet. Is the monitoring running?")
+        send_handle_menu(message)
+        return
 
-        # Extract the stdout attribute
-        command_stdout = command_output.stdout
+    # Read straight from the store of the monitoring, nothing is measured again
+    lines = [f"{'metric':<28} {'last':>7} {'1h avg':>7} {'24h avg':>7} {'24h max':>7} {'30d max':>7}"]
+    for name in metrics_store.metrics():
+        lines.append(f"{name[:28]:<28} {format_metric(metrics_store.latest(name), 'avg'):>7} "
+                     f"{format_metric(metrics_store.summary(name, 3600), 'avg'):>7} "
+                     f"{format_metric(metrics_store.summary(name, 86400), 'avg'):>7} "
+                     f"{format_metric(metrics_store.summary(name, 86400), 'max'):>7} "
+                     f"{format_metric(metrics_store.summary(name, 30 * 86400), 'max'):>7}")
+    metrics_store.close()
+
+    history_table = html.escape('\n'.join(lines))
+    bot.send_message(message.chat.id, f"<b>History:</b>\n<pre>{history_table}</pre>")
+    send_handle_menu(message)
 
-        # Escape the text to prevent Telegram from interpreting it as entities
-        command_stdout_escaped = html.escape(command_stdout)
+@router.command('history')
+def send_handle_history(message):
+    handle_history(message)
 
-        # Split the output into chunks of 10 lines
-        lines = command_stdout_escaped.split('\n')
-        chunks = [textwrap.dedent('\n'.join(lines[i:i+10]))
-                  for i in range(0, len(lines), 10)]
-        
-        logging.debug(f"Command output: {command_stdout_escaped}")
+# TOP
+@router.command('top')
+def handle_top(message):
+    logger.info(f"User {message.from_user.first_name} requested the top processes: {message.text}")
+    arguments = message.text.split()[1:]
+    by = 'rss' if arguments and arguments[0] in ('mem', 'memory', 'rss') else 'cpu'
+    try:
+        names = container_names(docker_client)
+    except (DockerError, OSError) as e:
+        logger.error(f"Getting the container names failed. Error: {e}")
+        names = {}
+    try:
+        usages = sample_processes(window=1)
+    except OSError as e:
+        logger.error(f"Reading the processes failed. Error: {e}")
+        bot.reply_to(message, f"Reading the processes failed. Error: {e}")
+        return
 
-        # If the output is empty, send a message indicating that
-        if not chunks:
-            bot.send_message(message.chat.id, "The command output is empty.")
+    # CPU is measured over the last second, in percent of one core
+    top_table = html.escape(format_top(usages, 10, by, names))
+    bot.send_message(message.chat.id, f"<b>Top processes by {'memory' if by == 'rss' else 'CPU'}:</b>\n<pre>{top_table}</pre>")
+
+# FLEET
+@router.command('fleet')
+def handle_fleet(message):
+    logger.info(f"User {message.from_user.first_name} requested the fleet: {message.text}")
+    if fleet_aggregator is None:
+        bot.reply_to(message, "This bot is not a fleet aggregator. Set FLEET_PORT and FLEET_TOKEN to receive the monitoring of other hosts.")
+        return
+    agents = fleet_aggregator.snapshot()
+    if not agents:
+        bot.reply_to(message, "No agent has reported yet.")
+        return
+
+    arguments = message.text.split()[1:]
+    if arguments:
+        agent = next((agent for agent in agents if agent.name == arguments[0]), None)
+        if agent is None:
+            bot.reply_to(message, f"Unknown host {html.escape(arguments[0])}.")
+            return
+        # Long states are cut to fit in one message
+        agent_state = html.escape(format_agent(agent))[:3800]
+        bot.send_message(message.chat.id, f"<b>{html.escape(agent.name)}:</b>\n<pre>{agent_state}</pre>")
+        return
+
+    # srv, svc and ctr are the servers, services and containers that are not up, ! marks a host that stopped reporting
+    fleet_table = html.escape(format_fleet(agents, fleet_aggregator))
+    bot.send_message(message.chat.id, f"<b>Fleet ({len(agents)} hosts):</b>\n<pre>{fleet_table}</pre>\nSend /fleet &lt;host&gt; for the details of a host.")
+
+# PERF
+# Function to send a profile as a text document
+def send_profile(chat_id, profile_text, name):
+    profile_path = os.path.join(log_directory, f"profile-{name}.txt")
+    with open(profile_path, 'w') as profile_file:
+        profile_file.write(profile_text)
+    with open(profile_path, 'rb') as profile_file:
+        bot.send_document(chat_id, profile_file)
+    os.remove(profile_path)
+
+# Function to wait until the monitoring wrote the profile that was asked for, runs in its own thread
+def wait_for_monitoring_profile(chat_id, requested_at, timeout=1800):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.path.getmtime(profile_dump_path) >= requested_at:
+                with open(profile_dump_path, 'r') as profile_file:
+                    send_profile(chat_id, profile_file.read(), 'monitoring')
+                return
+        except FileNotFoundError:
+            pass
+        time.sleep(5)
+    bot.send_message(chat_id, "The monitoring did not send a profile. Is it running?")
+
+@router.command('perf')
+def handle_perf(message):
+    logger.info(f"User {message.from_user.first_name} requested the performance: {message.text}")
+    arguments = message.text.split()[1:]
+    runs = int(arguments[1]) if len(arguments) > 1 and arguments[1].isdigit() else 10
+
+    if arguments and arguments[0] == 'bot':
+        if profiler.start_profile(runs, lambda profile_text: send_profile(message.chat.id, profile_text, 'bot')):
+            bot.reply_to(message, f"Profiling the next {runs} messages.")
         else:
-            # Concatenate all chunks into one message
-            full_output = '\n'.join(chunks)
-            # Remove the line with "/usr/bin/apt"
-            full_output = '\n'.join(line for line in full_output.split('\n') if "/usr/bin/apt" not in line)
-            reply_message += full_output
-            
-            bot.send_message(message.chat.id, reply_message)
+            bot.reply_to(message, "A profile of the bot is already being taken.")
+        return
 
-        send_handle_menu(message)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Sending command system info failed. Error: {e}")
-        print(f"Sending command system info failed. Error: {e}")	
-        bot.reply_to(message, f"Sending command system info failed. Error: {e}")
-        # Go back to the main menu
-        send_handle_menu(message)
+    if arguments and arguments[0] == 'monitoring':
+        try:
+            request_profile(profile_request_path, runs)
+        except OSError as e:
+            bot.reply_to(message, f"Could not ask the monitoring for a profile. Error: {e}")
+            return
+        bot.reply_to(message, f"Profiling the next {runs} checks of the monitoring, I will send it when it is done.")
+        threading.Thread(target=wait_for_monitoring_profile, args=(message.chat.id, time.time()), daemon=True).start()
+        return
 
-@bot.message_handler(commands=['sysinfo'], func=lambda message: message.chat.id in ALLOWED_USERS)
-def send_handle_system_info(message):
-    handle_system_info(message)
+    # Durations are in milliseconds, slowest first
+    perf_message = f"<b>Bot handlers (ms):</b>\n<pre>{html.escape(format_timings(profiler.timings()))}</pre>"
+    try:
+        monitoring_timings, saved = load_timings(perf_snapshot_path)
+        saved_at = datetime.fromtimestamp(saved).strftime('%H:%M:%S')
+        perf_message += f"\n<b>Monitoring checks (ms), saved at {saved_at}:</b>\n<pre>{html.escape(format_timings(monitoring_timings))}</pre>"
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"Reading the timings of the monitoring failed. Error: {e}")
+        perf_message += "\nNo timings of the monitoring yet. Is it running?"
+    bot.send_message(message.chat.id, perf_message)
 
 # REBOOT
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🔁 Reboot")
+@router.exact("🔁 Reboot")
 def handle_reboot_menu(message):
     markup_reboot = types.ReplyKeyboardMarkup(
         row_width=2, one_time_keyboard=True)
@@ -277,30 +479,29 @@ def handle_reboot_menu(message):
                      reply_markup=markup_reboot)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🔁 Reboot now")
+@router.exact("🔁 Reboot now")
 def handle_reboot_now(message):
-    logging.info(f"User {message.from_user.first_name} requested a reboot")
+    logger.info(f"User {message.from_user.first_name} requested a reboot")
     bot.reply_to(message, "Rebooting the server.")
     try:
-        logging.info(f"Rebooting the server.")
+        logger.info(f"Rebooting the server.")
         subprocess.run(f"sudo reboot now", shell=True, check=True)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Rebooting failed. Error: {e}")
-        print(f"Rebooting failed. Error: {e}")
+        logger.error(f"Rebooting failed. Error: {e}")
         bot.reply_to(message, f"Rebooting failed. Error: {e}")
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "❌ Cancel reboot")
+@router.exact("❌ Cancel reboot")
 def handle_cancel_reboot(message):
-    logging.info(f"User {message.from_user.first_name} canceled the reboot")
+    logger.info(f"User {message.from_user.first_name} canceled the reboot")
     bot.reply_to(message, "Reboot canceled.")
 
 
-@bot.message_handler(commands=['reboot'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('reboot')
 def send_handle_reboot(message):
     handle_reboot_menu(message)
 
 # WAKE up a device on the wake on lan
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "💻 Wake up WoL")
+@router.exact("💻 Wake up WoL")
 def handle_wakewol_menu(message):
     markup_wakewol = types.ReplyKeyboardMarkup(
         row_width=2, one_time_keyboard=True)
@@ -316,38 +517,37 @@ def handle_wakewol_menu(message):
                      reply_markup=markup_wakewol)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "💻 Wake up")
+@router.exact("💻 Wake up")
 def handle_wakewol_now(message):
-    logging.info(f"User {message.from_user.first_name} requested a wake up")
+    logger.info(f"User {message.from_user.first_name} requested a wake up")
     bot.reply_to(message, f"Waking up {wol_hostname}.")
     command = f"sudo etherwake -i eth0 {wol_address}"
     try:
-        logging.info(f"Waking up {wol_hostname}.")
-        logging.info(f"Command: {command}")
+        logger.info(f"Waking up {wol_hostname}.")
+        logger.info(f"Command: {command}")
         subprocess.run(command,
                        shell=True, text=True)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Waking up failed. Error: {e}")
-        print(f"Waking up failed. Error: {e}")
+        logger.error(f"Waking up failed. Error: {e}")
         bot.reply_to(message, f"Waking up failed. Error: {e}")
     
     send_handle_menu(message)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "❌ Cancel wake up")
+@router.exact("❌ Cancel wake up")
 def handle_cancel_wakewol(message):
-    logging.info(f"User {message.from_user.first_name} canceled the wake up")
+    logger.info(f"User {message.from_user.first_name} canceled the wake up")
     bot.reply_to(message, "Wake up canceled.")
     send_handle_menu(message)
 
 
-@bot.message_handler(commands=['wakewol'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('wakewol')
 def send_handle_wakewol(message):
     handle_wakewol_menu(message)
 
 
 # SERVICES
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "📦 Services")
+@router.exact("📦 Services")
 def handle_services_menu(message):
     markup_services_menu = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
@@ -369,29 +569,30 @@ def handle_services_menu(message):
                      reply_markup=markup_services_menu)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🔙 Go back to services"))
+@router.prefix("🔙 Go back to services")
 def handle_service_go_back(message):
     handle_services_menu(message)
 
 
-@bot.message_handler(commands=['services'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('services')
 def send_handle_servicescommand(message):
     handle_services_menu(message)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟫 Get status services")
+@router.exact("🟫 Get status services")
 def handle_getstatusservices(message):
-    logging.info(f"User {message.from_user.first_name} requested service status")
+    logger.info(f"User {message.from_user.first_name} requested service status")
     service_status_message = "<b>Status services:</b>"
 
-    for service in services_list:
-        try:
-            service_status = subprocess.run(f'systemctl status {service} | grep "Active:" | awk \'{{print "{service}:", $2, $3}}\'', shell=True, capture_output=True, text=True)
-            service_status_message += f"\n{service_status.stdout}"
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Get status services failed. Error: {e}")
-            print(f"Get status services failed. Error: {e}")
-            service_status_message += f"\nError: {e}"
+    try:
+        # One systemctl call for all services
+        services_list = services_config.get()
+        unit_states = query_units(services_list)
+        for service in services_list:
+            service_status_message += f"\n{html.escape(format_unit_state(unit_states[service]))}"
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Get status services failed. Error: {e}")
+        service_status_message += f"\nError: {html.escape(str(e))}"
 
     bot.send_message(message.chat.id, service_status_message, parse_mode="HTML")
 
@@ -399,13 +600,13 @@ def handle_getstatusservices(message):
     handle_services_menu(message)
 
 # Start a service
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟩 Start a service")
+@router.exact("🟩 Start a service")
 def handle_startservice_menu(message):
     markup_startservice = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
     # Add buttons
     button_counter = 1
-    for service in services_list:
+    for service in services_config.get():
         button = types.InlineKeyboardButton(f"⏯ Start service: {service}")
         markup_startservice.add(button)
         button_counter += 1
@@ -418,17 +619,16 @@ def handle_startservice_menu(message):
                      reply_markup=markup_startservice)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("⏯ Start service:"))
+@router.prefix("⏯ Start service:")
 def handle_startservice_now(message):
     service = message.text.split(": ")[1]
-    logging.info(f"User {message.from_user.first_name} requested service start: {service}")
+    logger.info(f"User {message.from_user.first_name} requested service start: {service}")
     bot.reply_to(message, f"Starting {service}.")
     try:
-        logging.info(f"Starting {service}.")
+        logger.info(f"Starting {service}.")
         subprocess.run(f"sudo systemctl start {service}", shell=True, text=True)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Starting {service} failed. Error: {e}")
-        print(f"Starting {service} failed. Error: {e}")
+        logger.error(f"Starting {service} failed. Error: {e}")
         bot.reply_to(message, f"Starting {service} failed. Error: {e}")
 
     # Get all statusses
@@ -436,13 +636,13 @@ def handle_startservice_now(message):
 
 
 # Restart a service
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟨 Restart a service")
+@router.exact("🟨 Restart a service")
 def handle_restartservice_menu(message):
     markup_restartservice = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
     # Add buttons
     button_counter = 1
-    for service in services_list:
+    for service in services_config.get():
         button = types.InlineKeyboardButton(f"🔁 Restart service: {service}")
         markup_restartservice.add(button)
         button_counter += 1
@@ -456,17 +656,16 @@ def handle_restartservice_menu(message):
                      reply_markup=markup_restartservice)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🔁 Restart service:"))
+@router.prefix("🔁 Restart service:")
 def handle_restartservice_now(message):
     service = message.text.split(": ")[1]
-    logging.info(f"User {message.from_user.first_name} requested service restart: {service}")
+    logger.info(f"User {message.from_user.first_name} requested service restart: {service}")
     bot.reply_to(message, f"Restarting {service}.")
     try:
-        logging.info(f"Restarting {service}.")
+        logger.info(f"Restarting {service}.")
         subprocess.run(f"sudo systemctl restart {service}", shell=True, text=True)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Restarting {service} failed. Error: {e}")
-        print(f"Restarting {service} failed. Error: {e}")
+        logger.error(f"Restarting {service} failed. Error: {e}")
         bot.reply_to(message, f"Restarting {service} failed. Error: {e}")
 
     # Get all statusses
@@ -475,13 +674,13 @@ def handle_restartservice_now(message):
 # Stop a service
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟥 Stop a service")
+@router.exact("🟥 Stop a service")
 def handle_stopservice_menu(message):
     markup_stopservice = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
     # Add buttons
     button_counter = 1
-    for service in services_list:
+    for service in services_config.get():
         button = types.InlineKeyboardButton(f"⛔ Stop service: {service}")
         markup_stopservice.add(button)
         button_counter += 1
@@ -494,17 +693,16 @@ def handle_stopservice_menu(message):
                      reply_markup=markup_stopservice)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("⛔ Stop service:"))
+@router.prefix("⛔ Stop service:")
 def handle_stopservice_now(message):
     service = message.text.split(": ")[1]
-    logging.info(f"User {message.from_user.first_name} requested service stop: {service}")
+    logger.info(f"User {message.from_user.first_name} requested service stop: {service}")
     bot.reply_to(message, f"Stopping {service}.")
     try:
-        logging.info(f"Stopping {service}.")
+        logger.info(f"Stopping {service}.")
         subprocess.run(f"sudo systemctl stop {service}", shell=True, text=True)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Stopping {service} failed. Error: {e}")
-        print(f"Stopping {service} failed. Error: {e}")
+        logger.error(f"Stopping {service} failed. Error: {e}")
         bot.reply_to(message, f"Stopping {service} failed. Error: {e}")
 
     # Get all statusses
@@ -513,17 +711,16 @@ def handle_stopservice_now(message):
 # Start all services
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟩🟩 Start all services")
+@router.exact("🟩🟩 Start all services")
 def handle_startallservices(message):
-    logging.info(f"User {message.from_user.first_name} requested service start all")
-    for service in services_list:
+    logger.info(f"User {message.from_user.first_name} requested service start all")
+    for service in services_config.get():
         bot.reply_to(message, f"Starting {service}.")
         try:
-            logging.info(f"Starting {service}.")
+            logger.info(f"Starting {service}.")
             subprocess.run(f"sudo systemctl start {service}", shell=True, text=True)
         except subprocess.CalledProcessError as e:
-            logging.error(f"Starting {service} failed. Error: {e}")
-            print(f"Starting {service} failed. Error: {e}")
+            logger.error(f"Starting {service} failed. Error: {e}")
             bot.reply_to(message, f"Starting {service} failed. Error: {e}")
 
     # Get statusses
@@ -532,17 +729,16 @@ def handle_startallservices(message):
 # Restart all services
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟨🟨 Restart all services")
+@router.exact("🟨🟨 Restart all services")
 def handle_restartallservices(message):
-    logging.info(f"User {message.from_user.first_name} requested service restart all")
-    for service in services_list:
+    logger.info(f"User {message.from_user.first_name} requested service restart all")
+    for service in services_config.get():
         bot.reply_to(message, f"Restarting {service}.")
         try:
-            logging.info(f"Restarting {service}.")
+            logger.info(f"Restarting {service}.")
             subprocess.run(f"sudo systemctl restart {service}", shell=True, text=True)
         except subprocess.CalledProcessError as e:
-            logging.error(f"Restarting {service} failed. Error: {e}")
-            print(f"Restarting {service} failed. Error: {e}")
+            logger.error(f"Restarting {service} failed. Error: {e}")
             bot.reply_to(message, f"Restarting {service} failed. Error: {e}")
 
     # Get statusses
@@ -551,17 +747,16 @@ def handle_restartallservices(message):
 # Stop all services
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟥🟥 Stop all services")
+@router.exact("🟥🟥 Stop all services")
 def handle_stopallservices(message):
-    logging.info(f"User {message.from_user.first_name} requested service stop all")
-    for service in services_list:
+    logger.info(f"User {message.from_user.first_name} requested service stop all")
+    for service in services_config.get():
         bot.reply_to(message, f"Stopping {service}.")
         try:
-            logging.info(f"Stopping {service}.")
+            logger.info(f"Stopping {service}.")
             subprocess.run(f"sudo systemctl stop {service}", shell=True, text=True)
         except subprocess.CalledProcessError as e:
-            logging.error(f"Stopping {service} failed. Error: {e}")
-            print(f"Stopping {service} failed. Error: {e}")
+            logger.error(f"Stopping {service} failed. Error: {e}")
             bot.reply_to(message, f"Stopping {service} failed. Error: {e}")
 
     # Get statusses
@@ -569,7 +764,7 @@ def handle_stopallservices(message):
 
 
 # DOCKER
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🐳   Docker")
+@router.exact("🐳   Docker")
 def handle_docker_menu(message):
     markup_docker_menu = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
@@ -592,41 +787,33 @@ def handle_docker_menu(message):
                      reply_markup=markup_docker_menu)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🔙 Go back to docker"))
+@router.prefix("🔙 Go back to docker")
 def handle_docker_go_back(message):
     handle_docker_menu(message)
 
 
-@bot.message_handler(commands=['docker'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('docker')
 def send_handle_dockercommand(message):
     handle_docker_menu(message)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟫 Get status containers")
+@router.exact("🟫 Get status containers")
 def handle_getdockerstatus(message):
-    logging.info(f"User {message.from_user.first_name} requested service get status")
+    logger.info(f"User {message.from_user.first_name} requested service get status")
     status_message = "<b>Status containers:</b>"
-    # Run the docker ps command, get the NAMES, CREATED, and STATUSES
     try:
-        docker_ps_output = subprocess.run(
-            'docker ps -a --format "Name: {{.Names}}\nCreated at: {{.CreatedAt}}\nStatus: {{.Status}}\n"',
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-
-        # Extract the stdout attribute
-        docker_ps_stdout = docker_ps_output.stdout
-
-        status_message += f"\n{docker_ps_stdout}"
+        # Get the names, creation times and statuses in one API request
+        containers = docker_client.list_containers()
+        for container in containers:
+            created_at = datetime.fromtimestamp(container.created).strftime('%Y-%m-%d %H:%M:%S') if container.created else 'unknown'
+            status_message += f"\nName: {html.escape(container.name)}\nCreated at: {created_at}\nStatus: {html.escape(container.status)}\n"
         
-        logging.info(f"Status message: {status_message}")
+        logger.debug("Sending the status of the containers.", extra={'containers': len(containers), 'bytes': len(status_message)})
 
         bot.send_message(message.chat.id, status_message, parse_mode="HTML")
 
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Get status containers failed. Error: {e}")
-        print(f"Get status containers failed. Error: {e}")
+    except (DockerError, OSError) as e:
+        logger.error(f"Get status containers failed. Error: {e}")
         bot.reply_to(
             message, f"Getting container statusses failed. Error: {e}")
 
@@ -634,10 +821,9 @@ def handle_getdockerstatus(message):
     handle_docker_menu(message)
 
 # Start a docker container
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🟩 Start a docker container"))
+@router.prefix("🟩 Start a docker container")
 def handle_startdockercontainer(message):
-    container_names = get_docker_names()
-    container_list = container_names.split('\n')[:-1]
+    container_list = get_docker_names()
 
     markup_startcontainer = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
@@ -656,27 +842,25 @@ def handle_startdockercontainer(message):
                      reply_markup=markup_startcontainer)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("⏯ Start container:"))
+@router.prefix("⏯ Start container:")
 def handle_startdockercontainer_now(message):
     container = message.text.split(": ")[1]
-    logging.info(f"User {message.from_user.first_name} requested docker start: {container}")
+    logger.info(f"User {message.from_user.first_name} requested docker start: {container}")
     bot.reply_to(message, f"Starting {container}.")
     try:
-        logging.info(f"Starting {container}.")
-        subprocess.run(f"sudo docker start {container}", shell=True, text=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Starting {container} failed. Error: {e}")
-        print(f"Starting {container} failed. Error: {e}")
+        logger.info(f"Starting {container}.")
+        docker_client.start(container)
+    except (DockerError, OSError) as e:
+        logger.error(f"Starting {container} failed. Error: {e}")
         bot.reply_to(message, f"Starting {container} failed. Error: {e}")
 
     # Get all statusses
     handle_getdockerstatus(message)
 
 # Restart a docker container
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🟨 Restart a docker container"))
+@router.prefix("🟨 Restart a docker container")
 def handle_restartdockercontainer(message):
-    container_names = get_docker_names()
-    container_list = container_names.split('\n')[:-1]
+    container_list = get_docker_names()
 
     markup_restartcontainer = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
@@ -696,17 +880,16 @@ def handle_restartdockercontainer(message):
                      reply_markup=markup_restartcontainer)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🔁 Restart container:"))
+@router.prefix("🔁 Restart container:")
 def handle_restartdockercontainer_now(message):
     container = message.text.split(": ")[1]
-    logging.info(f"User {message.from_user.first_name} requested docker restart: {container}")
+    logger.info(f"User {message.from_user.first_name} requested docker restart: {container}")
     bot.reply_to(message, f"Restarting {container}.")
     try:
-        logging.info(f"Restarting {container}.")
-        subprocess.run(f"sudo docker restart {container}", shell=True, text=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Restarting {container} failed. Error: {e}")
-        print(f"Restarting {container} failed. Error: {e}")
+        logger.info(f"Restarting {container}.")
+        docker_client.restart(container)
+    except (DockerError, OSError) as e:
+        logger.error(f"Restarting {container} failed. Error: {e}")
         bot.reply_to(message, f"Restarting {container} failed. Error: {e}")
 
     # Get all statusses
@@ -714,10 +897,9 @@ def handle_restartdockercontainer_now(message):
 
 
 # Stop a docker container
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🟥 Stop a docker container"))
+@router.prefix("🟥 Stop a docker container")
 def handle_stopdockercontainer(message):
-    container_names = get_docker_names()
-    container_list = container_names.split('\n')[:-1]
+    container_list = get_docker_names()
 
     markup_stopcontainer = types.ReplyKeyboardMarkup(
         row_width=3, one_time_keyboard=True)
@@ -736,17 +918,16 @@ def handle_stopdockercontainer(message):
                      reply_markup=markup_stopcontainer)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("⛔ Stop container:"))
+@router.prefix("⛔ Stop container:")
 def handle_stopcontainer_now(message):
     container = message.text.split(": ")[1]
-    logging.info(f"User {message.from_user.first_name} requested docker stop: {container}")
+    logger.info(f"User {message.from_user.first_name} requested docker stop: {container}")
     bot.reply_to(message, f"Stopping {container}.")
     try:
-        logging.info(f"Stopping {container}.")
-        subprocess.run(f"sudo docker stop {container}", shell=True, text=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Stopping {container} failed. Error: {e}")
-        print(f"Stopping {container} failed. Error: {e}")
+        logger.info(f"Stopping {container}.")
+        docker_client.stop(container)
+    except (DockerError, OSError) as e:
+        logger.error(f"Stopping {container} failed. Error: {e}")
         bot.reply_to(message, f"Stopping {container} failed. Error: {e}")
 
     # Get all statusses
@@ -755,61 +936,55 @@ def handle_stopcontainer_now(message):
 # Start all docker containers
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟩🟩 Start all docker containers")
+@router.exact("🟩🟩 Start all docker containers")
 def handle_startalldockercontainers(message):
-    logging.info(f"User {message.from_user.first_name} requested docker start all")
-    container_names = get_docker_names()
-    container_list = container_names.split('\n')[:-1]
+    logger.info(f"User {message.from_user.first_name} requested docker start all")
+    container_list = get_docker_names()
     
 
     for container in container_list:
         bot.reply_to(message, f"Starting {container}.")
         try:
-            logging.info(f"Starting {container}.")
-            subprocess.run(f"docker start {container}", shell=True, text=True)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Starting {container} failed. Error: {e}")
-            print(f"Starting {container} failed. Error: {e}")
+            logger.info(f"Starting {container}.")
+            docker_client.start(container)
+        except (DockerError, OSError) as e:
+            logger.error(f"Starting {container} failed. Error: {e}")
             bot.reply_to(message, f"Starting {container} failed. Error: {e}")
 
     # Get statusses
     handle_getdockerstatus(message)
 
 # Restart all docker containers
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟨🟨 Restart all docker containers")
+@router.exact("🟨🟨 Restart all docker containers")
 def handle_restartalldockercontainers(message):
-    logging.info(f"User {message.from_user.first_name} requested docker restart all")
-    container_names = get_docker_names()
-    container_list = container_names.split('\n')[:-1]
+    logger.info(f"User {message.from_user.first_name} requested docker restart all")
+    container_list = get_docker_names()
 
     for container in container_list:
         bot.reply_to(message, f"Restarting {container}.")
         try:
-            logging.info(f"Restarting {container}.")
-            subprocess.run(f"docker restart {container}", shell=True, text=True)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Restarting {container} failed. Error: {e}")
-            print(f"Restarting {container} failed. Error: {e}")
+            logger.info(f"Restarting {container}.")
+            docker_client.restart(container)
+        except (DockerError, OSError) as e:
+            logger.error(f"Restarting {container} failed. Error: {e}")
             bot.reply_to(message, f"Restarting {container} failed. Error: {e}")
 
     # Get statusses
     handle_getdockerstatus(message)
 
 # Stop all docker containers
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🟥🟥 Stop all docker containers")
+@router.exact("🟥🟥 Stop all docker containers")
 def handle_stopalldockercontainers(message):
-    logging.info(f"User {message.from_user.first_name} requested docker stop all")
-    container_names = get_docker_names()
-    container_list = container_names.split('\n')[:-1]
+    logger.info(f"User {message.from_user.first_name} requested docker stop all")
+    container_list = get_docker_names()
 
     for container in container_list:
         bot.reply_to(message, f"Stopping {container}.")
         try:
-            logging.info(f"Stopping {container}.")
-            subprocess.run(f"docker stop {container}", shell=True, text=True)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Stopping {container} failed. Error: {e}")
-            print(f"Stopping {container} failed. Error: {e}")
+            logger.info(f"Stopping {container}.")
+            docker_client.stop(container)
+        except (DockerError, OSError) as e:
+            logger.error(f"Stopping {container} failed. Error: {e}")
             bot.reply_to(message, f"Stopping {container} failed. Error: {e}")
 
     time.sleep(1)
@@ -818,39 +993,26 @@ def handle_stopalldockercontainers(message):
 
 
 def get_docker_names():
-    logging.info(f"Getting container names")
-    # Run the docker ps command, get the NAMES, CREATED, and STATUSES
+    logger.info(f"Getting container names")
     try:
-        docker_ps_output = subprocess.run(
-            'docker ps -a --format {{.Names}}',
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-
-        # Extract the stdout attribute
-        docker_ps_stdout = docker_ps_output.stdout
-
-        names = f"{docker_ps_stdout}"
+        names = [container.name for container in docker_client.list_containers()]
         
-        logging.info(f"Container names: {names}")
+        logger.info(f"Container names: {names}")
         return names
 
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Getting container names failed. Error: {e}")
-        print(f"Getting container names failed. Error: {e}")
-        bot.send_message(f"Getting container names failed. Error: {e}")
+    except (DockerError, OSError) as e:
+        logger.error(f"Getting container names failed. Error: {e}")
         return []
 
 # LOGS
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "📜       Logs")
+@router.exact("📜       Logs")
 def handle_logs_menu(message):
     markup_logs_menu = types.ReplyKeyboardMarkup(
         row_width=4, one_time_keyboard=True)
 
     # Add buttons
     button_counter = 1
-    for log_file in log_files:
+    for log_file in log_files_config.get():
         button = types.InlineKeyboardButton(f"📜 Log: {log_file}")
         markup_logs_menu.add(button)
         button_counter += 1
@@ -863,15 +1025,15 @@ def handle_logs_menu(message):
                      reply_markup=markup_logs_menu)
 
 
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("📜 Log: "))
+@router.prefix("📜 Log: ")
 def handle_logs(message):
-    logging.info(f"User {message.from_user.first_name} requested log file {message.text.split(': ')[1]}")
+    logger.info(f"User {message.from_user.first_name} requested log file {message.text.split(': ')[1]}")
     log_directory = f"{message.text.split(': ')[1]}/"
-    logging.info(f"Log directory: {log_directory}")
+    logger.info(f"Log directory: {log_directory}")
 
     # List all files in the log directory
     log_files = glob(os.path.join(log_directory, '*.log'))
-    logging.info(f"Log files: {log_files}")
+    logger.info(f"Log files: {log_files}")
 
     if not log_files:
         bot.send_message(message.chat.id, "No log files found.")
@@ -913,19 +1075,19 @@ def handle_logs(message):
     handle_logs_menu(message)
 
 
-@bot.message_handler(commands=['logs'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('logs')
 def send_handle_logs(message):
     handle_logs_menu(message)
 
 
 # CHECK SERVERS
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text == "🔔 Check servers")
+@router.exact("🔔 Check servers")
 def handle_check_servers_menu(message):
     markup_check_servers_menu = types.ReplyKeyboardMarkup(
         row_width=4, one_time_keyboard=True)
     
-    for server in servers_list:
-        server_name = server.split('=')[0]
+    for server in servers_config.get():
+        server_name = server.name
         button = types.InlineKeyboardButton(f"🔔 Ping: {server_name}")
         markup_check_servers_menu.add(button)
 
@@ -933,105 +1095,114 @@ def handle_check_servers_menu(message):
     markup_check_servers_menu.add(check_servers_back_button)
     option_selection_text = "Which server do you want to ping?"
 
+    # Latencies of the probes of the monitoring, in milliseconds
+    try:
+        latencies, window, saved = load_latencies(latency_snapshot_path)
+        if latencies:
+            saved_at = datetime.fromtimestamp(saved).strftime('%H:%M:%S')
+            option_selection_text = (f"<b>Probe latency (ms) over the last {window // 60:.0f} minutes, saved at {saved_at}:</b>\n"
+                                     f"<pre>{html.escape(format_latencies(latencies))}</pre>\n{option_selection_text}")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"Reading the latencies of the monitoring failed. Error: {e}")
+
     bot.send_message(message.chat.id, option_selection_text,
                      reply_markup=markup_check_servers_menu)
 
-@bot.message_handler(commands=['ping'], func=lambda message: message.chat.id in ALLOWED_USERS)
+@router.command('ping')
 def send_handle_check_servers(message):
     handle_check_servers_menu(message)
     
-@bot.message_handler(func=lambda message: message.chat.id in ALLOWED_USERS and message.text.startswith("🔔 Ping: "))
+@router.prefix("🔔 Ping: ")
 def handle_check_servers(message):
     chosen_server_name = message.text.split(": ")[1]
-    logging.info(f"User {message.from_user.first_name} requested server check for {chosen_server_name}...")
-    for server in servers_list:
-        server_name = server.split('=')[0]
-        server_ip_port = server.split('=')[1]
-        server_ip = server_ip_port.split(':')[0]
-        port = server_ip_port.split(':')[1]
+    logger.info(f"User {message.from_user.first_name} requested server check for {chosen_server_name}...")
+    for server_name, server_ip, port in servers_config.get():
         if chosen_server_name == server_name:
             bot.send_message(message.chat.id, f"Pinging {server_name} at port {port}...")
             ping_server(server_name, server_ip, port, message)
 
+# Function to keep the result of a ping of the bot, returns the result of the last ping.
+# It is kept apart from the state the monitoring confirmed ('server'), so a ping never
+# changes the state the monitoring alerts on.
+def record_ping(server_name, state):
+    return state_store.set('server_ping', server_name, state)
+
 def ping_server(server_name, server_ip, port, message):
-    logging.info(f"Pinging {server_name} at port {port}...")
+    logger.info(f"Pinging {server_name} at port {port}...")
     time_out = 5
     ping_output = subprocess.run(f'nc -zv -{time_out} {server_ip} {port}', shell=True, capture_output=True, text=True, timeout=10)
     
-    try:
-        with open(server_states_json, 'r') as json_file:
-            previous_server_states = json.load(json_file)
-    except FileNotFoundError:
-        previous_server_states = {}
-
-    current_server_states = previous_server_states    
-    
     # Check if output contains 'failed' or 'succeeded'    
     if 'succeeded' in str(ping_output):
-        print(f"Server {server_name} is online.")
-        logging.info(f"Server {server_name} is online.")
-        logging.info(f"Output: {str(ping_output)}")
+        logger.info(f"Server {server_name} is online.")
+        logger.info(f"Output: {str(ping_output)}")
         
-        if server_name in previous_server_states:
-            if previous_server_states[server_name] == 'offline' or previous_server_states[server_name] == 'unknown':
-                bot.send_message(message.chat.id, f"✅ Server {server_name} is back online.")
-            else:
-                bot.send_message(message.chat.id, f"✅ Server {server_name} is online.")
+        # Update the state and get the previous one in one transaction
+        previous_state = record_ping(server_name, 'online')
+        if previous_state == 'offline' or previous_state == 'unknown':
+            bot.send_message(message.chat.id, f"✅ Server {server_name} is back online.")
         else:
             bot.send_message(message.chat.id, f"✅ Server {server_name} is online.")
-                
-                
-        current_server_states[server_name] = 'online'
            
     else:
         time.sleep(5)
         time_out2 = 10
         ping_output2 = subprocess.run(f'nc -zv -w {time_out2} {server_ip} {port}', shell=True, capture_output=True, text=True, timeout=10)
         if 'succeeded' in str(ping_output2):
-            print(f"Server {server_name} is online.")
-            logging.info(f"Server {server_name} is online.")
-            logging.info(f"Output: {str(ping_output2)}")
+            logger.info(f"Server {server_name} is online.")
+            logger.info(f"Output: {str(ping_output2)}")
             
-            if server_name in previous_server_states:
-                if previous_server_states[server_name] == 'offline' or previous_server_states[server_name] == 'unknown':
-                    bot.send_message(message.chat.id, f"✅ Server {server_name} is back online.")
-                else:
-                    bot.send_message(message.chat.id, f"✅ Server {server_name} is online.")
+            previous_state = record_ping(server_name, 'online')
+            if previous_state == 'offline' or previous_state == 'unknown':
+                bot.send_message(message.chat.id, f"✅ Server {server_name} is back online.")
             else:
                 bot.send_message(message.chat.id, f"✅ Server {server_name} is online.")            
             
-            current_server_states[server_name] = 'online'
-            
         elif 'failed' in str(ping_output2) or 'timed out' in str(ping_output2):      
-            print(f"Server {server_name} is offline.")
-            logging.info(f"Server {server_name} is offline.")
-            logging.info(f"Output: {str(ping_output2)}")
+            logger.info(f"Server {server_name} is offline.")
+            logger.info(f"Output: {str(ping_output2)}")
             bot.send_message(message.chat.id, f"⚠️ Server {server_name} is offline!") 
-            current_server_states[server_name] = 'offline'
+            record_ping(server_name, 'offline')
         else:
-            print(f"Status of server {server_name} is unknown.")
-            logging.info(f"Status of server {server_name} is unknown.")
-            logging.info(f"Output: {str(ping_output2)}")
+            logger.info(f"Status of server {server_name} is unknown.")
+            logger.info(f"Output: {str(ping_output2)}")
             bot.send_message(message.chat.id, f"⚠️ Status of server {server_name} is unknown!")
             bot.send_message(message.chat.id, f"Output: {str(ping_output2)}")
-            current_server_states[server_name] = 'unknown'
+            record_ping(server_name, 'unknown')
 
-    save_server_states_to_json(current_server_states)
-    
-def save_server_states_to_json(server_states):
-    with open(server_states_json, 'w') as json_file:
-        json.dump(server_states, json_file)
-    
 
-@bot.message_handler(func=lambda message: True)
+@router.fallback
 def handle_all_other_messages(message):
-    logging.debug(f"Handle_all_other_messages function started.\n\n")
     # Code to execute for all other messages
     bot.reply_to(message, "I'm sorry, I don't understand that command.")
+    logger.debug("I'm sorry, I don't understand that command.", extra={'chat': message.chat.id})
 
-    logging.info("I'm sorry, I don't understand that command.")
-    logging.debug(f"Handle_all_other_messages function ended.\n\n")
+# Time every message handler, for /perf
+for route in router.routes:
+    route['function'] = profiler.wrap(route['function'].__name__, route['function'])
+
+
+# One telebot handler for all text messages, the router picks the function
+@bot.message_handler(func=lambda message: True)
+def route_message(message):
+    router.dispatch(message)
+
+# Only poll when started as a script, benchmarks/bench_bot.py loads the handlers without polling
+if __name__ == '__main__':
+    if BOT_METRICS_PORT:
+        try:
+            start_metrics_server(metrics_registry, BOT_METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Could not serve metrics on port {BOT_METRICS_PORT}: {str(e)}")
+
+    if fleet_aggregator is not None:
+        if not FLEET_TOKEN:
+            logger.error("FLEET_PORT is set but FLEET_TOKEN is not, not receiving fleet pushes.")
+        else:
+            try:
+                start_fleet_server(fleet_aggregator, FLEET_PORT, FLEET_HOST)
+            except OSError as e:
+                logger.error(f"Could not receive fleet pushes on port {FLEET_PORT}: {str(e)}")
 
-print("Bot running...")
-logging.info("Bot running...")
-bot.polling()
+    logger.info("Bot running...")
+    bot.polling()
@@ -0,0 +1,94 @@
+import html
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Alert pipeline between the checks and Telegram. Alerts are keyed by
+# (check, target): an alert with the same state as the active one is not sent
+# again, only as a "still" reminder once the reminder interval has passed.
+# Everything that comes in within the batch window goes out as one message.
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class AlertPipeline:
+    def __init__(self, send, batch_seconds=5, reminder_seconds=3600):
+        self.send = send
+        self.batch_seconds = batch_seconds
+        self.reminder_seconds = reminder_seconds
+        self.active = {}     # (check, target) -> [state, last sent monotonic time]
+        self.queue = []      # (message, parse_mode)
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    # Function to raise an alert. Returns True if it will be sent.
+    def alert(self, check, target, state, message, parse_mode=None):
+        key = (check, target)
+        now = time.monotonic()
+        with self._lock:
+            active = self.active.get(key)
+            if active is not None and active[0] == state:
+                if not self.reminder_seconds or now - active[1] < self.reminder_seconds:
+                    self.suppressed += 1
+                    logger.info(f"Suppressed repeated alert for {check} {target}: {state}")
+                    return False
+                message = f"⏰ Still: {message}"
+            self.active[key] = [state, now]
+            self._enqueue(message, parse_mode)
+        return True
+
+    # Function to clear the alert of a target that is fine again, the message is always sent
+    def resolve(self, check, target, message=None, parse_mode=None):
+        with self._lock:
+            self.active.pop((check, target), None)
+            if message is not None:
+                self._enqueue(message, parse_mode)
+
+    def is_active(self, check, target):
+        with self._lock:
+            return (check, target) in self.active
+
+    def _enqueue(self, message, parse_mode):
+        self.queue.append((message, parse_mode))
+        if self._timer is None:
+            self._timer = threading.Timer(self.batch_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    # Function to send everything that is queued as one digest
+    def flush(self):
+        with self._lock:
+            queued = self.queue
+            self.queue = []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not queued:
+            return
+
+        if len(queued) == 1:
+            self.send(*queued[0])
+            return
+
+        # Mixed messages are sent as HTML, so the plain ones are escaped
+        html_mode = any(parse_mode == 'HTML' for _, parse_mode in queued)
+        parts = [message if parse_mode == 'HTML' or not html_mode else html.escape(message) for message, parse_mode in queued]
+        for digest in split_digest(f"🔔 {len(parts)} alerts:", parts):
+            self.send(digest, 'HTML' if html_mode else None)
+
+
+# Function to join messages into as few Telegram messages as possible
+def split_digest(title, parts, limit=TELEGRAM_MESSAGE_LIMIT):
+    digests = []
+    current = title
+    for part in parts:
+        part = part[:limit - len(title) - 2]
+        if len(current) + 2 + len(part) > limit:
+            digests.append(current)
+            current = title
+        current += f"\n\n{part}"
+    digests.append(current)
+    return digests
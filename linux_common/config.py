@@ -0,0 +1,246 @@
+import logging
+import os
+import shlex
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# The list files (services, containers, servers, log files) parsed into typed
+# entries. A file is only read again when its modification time, size or
+# inode changed, and the new entries replace the old ones in one step.
+# Blank lines and # comments are ignored, invalid lines are logged and skipped.
+
+Server = namedtuple('Server', ['name', 'host', 'port'])
+# A server to probe: kind is 'tcp', 'http', 'https' or 'dns', options are the expectations
+# (status, contains, banner, type) and latency limits in ms (p50, p95, p99) of the line
+ProbeTarget = namedtuple('ProbeTarget', ['name', 'kind', 'host', 'port', 'path', 'options'])
+StorageThreshold = namedtuple('StorageThreshold', ['mount', 'percent', 'inodes_percent'])
+
+
+# Function to get the entries of a list file without blank lines and # comments, with their line numbers
+def config_lines(text):
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line_number, line
+
+
+# Function to parse a file with one name per line, like services or containers
+def parse_names(text, path=''):
+    names = []
+    for line_number, line in config_lines(text):
+        if any(char.isspace() for char in line):
+            logger.warning(f"{path}:{line_number}: skipping {line!r}, a name cannot contain spaces.")
+        elif line not in names:
+            names.append(line)
+    return names
+
+
+# Function to parse a file with one path per line, like log directories
+def parse_paths(text, path=''):
+    paths = []
+    for line_number, line in config_lines(text):
+        if not os.path.isabs(line):
+            logger.warning(f"{path}:{line_number}: skipping {line!r}, not an absolute path.")
+        elif line not in paths:
+            paths.append(line)
+    return paths
+
+
+# Function to parse a "name=ip:port" line into a Server
+def parse_server(line):
+    server_name, server_ip_port = line.split('=', 1)
+    server_ip, port = server_ip_port.rsplit(':', 1)
+    server = Server(server_name.strip(), server_ip.strip().strip('[]'), int(port))
+    if not server.name or not server.host or not 0 < server.port < 65536:
+        raise ValueError(f"invalid server {line!r}")
+    return server
+
+
+# Function to parse a file with one "name=ip:port" server per line
+def parse_servers(text, path=''):
+    servers = []
+    names = set()
+    for line_number, line in config_lines(text):
+        try:
+            server = parse_server(line)
+        except ValueError:
+            logger.warning(f"{path}:{line_number}: skipping {line!r}, expected name=ip:port.")
+            continue
+        if server.name in names:
+            logger.warning(f"{path}:{line_number}: skipping {line!r}, server {server.name} is listed twice.")
+            continue
+        names.add(server.name)
+        servers.append(server)
+    return servers
+
+
+# Default ports and the options every kind of probe accepts
+PROBE_PORTS = {'tcp': None, 'http': 80, 'https': 443, 'dns': 53}
+PROBE_OPTIONS = {
+    'tcp': {'banner'},
+    'http': {'status', 'contains'},
+    'https': {'status', 'contains'},
+    'dns': {'type'},
+}
+LATENCY_OPTIONS = ('p50', 'p95', 'p99')
+DNS_TYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'MX': 15, 'TXT': 16, 'AAAA': 28}
+
+
+# Function to check a "status=200,204" or "status=2xx" option
+def parse_status_option(value):
+    statuses = [status.strip().lower() for status in value.split(',')]
+    for status in statuses:
+        if not (len(status) == 3 and status[0] in '12345' and (status.isdigit() or status[1:] == 'xx')):
+            raise ValueError(f"invalid status {status!r}")
+    return statuses
+
+
+# Function to parse a probe line into a ProbeTarget:
+#   name=ip:port                                          TCP connect
+#   name=tcp://host:port banner=SSH-                      TCP connect and read the greeting
+#   name=https://host/health status=200 contains=ok       HTTP(S) GET
+#   name=dns://resolver/example.com type=A                DNS query over UDP
+# and latency limits in ms on every kind, like p95=800.
+def parse_probe_target(line):
+    name, separator, definition = (part.strip() for part in line.partition('='))
+    parts = shlex.split(definition)
+    if not name or not separator or not parts:
+        raise ValueError("expected name=ip:port or name=kind://address")
+    address, option_parts = parts[0], parts[1:]
+
+    if '://' in address:
+        url = urlsplit(address)
+        kind = url.scheme.lower()
+        if kind not in PROBE_PORTS or not url.hostname:
+            raise ValueError(f"invalid probe {line!r}")
+        host, port = url.hostname, url.port or PROBE_PORTS[kind]
+        if port is None:
+            raise ValueError(f"{kind} needs a port")
+        if kind in ('http', 'https'):
+            path = (url.path or '/') + (f"?{url.query}" if url.query else '')
+        elif kind == 'dns':
+            path = url.path.strip('/')
+            if not path:
+                raise ValueError("dns needs a name to query")
+        else:
+            path = None
+    else:
+        try:
+            server = parse_server(f"{name}={address}")
+        except ValueError:
+            raise ValueError("expected name=ip:port or name=kind://address")
+        kind, host, port, path = 'tcp', server.host, server.port, None
+    if not 0 < port < 65536:
+        raise ValueError(f"invalid port {port}")
+
+    options = {}
+    for part in option_parts:
+        key, separator, value = part.partition('=')
+        if not separator or (key not in PROBE_OPTIONS[kind] and key not in LATENCY_OPTIONS):
+            raise ValueError(f"unknown option {part!r} for {kind}")
+        if key == 'status':
+            value = parse_status_option(value)
+        elif key == 'type':
+            value = value.upper()
+            if value not in DNS_TYPES:
+                raise ValueError(f"unknown dns type {value!r}")
+        elif key in LATENCY_OPTIONS:
+            value = float(value)
+            if value <= 0:
+                raise ValueError(f"invalid latency limit {part!r}")
+        options[key] = value
+    return ProbeTarget(name, kind, host, port, path, options)
+
+
+# Function to parse a file with one probe per line, see parse_probe_target
+def parse_probe_targets(text, path=''):
+    targets = []
+    names = set()
+    for line_number, line in config_lines(text):
+        try:
+            target = parse_probe_target(line)
+        except ValueError as e:
+            logger.warning(f"{path}:{line_number}: skipping {line!r}, {str(e)}.")
+            continue
+        if target.name in names:
+            logger.warning(f"{path}:{line_number}: skipping {line!r}, server {target.name} is listed twice.")
+            continue
+        names.add(target.name)
+        targets.append(target)
+    return targets
+
+
+# Function to parse a "mount=percent[,inodes percent]" or "mount=off" line into a StorageThreshold.
+# Without an inodes percent it is None, and the default is used.
+def parse_storage_threshold(line):
+    mount, thresholds = (part.strip() for part in line.rsplit('=', 1))
+    if not os.path.isabs(mount):
+        raise ValueError(f"invalid mount {mount!r}")
+    if thresholds == 'off':
+        return StorageThreshold(mount, None, None)
+    percent, _, inodes_percent = thresholds.partition(',')
+    threshold = StorageThreshold(mount, int(percent), int(inodes_percent) if inodes_percent else None)
+    if not 0 < threshold.percent <= 100 or not (threshold.inodes_percent is None or 0 < threshold.inodes_percent <= 100):
+        raise ValueError(f"invalid threshold {line!r}")
+    return threshold
+
+
+# Function to parse a file with one "mount=percent[,inodes percent]" threshold per line
+def parse_storage_thresholds(text, path=''):
+    thresholds = {}
+    for line_number, line in config_lines(text):
+        try:
+            threshold = parse_storage_threshold(line)
+        except ValueError:
+            logger.warning(f"{path}:{line_number}: skipping {line!r}, expected /mount=percent, /mount=percent,inodes_percent or /mount=off.")
+            continue
+        thresholds[threshold.mount] = threshold
+    return thresholds
+
+
+class ConfigFile:
+    def __init__(self, path, parser=parse_names):
+        self.path = path
+        self.parser = parser
+        self.version = 0
+        self._signature = None
+        self._entries = None
+        self._lock = threading.Lock()
+
+    # Function to get the entries, reading the file again only when it changed.
+    # When the file cannot be read, the last entries are kept.
+    def get(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            if self._entries is None:
+                raise
+            logger.error(f"Could not read {self.path}, keeping the last version: {str(e)}")
+            return self._entries
+
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._reload(signature)
+        return self._entries
+
+    def _reload(self, signature):
+        try:
+            with open(self.path, 'r') as config_file:
+                text = config_file.read()
+        except OSError as e:
+            if self._entries is None:
+                raise
+            logger.error(f"Could not read {self.path}, keeping the last version: {str(e)}")
+            return
+
+        entries = self.parser(text, self.path)
+        if self._entries is not None:
+            logger.info(f"Reloaded {self.path}: {len(entries)} entries.")
+        self._entries = entries
+        self._signature = signature
+        self.version += 1
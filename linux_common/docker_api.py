@@ -0,0 +1,157 @@
+import http.client
+import json
+import os
+import queue
+import socket
+from collections import namedtuple
+from urllib.parse import quote, urlencode
+
+# Minimal Docker Engine API client that talks HTTP over the unix socket,
+# so listing containers or starting one does not fork the docker CLI.
+DOCKER_SOCKET = os.environ.get('DOCKER_SOCKET', '/var/run/docker.sock')
+
+ContainerState = namedtuple('ContainerState', ['name', 'id', 'state', 'status', 'health', 'created'])
+
+
+class DockerError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+# HTTPConnection that connects to a unix socket instead of a TCP port
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=10):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+# Function to get the health from a status like "Up 3 hours (healthy)"
+def parse_health(status):
+    for health in ('healthy', 'unhealthy', 'health: starting'):
+        if f"({health})" in status:
+            return health.replace('health: ', '')
+    return None
+
+
+class DockerClient:
+    def __init__(self, socket_path=None, timeout=10, pool_size=4):
+        self.socket_path = socket_path or DOCKER_SOCKET
+        self.timeout = timeout
+        # Idle keep-alive connections, reused between requests
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _get_connection(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return UnixHTTPConnection(self.socket_path, self.timeout)
+
+    def _release_connection(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    # Function to do one request, returns the status and the decoded JSON body (or None)
+    def request(self, method, path, params=None, timeout=None):
+        if params:
+            path = f"{path}?{urlencode(params)}"
+
+        for attempt in range(2):
+            connection = self._get_connection()
+            fresh = connection.sock is None
+            try:
+                connection.timeout = timeout or self.timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(connection.timeout)
+                connection.request(method, path, headers={'Host': 'docker'})
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, ConnectionError) as e:
+                connection.close()
+                # A pooled connection may have been closed by the daemon, retry once on a new one
+                if attempt == 0 and not fresh:
+                    continue
+                raise DockerError(0, str(e))
+            except OSError:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release_connection(connection)
+
+            data = json.loads(body) if body and response.getheader('Content-Type', '').startswith('application/json') else None
+            if response.status >= 400:
+                message = data.get('message') if isinstance(data, dict) else body.decode(errors='replace')
+                raise DockerError(response.status, message)
+            return response.status, data
+
+    # Function to list all containers with their exact state in one request
+    def list_containers(self, all=True):
+        _, data = self.request('GET', '/containers/json', {'all': 1 if all else 0})
+        containers = []
+        for container in data or []:
+            name = container['Names'][0].lstrip('/') if container.get('Names') else container['Id'][:12]
+            status = container.get('Status', '')
+            containers.append(ContainerState(name, container['Id'], container.get('State', 'unknown'), status, parse_health(status), container.get('Created')))
+        return containers
+
+    # Function to get the state of containers by name, missing containers are left out
+    def container_states(self, names=None):
+        states = {container.name: container for container in self.list_containers()}
+        if names is None:
+            return states
+        return {name: states[name] for name in names if name in states}
+
+    def inspect(self, name):
+        return self.request('GET', f"/containers/{quote(name)}/json")[1]
+
+    # Lifecycle actions. Docker answers 304 if the container already is in that state.
+    def start(self, name):
+        return self.request('POST', f"/containers/{quote(name)}/start")[0]
+
+    def stop(self, name, timeout=None):
+        params = {'t': timeout} if timeout is not None else None
+        return self.request('POST', f"/containers/{quote(name)}/stop", params, timeout=self.timeout + (timeout or 10))[0]
+
+    def restart(self, name, timeout=None):
+        params = {'t': timeout} if timeout is not None else None
+        return self.request('POST', f"/containers/{quote(name)}/restart", params, timeout=self.timeout + (timeout or 10))[0]
+
+    # Function to stream events from /events, yields one dict per event.
+    # Uses its own connection without a read timeout, the stream can be idle for hours.
+    def events(self, filters=None):
+        connection = UnixHTTPConnection(self.socket_path, timeout=None)
+        path = '/events'
+        if filters:
+            path = f"{path}?{urlencode({'filters': json.dumps(filters)})}"
+        try:
+            connection.request('GET', path, headers={'Host': 'docker'})
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise DockerError(response.status, response.read().decode(errors='replace'))
+            while True:
+                line = response.readline()
+                if not line:
+                    return
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
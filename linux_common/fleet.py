@@ -0,0 +1,335 @@
+import hmac
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+# Fleet mode: the monitoring of every host runs as an agent that pushes its
+# state and alerts to one aggregator, which runs in a single bot. The state
+# of an agent is a flat dict (like "cpu.percent" or "state.server.nas"). Every
+# push sends only the keys that changed since the last state the aggregator
+# acknowledged, together with the alerts of that period, as one
+# zlib-compressed JSON batch. When the aggregator does not know that state
+# (it restarted, or a push got lost), it answers 409 and the agent sends
+# its whole state again. Alerts have increasing ids, so an alert that is
+# sent twice is only delivered once. deliver() only returns once the
+# aggregator acknowledged the alert, so the Notifier keeps it in its spool
+# on disk until then.
+
+PUSH_PATH = '/push'
+MAX_BATCH_BYTES = 4 * 1024 * 1024     # compressed
+MAX_DECODED_BYTES = 32 * 1024 * 1024
+
+
+# Function to encode a batch for a push
+def encode_batch(batch):
+    return zlib.compress(json.dumps(batch, separators=(',', ':')).encode(), 6)
+
+
+# Function to decode a pushed batch, a batch that unpacks to more than MAX_DECODED_BYTES is refused
+def decode_batch(body):
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(body, MAX_DECODED_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError("batch is too large")
+    return json.loads(data.decode())
+
+
+# Function to get the keys that changed or were removed between two states
+def diff_state(previous, current):
+    changed = {key: value for key, value in current.items() if key not in previous or previous[key] != value}
+    removed = [key for key in previous if key not in current]
+    return changed, removed
+
+
+class FleetAgent:
+    def __init__(self, url, name, token, interval=15, max_alerts=1000, timeout=10):
+        self.url = url.rstrip('/') + PUSH_PATH
+        self.name = name
+        self.token = token
+        self.interval = interval
+        self.timeout = timeout
+        self._state = {}
+        self._acknowledged = {}       # the state the aggregator has
+        self._acknowledged_sequence = 0  # 0 when the aggregator has nothing, then the whole state is sent
+        self._sequence = 0
+        self._alerts = deque(maxlen=max_alerts)  # (id, message, parse_mode, time)
+        self._alert_id = int(time.time() * 1000)  # keeps increasing over restarts
+        self._delivering = None  # (id, message, parse_mode) of the alert deliver() waits for
+        self._lock = threading.Lock()
+        self._push_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.pushes = 0
+        self.failed_pushes = 0
+        self.full_pushes = 0
+        self.bytes_sent = 0
+
+    # Function to set a value of the state, values must be JSON (numbers, strings, None)
+    def set(self, key, value):
+        with self._lock:
+            self._state[key] = value
+
+    # Function to remove the keys that start with a prefix, like the servers that are not listed anymore
+    def remove_prefix(self, prefix, keep=()):
+        with self._lock:
+            for key in [key for key in self._state if key.startswith(prefix) and key not in keep]:
+                del self._state[key]
+
+    # Function to queue an alert for the next push, has the signature of a Notifier send function
+    def alert(self, message, parse_mode=None):
+        with self._lock:
+            self._alert_id += 1
+            self._alerts.append((self._alert_id, message, parse_mode, time.time()))
+
+    # Function to push an alert right away, has the signature of a Notifier send function.
+    # Raises OSError when the aggregator did not acknowledge it, so the Notifier retries.
+    # A retry of the same message keeps its id, so the aggregator delivers it only once.
+    def deliver(self, message, parse_mode=None):
+        with self._lock:
+            if self._delivering is None or self._delivering[1:] != (message, parse_mode):
+                self._alert_id += 1
+                self._delivering = (self._alert_id, message, parse_mode)
+                self._alerts.append((self._alert_id, message, parse_mode, time.time()))
+            alert_id = self._delivering[0]
+        self.push()
+        with self._lock:
+            if any(alert[0] == alert_id for alert in self._alerts):
+                raise OSError("The fleet aggregator did not acknowledge the alert")
+            if self._delivering is not None and self._delivering[0] == alert_id:
+                self._delivering = None
+
+    # Function to build the next batch, returns it with the state it is based on
+    def _batch(self):
+        with self._lock:
+            state = dict(self._state)
+            alerts = list(self._alerts)
+            self._sequence += 1
+            sequence = self._sequence
+        if self._acknowledged_sequence:
+            changed, removed = diff_state(self._acknowledged, state)
+        else:
+            changed, removed = state, []
+        batch = {'agent': self.name, 'sequence': sequence, 'base': self._acknowledged_sequence,
+                 'changed': changed, 'removed': removed, 'alerts': alerts, 'time': time.time()}
+        return batch, state
+
+    # Function to push the changes and the queued alerts, returns True when the aggregator has them
+    def push(self):
+        with self._push_lock:
+            for _ in range(2):
+                batch, state = self._batch()
+                body = encode_batch(batch)
+                if not batch['base']:
+                    self.full_pushes += 1
+                try:
+                    status = self._post(body)
+                except (URLError, OSError, ValueError) as e:
+                    self.failed_pushes += 1
+                    logger.error(f"Pushing to the fleet aggregator failed: {str(e)}")
+                    return False
+                self.pushes += 1
+                self.bytes_sent += len(body)
+
+                if status == 409:
+                    # The aggregator does not have our state, send all of it
+                    logger.info("The fleet aggregator asked for the whole state.")
+                    self._acknowledged_sequence = 0
+                    continue
+
+                self._acknowledged = state
+                self._acknowledged_sequence = batch['sequence']
+                sent_ids = {alert[0] for alert in batch['alerts']}
+                with self._lock:
+                    self._alerts = deque((alert for alert in self._alerts if alert[0] not in sent_ids), maxlen=self._alerts.maxlen)
+                return True
+            return False
+
+    def _post(self, body):
+        request = Request(self.url, data=body, method='POST', headers={
+            'Content-Type': 'application/json', 'Content-Encoding': 'deflate', 'Authorization': f"Bearer {self.token}"})
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return response.status
+        except HTTPError as e:
+            if e.code == 409:
+                return 409
+            raise
+
+    def _worker(self):
+        while not self._stopped.wait(self.interval):
+            self.push()
+
+    # Function to push every interval in a background thread
+    def start(self):
+        self._thread = threading.Thread(target=self._worker, name='fleet-agent', daemon=True)
+        self._thread.start()
+
+    # Function to stop pushing, the last changes are pushed first
+    def stop(self):
+        self._stopped.set()
+        self.push()
+
+
+# What the aggregator knows about one agent
+class Agent:
+    def __init__(self, name):
+        self.name = name
+        self.sequence = 0
+        self.state = {}
+        self.last_alert_id = 0
+        self.last_seen = None      # wall clock time of the last push
+        self.address = None
+        self.pushes = 0
+
+    def copy(self):
+        agent = Agent(self.name)
+        agent.__dict__.update(self.__dict__)
+        agent.state = dict(self.state)
+        return agent
+
+
+class FleetAggregator:
+    # on_alert(agent name, message, parse_mode) is called for every new alert of an agent
+    def __init__(self, token, on_alert=None, stale_after=120):
+        self.token = token
+        self.on_alert = on_alert
+        self.stale_after = stale_after
+        self.agents = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.pushes = 0
+        self.rejected = 0
+        self.bytes_received = 0
+
+    # Function to apply a pushed batch, returns the HTTP status for the agent
+    def apply(self, batch, address=None, size=0):
+        name = str(batch['agent'])
+        new_alerts = []
+        with self._lock:
+            self.bytes_received += size
+            agent = self.agents.get(name)
+            if agent is None:
+                agent = self.agents[name] = Agent(name)
+
+            if batch['base'] == 0:
+                agent.state = dict(batch['changed'])
+            elif batch['base'] == agent.sequence:
+                agent.state.update(batch['changed'])
+                for key in batch['removed']:
+                    agent.state.pop(key, None)
+            else:
+                self.rejected += 1
+                return 409
+
+            agent.sequence = batch['sequence']
+            agent.last_seen = time.time()
+            agent.address = address
+            agent.pushes += 1
+            self.pushes += 1
+            for alert_id, message, parse_mode, _ in batch['alerts']:
+                if alert_id > agent.last_alert_id:
+                    agent.last_alert_id = alert_id
+                    new_alerts.append((message, parse_mode))
+
+        if self.on_alert is not None:
+            for message, parse_mode in new_alerts:
+                try:
+                    self.on_alert(name, message, parse_mode)
+                except Exception as e:
+                    logger.error(f"Handling an alert of {name} failed: {str(e)}")
+        return 200
+
+    def is_authorized(self, authorization):
+        return bool(self.token) and hmac.compare_digest(authorization or '', f"Bearer {self.token}")
+
+    # Function to get a copy of every agent, sorted by name
+    def snapshot(self):
+        with self._lock:
+            return [self.agents[name].copy() for name in sorted(self.agents)]
+
+    def is_stale(self, agent, now=None):
+        now = time.time() if now is None else now
+        return agent.last_seen is None or now - agent.last_seen > self.stale_after
+
+
+class FleetHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_status(self, status, text=''):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        aggregator = self.server.aggregator
+        if self.path.split('?')[0] != PUSH_PATH:
+            self.send_status(404, 'not found')
+            return
+        if not aggregator.is_authorized(self.headers.get('Authorization')):
+            self.send_status(401, 'unauthorized')
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_BATCH_BYTES:
+            self.send_status(413, 'too large')
+            return
+        body = self.rfile.read(length)
+        try:
+            batch = decode_batch(body)
+            status = aggregator.apply(batch, self.client_address[0], length)
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            logger.error(f"Invalid push from {self.client_address[0]}: {str(e)}")
+            self.send_status(400, 'invalid batch')
+            return
+        self.send_status(status, 'ok' if status == 200 else 'send the whole state')
+
+
+# Function to receive pushes of agents in a background thread
+def start_fleet_server(aggregator, port, host='0.0.0.0'):
+    server = ThreadingHTTPServer((host, port), FleetHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 128
+    server.aggregator = aggregator
+    threading.Thread(target=server.serve_forever, name='fleet', daemon=True).start()
+    logger.info(f"Receiving fleet pushes on http://{host}:{server.server_address[1]}{PUSH_PATH}")
+    return server
+
+
+# Function to count the keys with a prefix that are not in a good state, like services that are not active
+def count_bad(state, prefix, good):
+    return sum(1 for key, value in state.items() if key.startswith(prefix) and value not in good)
+
+
+# Function to format the agents as a table, one line per host
+def format_fleet(agents, aggregator, now=None):
+    now = time.time() if now is None else now
+    lines = [f"{'host':<16} {'seen':>6} {'cpu%':>5} {'disk%':>5} {'srv':>3} {'svc':>3} {'ctr':>3}"]
+    for agent in agents:
+        seen = f"{int(now - agent.last_seen)}s" if agent.last_seen else '-'
+        if aggregator.is_stale(agent, now):
+            seen = f"!{seen}"
+        cpu = agent.state.get('cpu.percent')
+        storage = agent.state.get('storage.percent')
+        lines.append(f"{agent.name[:16]:<16} {seen:>6} {cpu if cpu is not None else '-':>5} {storage if storage is not None else '-':>5} "
+                     f"{count_bad(agent.state, 'state.server.', ('online',)):>3} {count_bad(agent.state, 'state.service.', ('active',)):>3} "
+                     f"{count_bad(agent.state, 'state.container.', ('running',)):>3}")
+    return '\n'.join(lines)
+
+
+# Function to format the whole state of one agent
+def format_agent(agent):
+    return '\n'.join(f"{key}: {value}" for key, value in sorted(agent.state.items()))
@@ -0,0 +1,293 @@
+import math
+import os
+import time
+from collections import deque, namedtuple
+
+# Native host metrics, read straight from /proc and statvfs without forking.
+
+CpuTimes = namedtuple('CpuTimes', ['busy', 'total'])
+MemoryInfo = namedtuple('MemoryInfo', ['total_mb', 'used_mb', 'free_mb', 'available_mb', 'cache_mb', 'swap_total_mb', 'swap_used_mb'])
+LoadAverage = namedtuple('LoadAverage', ['load1', 'load5', 'load15', 'running', 'total'])
+DiskUsage = namedtuple('DiskUsage', ['mount', 'device', 'total_bytes', 'used_bytes', 'free_bytes', 'percent',
+                                     'inodes_total', 'inodes_used', 'inodes_percent'])
+Mount = namedtuple('Mount', ['mount', 'device', 'fs_type', 'read_only'])
+# Pressure stall information of one resource: the percent of time some (or all, full) tasks
+# were stalled over the last 10, 60 and 300 seconds, and the total stall time in microseconds
+PressureLine = namedtuple('PressureLine', ['avg10', 'avg60', 'avg300', 'total_us'])
+Pressure = namedtuple('Pressure', ['resource', 'some', 'full'])
+
+# Counters of /proc/vmstat: pages swapped in and out, major page faults and processes killed for memory
+VMSTAT_COUNTERS = ('pswpin', 'pswpout', 'pgmajfault', 'oom_kill')
+
+# Filesystems that do not store files on a disk, or are full by design (squashfs of snaps)
+PSEUDO_FILESYSTEMS = {
+    'autofs', 'binfmt_misc', 'bpf', 'cgroup', 'cgroup2', 'configfs', 'debugfs', 'devpts', 'devtmpfs', 'efivarfs',
+    'fusectl', 'fuse.lxcfs', 'fuse.gvfsd-fuse', 'fuse.portal', 'hugetlbfs', 'mqueue', 'nsfs', 'overlay', 'proc',
+    'pstore', 'ramfs', 'rpc_pipefs', 'securityfs', 'selinuxfs', 'squashfs', 'sysfs', 'tmpfs', 'tracefs',
+}
+
+
+# Function to read the aggregated CPU times from /proc/stat
+def read_cpu_times(path='/proc/stat'):
+    with open(path, 'r') as stat_file:
+        fields = stat_file.readline().split()
+    # user nice system idle iowait irq softirq steal (guest time is already included in user)
+    values = [int(value) for value in fields[1:9]]
+    idle = values[3] + values[4]
+    total = sum(values)
+    return CpuTimes(total - idle, total)
+
+
+# Function to calculate the CPU usage in percent between two samples
+def cpu_percent(previous, current):
+    total = current.total - previous.total
+    if total <= 0:
+        return 0.0
+    return round((current.busy - previous.busy) * 100 / total, 1)
+
+
+# Keeps the previous /proc/stat sample so the usage can be calculated from the delta
+class CpuSampler:
+    def __init__(self):
+        self._previous = None
+
+    # Returns the usage since the previous sample. With a window, a fresh
+    # sample is taken first and the usage over that window is returned.
+    def sample(self, window=None):
+        if window is not None or self._previous is None:
+            self._previous = read_cpu_times()
+            time.sleep(window if window is not None else 0.5)
+        current = read_cpu_times()
+        usage = cpu_percent(self._previous, current)
+        self._previous = current
+        return usage
+
+
+# Function to measure the CPU usage over a short window
+def cpu_usage(window=0.5):
+    return CpuSampler().sample(window)
+
+
+# Function to read memory and swap usage from /proc/meminfo
+def read_memory(path='/proc/meminfo'):
+    meminfo = {}
+    with open(path, 'r') as meminfo_file:
+        for line in meminfo_file:
+            key, value = line.split(':', 1)
+            meminfo[key] = int(value.split()[0])  # in kB
+
+    total = meminfo['MemTotal']
+    free = meminfo['MemFree']
+    cache = meminfo.get('Buffers', 0) + meminfo.get('Cached', 0) + meminfo.get('SReclaimable', 0)
+    available = meminfo.get('MemAvailable', free + cache)
+    used = max(total - free - cache, 0)
+    swap_total = meminfo.get('SwapTotal', 0)
+    swap_used = swap_total - meminfo.get('SwapFree', 0)
+    return MemoryInfo(total // 1024, used // 1024, free // 1024, available // 1024, cache // 1024, swap_total // 1024, swap_used // 1024)
+
+
+# Function to read the counters of /proc/vmstat, a counter the kernel does not have is 0
+def read_vmstat(path='/proc/vmstat', counters=VMSTAT_COUNTERS):
+    values = dict.fromkeys(counters, 0)
+    with open(path, 'r') as vmstat_file:
+        for line in vmstat_file:
+            key, _, value = line.partition(' ')
+            if key in values:
+                values[key] = int(value)
+    return values
+
+
+# Function to read the pressure of 'cpu', 'memory' or 'io' from /proc/pressure, None when
+# the kernel has no pressure stall information (before 4.20, or booted with psi=0)
+def read_pressure(resource, directory='/proc/pressure'):
+    lines = {}
+    try:
+        with open(os.path.join(directory, resource), 'r') as pressure_file:
+            for line in pressure_file:
+                kind, *fields = line.split()
+                values = dict(field.split('=', 1) for field in fields)
+                lines[kind] = PressureLine(float(values['avg10']), float(values['avg60']), float(values['avg300']), int(values['total']))
+    except OSError:
+        return None
+    if 'some' not in lines:
+        return None
+    return Pressure(resource, lines['some'], lines.get('full'))
+
+
+# Function to read the pressure of cpu, memory and io, by resource (without the ones the kernel does not have)
+def read_pressures(directory='/proc/pressure'):
+    pressures = {}
+    for resource in ('cpu', 'memory', 'io'):
+        pressure = read_pressure(resource, directory)
+        if pressure is not None:
+            pressures[resource] = pressure
+    return pressures
+
+
+# Function to format the pressure of every resource as "memory 1.2/0.8/0.3" (some avg10/avg60/avg300)
+def format_pressures(pressures):
+    return ', '.join(f"{resource} {pressure.some.avg10:.1f}/{pressure.some.avg60:.1f}/{pressure.some.avg300:.1f}"
+                     for resource, pressure in pressures.items())
+
+
+# Function to read the load average from /proc/loadavg
+def read_loadavg(path='/proc/loadavg'):
+    with open(path, 'r') as loadavg_file:
+        fields = loadavg_file.read().split()
+    running, total = fields[3].split('/')
+    return LoadAverage(float(fields[0]), float(fields[1]), float(fields[2]), int(running), int(total))
+
+
+# Function to read the uptime in seconds from /proc/uptime
+def read_uptime(path='/proc/uptime'):
+    with open(path, 'r') as uptime_file:
+        return float(uptime_file.read().split()[0])
+
+
+# Function to get the disk and inode usage of a mount point, calculated like df and df -i do
+def disk_usage(mount='/', device=None):
+    stat = os.statvfs(mount)
+    total = stat.f_blocks * stat.f_frsize
+    free = stat.f_bavail * stat.f_frsize
+    used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+    usable = used + free
+    percent = math.ceil(used * 100 / usable) if usable else 0
+    # Some filesystems (btrfs, vfat) have no fixed number of inodes and report 0
+    inodes_used = stat.f_files - stat.f_ffree
+    inodes_percent = math.ceil(inodes_used * 100 / stat.f_files) if stat.f_files else None
+    return DiskUsage(mount, device, total, used, free, percent, stat.f_files, inodes_used, inodes_percent)
+
+
+# Function to undo the octal escapes of /proc mount tables, like \040 for a space
+def unescape_mount(path):
+    return path.replace('\\040', ' ').replace('\\011', '\t').replace('\\012', '\n').replace('\\134', '\\')
+
+
+# Function to read the mounts from /proc/self/mountinfo. A filesystem that is
+# mounted more than once (bind mounts) is only returned for its first mount.
+def read_mounts(path='/proc/self/mountinfo'):
+    mounts = []
+    seen = set()
+    with open(path, 'r') as mountinfo_file:
+        for line in mountinfo_file:
+            fields, _, filesystem = line.partition(' - ')
+            fields = fields.split()
+            filesystem = filesystem.split()
+            if len(fields) < 6 or len(filesystem) < 2:
+                continue
+            device_number, mount, options = fields[2], unescape_mount(fields[4]), fields[5].split(',')
+            if device_number in seen:
+                continue
+            seen.add(device_number)
+            mounts.append(Mount(mount, unescape_mount(filesystem[1]), filesystem[0], 'ro' in options))
+    return mounts
+
+
+# Function to get the disk usage of every writable mount that stores files on a disk
+def mounted_disk_usage(path='/proc/self/mountinfo'):
+    usages = []
+    for mount in read_mounts(path):
+        if mount.fs_type in PSEUDO_FILESYSTEMS or mount.read_only:
+            continue
+        try:
+            usage = disk_usage(mount.mount, mount.device)
+        except OSError:
+            continue
+        if usage.total_bytes:
+            usages.append(usage)
+    return usages
+
+
+# Keeps the used bytes of every mount over a rolling window, to forecast when it is full
+class FillRate:
+    def __init__(self, window=6 * 3600, min_span=1800):
+        self.window = window        # seconds of samples used for the fill rate
+        self.min_span = min_span    # no forecast before the samples cover this many seconds
+        self._samples = {}          # mount -> deque of (monotonic time, used bytes)
+
+    # Function to add a sample of a mount
+    def add(self, mount, used_bytes, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        samples = self._samples.setdefault(mount, deque())
+        samples.append((timestamp, used_bytes))
+        while samples and timestamp - samples[0][0] > self.window:
+            samples.popleft()
+
+    # Function to get the fill rate in bytes per second (least squares over the window), None without enough samples
+    def rate(self, mount):
+        samples = self._samples.get(mount)
+        if not samples or len(samples) < 3 or samples[-1][0] - samples[0][0] < self.min_span:
+            return None
+        mean_time = sum(timestamp for timestamp, _ in samples) / len(samples)
+        mean_used = sum(used for _, used in samples) / len(samples)
+        variance = sum((timestamp - mean_time) ** 2 for timestamp, _ in samples)
+        if not variance:
+            return None
+        return sum((timestamp - mean_time) * (used - mean_used) for timestamp, used in samples) / variance
+
+    # Function to forecast the hours until a mount is full, None when it is not filling up
+    def hours_to_full(self, mount, free_bytes):
+        rate = self.rate(mount)
+        if rate is None or rate <= 0:
+            return None
+        return free_bytes / rate / 3600
+
+    # Function to forget the mounts that are gone
+    def keep(self, mounts):
+        for mount in set(self._samples) - set(mounts):
+            del self._samples[mount]
+
+
+# Keeps readings of counters that only go up (like the stall time of /proc/pressure or the
+# swapped pages of /proc/vmstat) over a rolling window, for their average rate over the window
+class CounterRate:
+    def __init__(self, window=300):
+        self.window = window
+        self._samples = {}          # counter -> deque of (monotonic time, value)
+
+    # Function to add a reading of a counter
+    def add(self, counter, value, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        samples = self._samples.setdefault(counter, deque())
+        # A counter that went down was reset, the readings before are of no use
+        if samples and value < samples[-1][1]:
+            samples.clear()
+        samples.append((timestamp, value))
+        while len(samples) > 2 and timestamp - samples[1][0] >= self.window:
+            samples.popleft()
+
+    # Function to get the increase per second over the window, None until the readings cover
+    # at least min_coverage of it (the whole window by default, 0 for any two readings)
+    def rate(self, counter, min_coverage=1.0):
+        samples = self._samples.get(counter)
+        if not samples or len(samples) < 2:
+            return None
+        span = samples[-1][0] - samples[0][0]
+        if span <= 0 or span < self.window * min_coverage:
+            return None
+        return (samples[-1][1] - samples[0][1]) / span
+
+    # Function to get the increase since the reading before the last one, None with one reading
+    def increase(self, counter):
+        samples = self._samples.get(counter)
+        if not samples or len(samples) < 2:
+            return None
+        return samples[-1][1] - samples[-2][1]
+
+
+# Function to format a number of bytes like df -h does
+def format_bytes(size):
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if size < 1024 or unit == 'T':
+            return f"{size:.1f}{unit}" if unit != 'B' else f"{size}{unit}"
+        size /= 1024
+
+
+# Function to format an uptime in seconds like the uptime command does
+def format_uptime(seconds):
+    days, remainder = divmod(int(seconds), 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes = remainder // 60
+    if days:
+        return f"up {days} day{'s' if days != 1 else ''}, {hours}:{minutes:02d}"
+    return f"up {hours}:{minutes:02d}"
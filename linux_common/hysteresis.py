@@ -0,0 +1,116 @@
+import time
+from collections import deque
+
+# Confirmed states and probe cadence of targets like servers. A target only
+# changes state when confirm_probes of its last confirm_window probes agree,
+# so one lost probe does not raise an alert. A target that keeps changing
+# state is flapping: its alerts are muted until it is stable again. Healthy
+# targets are probed less and less often (up to max_interval), targets with
+# a change that is not confirmed yet are probed every min_interval.
+
+# Flapping starts when at least this part of the recent probes changed state, and ends below the second.
+# It takes at least FLAP_MIN_CHANGES changes, so a single lost probe (online, offline, online) is not flapping.
+FLAP_START_RATIO = 0.5
+FLAP_STOP_RATIO = 0.25
+FLAP_MIN_CHANGES = 3
+
+
+class Target:
+    def __init__(self, name, state, flap_window):
+        self.name = name
+        self.state = state              # confirmed state, None until the first probe
+        self.probes = deque(maxlen=flap_window)
+        self.flapping = False
+        self.interval = None
+        self.next_probe = 0             # monotonic time, 0 is right away
+
+    # Number of recent probes that changed state compared to the probe before
+    @property
+    def flap_changes(self):
+        probes = list(self.probes)
+        return sum(1 for previous, current in zip(probes, probes[1:]) if previous != current)
+
+    # Part of the recent probes that changed state, 0 with fewer than FLAP_MIN_CHANGES changes.
+    # A new target counts as stable before its first probe, so its first probes cannot flap on their own.
+    @property
+    def flap_ratio(self):
+        changes = self.flap_changes
+        if changes < FLAP_MIN_CHANGES:
+            return 0.0
+        return changes / (self.probes.maxlen - 1)
+
+
+# What a probe changed, returned by TargetTracker.record
+class Transition:
+    def __init__(self, target, previous_state, state_changed, flapping_changed):
+        self.target = target
+        self.previous_state = previous_state
+        self.state_changed = state_changed
+        self.flapping_changed = flapping_changed
+
+
+class TargetTracker:
+    def __init__(self, interval, min_interval=None, max_interval=None, confirm_probes=2, confirm_window=3,
+                 flap_window=10, healthy_state='online'):
+        self.interval = interval
+        self.min_interval = min(min_interval or interval, interval)
+        self.max_interval = max(max_interval or interval, interval)
+        self.confirm_probes = confirm_probes
+        self.confirm_window = max(confirm_window, confirm_probes)
+        self.flap_window = max(flap_window, self.confirm_window)
+        self.healthy_state = healthy_state
+        self.targets = {}
+
+    # Function to get a target, new targets start with the state that was saved before (or None)
+    def get(self, name, saved_state=None):
+        target = self.targets.get(name)
+        if target is None:
+            target = self.targets[name] = Target(name, saved_state, self.flap_window)
+        return target
+
+    # Function to get the names that are due for a probe
+    def due(self, names, now=None):
+        now = time.monotonic() if now is None else now
+        return [name for name in names if self.get(name).next_probe <= now]
+
+    # Function to forget the targets that are not listed anymore
+    def keep(self, names):
+        for name in set(self.targets) - set(names):
+            del self.targets[name]
+
+    # Function to add the result of a probe, returns a Transition. max_interval
+    # caps the interval of this target, like one that needs regular latency samples.
+    def record(self, name, state, now=None, max_interval=None):
+        now = time.monotonic() if now is None else now
+        target = self.get(name)
+        target.probes.append(state)
+        previous_state = target.state
+
+        # A target without a state takes the first result, after that a change has to be confirmed
+        recent = list(target.probes)[-self.confirm_window:]
+        if target.state is None or (state != target.state and recent.count(state) >= self.confirm_probes):
+            target.state = state
+        state_changed = target.state != previous_state
+
+        was_flapping = target.flapping
+        ratio = target.flap_ratio
+        if not target.flapping and ratio >= FLAP_START_RATIO:
+            target.flapping = True
+        elif target.flapping and ratio < FLAP_STOP_RATIO:
+            target.flapping = False
+
+        # Faster while a change is not confirmed yet, slower and slower while healthy
+        if state != target.state:
+            target.interval = self.min_interval
+        elif target.state == self.healthy_state and not target.flapping:
+            if state_changed or target.interval is None or target.interval < self.interval:
+                target.interval = self.interval
+            else:
+                target.interval = min(target.interval * 2, self.max_interval)
+        else:
+            target.interval = self.interval
+        if max_interval:
+            target.interval = max(self.min_interval, min(target.interval, max_interval))
+        target.next_probe = now + target.interval
+
+        return Transition(target, previous_state, state_changed, target.flapping != was_flapping)
@@ -0,0 +1,132 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+# Logging of the bot and the monitoring. A record is put on a queue and one
+# background thread writes it, so a check or a handler never waits for the
+# disk (which can take long on an SD card). Every line of the log file is one
+# JSON record. Levels can be set per component (the logger name, like
+# "monitoring" or "linux_common.notifier"), and the debug records of one line
+# of code are rate limited, so a busy loop cannot flood the log.
+
+# Records that are waiting for the writer, when it cannot keep up new records are dropped
+MAX_QUEUED_RECORDS = 10000
+
+# Attributes every LogRecord has, anything else was passed with extra= and is written as a field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+# Writes a record as one line of JSON
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'component': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Lets through at most per_minute records per line of code at or below level (debug by default).
+# The next record of a line that was limited gets the number of dropped records as "dropped".
+class RateLimitFilter(logging.Filter):
+    def __init__(self, per_minute=10, level=logging.DEBUG):
+        super().__init__()
+        self.per_minute = per_minute
+        self.level = level
+        self._buckets = {}          # (path, line) -> (tokens, monotonic time, dropped)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level or self.per_minute <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, dropped = self._buckets.get(key, (self.per_minute, now, 0))
+            tokens = min(self.per_minute, tokens + (now - updated) * self.per_minute / 60)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.dropped = dropped
+        return True
+
+
+# Puts records on the queue without ever waiting, a record that does not fit is counted and dropped
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# Function to parse per component levels like "monitoring=DEBUG,telebot=WARNING" into {component: level},
+# invalid parts are logged and skipped
+def parse_log_levels(text):
+    levels = {}
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        component, separator, level = (value.strip() for value in part.partition('='))
+        if not separator or not component or not isinstance(logging.getLevelName(level.upper()), int):
+            logger.warning(f"Skipping log level {part.strip()!r}, expected component=LEVEL.")
+            continue
+        levels[component] = logging.getLevelName(level.upper())
+    return levels
+
+
+# Function to send all logging through one writer thread to a daily rotated JSON log file,
+# and to stdout as plain text when console is set. Returns the queue handler, for its dropped count.
+def setup_logging(path, level='INFO', levels='', console=False, debug_per_minute=10, backup_count=7):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # Use TimedRotatingFileHandler to create a new log file every day
+    file_handler = TimedRotatingFileHandler(path, when="midnight", interval=1, backupCount=backup_count, encoding='utf-8')
+    file_handler.suffix = "%Y-%m-%d.log"  # Add a suffix with the date format
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(MAX_QUEUED_RECORDS)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(debug_per_minute))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(parse_log_levels(f"root={level}").get('root', logging.INFO))
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Write what is still queued when the process exits
+    atexit.register(listener.stop)
+
+    for component, component_level in parse_log_levels(levels).items():
+        logging.getLogger(component).setLevel(component_level)
+    return queue_handler
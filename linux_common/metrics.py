@@ -0,0 +1,220 @@
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# In-process metrics in the Prometheus text exposition format, served on
+# localhost so a scraper can watch the monitoring and the bot without
+# parsing their logs. Values that already live elsewhere (like the
+# scheduler counters) are read by a function when the endpoint is scraped.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=(), function=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function  # returns {label values: value}, called on every scrape
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self.values)
+        for key, value in values.items():
+            if value is not None:
+                yield self.name, key if isinstance(key, tuple) else (key,), (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket, then the sum
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in values.items():
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", key, (('le', _format_value(float(bound))),), count
+            yield f"{self.name}_sum", key, (), counts[-1]
+            yield f"{self.name}_count", key, (), counts[len(self.buckets) - 1]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), function=None):
+        return self._add(Counter(name, help, labels, function))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._add(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    # Function to render all metrics in the text exposition format
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error(f"Could not collect metric {metric.name}: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Function to serve /metrics in a background thread, only on localhost by default
+def start_metrics_server(registry, port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+# Function to add the metrics every process has: start time and the number of started subprocesses.
+# Subprocesses are counted with an audit hook, so every subprocess.run, Popen and os.system is seen.
+def add_process_metrics(registry):
+    started = time.time()
+    registry.gauge('process_start_time_seconds', 'Start time of the process since the epoch.', function=lambda: started)
+    spawns = registry.counter('process_subprocess_spawns_total', 'Subprocesses started, by command.', ['command'])
+
+    def audit(event, args):
+        if event == 'subprocess.Popen':
+            executable, arguments = args[0], args[1]
+            if isinstance(arguments, (str, bytes)):
+                arguments = [arguments]
+            arguments = [str(argument) for argument in arguments or [executable]]
+            # For shell=True count the command that the shell runs
+            if len(arguments) > 2 and os.path.basename(arguments[0]) == 'sh' and arguments[1] == '-c' and arguments[2].split():
+                arguments = arguments[2].split()
+            spawns.inc(command=os.path.basename(arguments[0]))
+        elif event == 'os.system':
+            spawns.inc(command='sh')
+
+    sys.addaudithook(audit)
+    return spawns
+
+
+# Function to time every Telegram Bot API request of pyTelegramBotAPI, by API method
+def instrument_telebot(registry):
+    from telebot import apihelper
+
+    latency = registry.histogram('telegram_api_request_seconds', 'Duration of Telegram Bot API requests, by method.', ['method'],
+                                 buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+    errors = registry.counter('telegram_api_errors_total', 'Telegram Bot API requests that failed, by method.', ['method'])
+
+    def send_request(method, url, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.monotonic()
+        try:
+            response = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception:
+            errors.inc(method=api_method)
+            raise
+        finally:
+            latency.observe(time.monotonic() - started, method=api_method)
+        if response.status_code != 200:
+            errors.inc(method=api_method)
+        return response
+
+    apihelper.CUSTOM_REQUEST_SENDER = send_request
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Background delivery queue for outgoing messages. submit() never blocks:
+# the message is written to the spool directory first (so it survives a
+# crash or restart) and delivered in order by a single worker thread, which
+# retries with exponential backoff and waits as long as Telegram asks on 429.
+
+
+# Function to get the number of seconds Telegram asks to wait, None if it did not ask
+def get_retry_after(error):
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    result_json = getattr(error, 'result_json', None) or {}
+    return result_json.get('parameters', {}).get('retry_after', 1)
+
+
+# Function to check if retrying will not help, like a 400 Bad Request
+def is_permanent_error(error):
+    error_code = getattr(error, 'error_code', None)
+    return error_code is not None and 400 <= error_code < 500 and error_code != 429
+
+
+class Notifier:
+    def __init__(self, send, spool_directory='spool', max_queue=1000, max_backoff=300):
+        self.send = send
+        self.spool_directory = spool_directory
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._queued = set()    # spool files that are in the in-memory queue
+        self._overflow = False  # spool files that did not fit in the queue
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+        # Metrics
+        self.pending = 0
+        self.sent = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+        self.last_latency = None
+        self.total_latency = 0.0
+
+        os.makedirs(spool_directory, exist_ok=True)
+        self._load_spool()
+        self._thread = threading.Thread(target=self._worker, name='notifier', daemon=True)
+        self._thread.start()
+
+    def _spool_files(self):
+        return sorted(name for name in os.listdir(self.spool_directory) if name.endswith('.json'))
+
+    # Function to queue the messages that were left in the spool by a previous run
+    def _load_spool(self):
+        files = self._spool_files()
+        self.pending = len(files)
+        if files:
+            self._sequence = int(files[-1].split('-')[0]) + 1
+            logger.info(f"Loaded {len(files)} undelivered message(s) from the spool.")
+        for name in files:
+            self._enqueue(name)
+
+    def _enqueue(self, name):
+        with self._lock:
+            # Keep the order: once something overflowed, the worker reloads from the spool
+            if name in self._queued or self._overflow:
+                return
+            try:
+                self._queue.put_nowait(name)
+                self._queued.add(name)
+            except queue.Full:
+                self._overflow = True
+
+    # Function to queue a message, returns right away
+    def submit(self, message, parse_mode=None):
+        with self._lock:
+            name = f"{self._sequence:012d}-{os.getpid()}.json"
+            self._sequence += 1
+            self.pending += 1
+        path = os.path.join(self.spool_directory, name)
+        with open(f"{path}.tmp", 'w') as spool_file:
+            json.dump({'message': message, 'parse_mode': parse_mode, 'created': time.time()}, spool_file)
+        os.replace(f"{path}.tmp", path)
+        self._enqueue(name)
+
+    def _done(self, name):
+        with self._lock:
+            self._queued.discard(name)
+            self.pending -= 1
+        try:
+            os.remove(os.path.join(self.spool_directory, name))
+        except FileNotFoundError:
+            pass
+
+    # Function to deliver one spooled message, retrying until it is sent or cannot be sent
+    def _deliver(self, name):
+        try:
+            with open(os.path.join(self.spool_directory, name), 'r') as spool_file:
+                item = json.load(spool_file)
+        except FileNotFoundError:
+            # Already delivered after it was picked up from the spool a second time
+            with self._lock:
+                self._queued.discard(name)
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Dropping unreadable spooled message {name}: {str(e)}")
+            self.dropped += 1
+            self._done(name)
+            return
+
+        backoff = 1
+        while True:
+            try:
+                self.send(item['message'], item.get('parse_mode'))
+            except Exception as e:
+                self.failed_attempts += 1
+                if is_permanent_error(e):
+                    logger.error(f"Dropping message that Telegram refused: {str(e)}")
+                    self.dropped += 1
+                    break
+                retry_after = get_retry_after(e)
+                wait = retry_after if retry_after is not None else backoff
+                logger.warning(f"Sending Telegram message failed, retrying in {wait} seconds: {str(e)}")
+                time.sleep(wait)
+                if retry_after is None:
+                    backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            self.sent += 1
+            self.last_latency = time.time() - item['created']
+            self.total_latency += self.last_latency
+            logger.info(f"Delivered Telegram message after {self.last_latency:.2f} seconds, {self.pending - 1} more queued.")
+            break
+        self._done(name)
+
+    def _worker(self):
+        while True:
+            try:
+                name = self._queue.get(timeout=1)
+            except queue.Empty:
+                # Pick up the messages that only made it to the spool
+                if self._overflow:
+                    self._overflow = False
+                    for name in self._spool_files():
+                        self._enqueue(name)
+                continue
+            self._deliver(name)
+
+    # Function to get the delivery metrics
+    def stats(self):
+        return {
+            'queue_depth': self.pending,
+            'sent': self.sent,
+            'failed_attempts': self.failed_attempts,
+            'dropped': self.dropped,
+            'last_latency': self.last_latency,
+            'average_latency': self.total_latency / self.sent if self.sent else None,
+        }
+
+    # Function to wait until everything is delivered, for tests and shutdown
+    def wait_until_empty(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self.pending > 0:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
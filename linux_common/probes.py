@@ -0,0 +1,380 @@
+import errno
+import http.client
+import json
+import os
+import random
+import selectors
+import socket
+import ssl
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from linux_common.config import DNS_TYPES
+from linux_common.profiling import percentile
+
+# Result of a single probe. state is 'online', 'offline' or 'unknown', and
+# 'unhealthy' when an application probe got an answer that is not the expected one.
+ProbeResult = namedtuple('ProbeResult', ['name', 'host', 'port', 'state', 'latency_ms', 'error'])
+LatencyPercentiles = namedtuple('LatencyPercentiles', ['count', 'p50', 'p95', 'p99', 'covered_seconds'])
+
+
+# Host names that are looked up at the same time before the connects start
+RESOLVE_WORKERS = 8
+
+
+# Function to look up the address of a host, returns (address info, None) or (None, error)
+def _resolve(host, port, numeric_only=False):
+    try:
+        flags = socket.AI_NUMERICHOST if numeric_only else 0
+        return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=flags)[0], None
+    except socket.gaierror as e:
+        return None, str(e)
+
+
+# Function to resolve the hosts of the servers. Literal IP addresses are taken as they are,
+# host names are looked up concurrently, so a slow DNS server does not hold up the connects.
+def resolve_servers(servers, workers=RESOLVE_WORKERS):
+    addresses = {}
+    lookups = {}  # (host, port) -> None, in the order of the servers
+    for _, host, port in servers:
+        if (host, port) in addresses or (host, port) in lookups:
+            continue
+        address_info, _ = _resolve(host, port, numeric_only=True)
+        if address_info is not None:
+            addresses[(host, port)] = (address_info, None)
+        else:
+            lookups[(host, port)] = None
+    if lookups:
+        with ThreadPoolExecutor(max_workers=min(workers, len(lookups)), thread_name_prefix='resolve') as executor:
+            addresses.update(zip(lookups, executor.map(lambda lookup: _resolve(*lookup), lookups)))
+    return addresses
+
+
+# Function to start a non-blocking connect to a resolved address, returns the socket or a finished ProbeResult
+def _start_connect(name, host, port, resolved):
+    address_info, error = resolved
+    if address_info is None:
+        return None, None, ProbeResult(name, host, port, 'unknown', None, error)
+    family, sock_type, proto, _, address = address_info
+
+    sock = socket.socket(family, sock_type, proto)
+    sock.setblocking(False)
+    result = sock.connect_ex(address)
+    if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+        sock.close()
+        return None, None, ProbeResult(name, host, port, 'offline', None, os.strerror(result))
+    return sock, address, None
+
+
+# Function to probe many servers concurrently with TCP connects.
+# Total time is bounded by the timeout, not by the number of servers.
+def probe_servers(servers, timeout=5, concurrency=64):
+    pending = list(servers)
+    results = {}
+    in_flight = {}
+    addresses = resolve_servers(pending)
+    selector = selectors.DefaultSelector()
+
+    try:
+        while pending or in_flight:
+            # Fill up the in-flight window
+            while pending and len(in_flight) < concurrency:
+                name, host, port = pending.pop(0)
+                started = time.monotonic()
+                sock, _, finished = _start_connect(name, host, port, addresses[(host, port)])
+                if finished is not None:
+                    results[name] = finished
+                    continue
+                in_flight[sock] = (name, host, port, started, started + timeout)
+                selector.register(sock, selectors.EVENT_WRITE)
+
+            if not in_flight:
+                continue
+
+            now = time.monotonic()
+            next_deadline = min(deadline for _, _, _, _, deadline in in_flight.values())
+            for key, _ in selector.select(max(0, next_deadline - now)):
+                sock = key.fileobj
+                name, host, port, started, _ = in_flight.pop(sock)
+                selector.unregister(sock)
+                latency_ms = (time.monotonic() - started) * 1000
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                sock.close()
+                if error == 0:
+                    results[name] = ProbeResult(name, host, port, 'online', latency_ms, None)
+                else:
+                    results[name] = ProbeResult(name, host, port, 'offline', latency_ms, os.strerror(error))
+
+            # Expire probes that passed their deadline
+            now = time.monotonic()
+            for sock, (name, host, port, started, deadline) in list(in_flight.items()):
+                if now >= deadline:
+                    del in_flight[sock]
+                    selector.unregister(sock)
+                    sock.close()
+                    results[name] = ProbeResult(name, host, port, 'offline', None, 'timed out')
+    finally:
+        for sock in in_flight:
+            sock.close()
+        selector.close()
+
+    return [results[name] for name, _, _ in servers]
+
+
+# Most of a response body that is read, a health page that is larger is not kept alive
+MAX_BODY_BYTES = 64 * 1024
+DNS_RCODES = {1: 'FORMERR', 2: 'SERVFAIL', 3: 'NXDOMAIN', 4: 'NOTIMP', 5: 'REFUSED'}
+
+
+# Function to check a status code against "status=" options like ['200', '2xx'], without it any status below 400 is fine
+def status_matches(status, expected):
+    if not expected:
+        return status < 400
+    return any(str(status) == option or (option.endswith('xx') and str(status)[0] == option[0]) for option in expected)
+
+
+# Function to build a DNS query for a name, returns the query id and the packet
+def build_dns_query(name, record_type='A'):
+    query_id = random.randrange(1 << 16)
+    question = b''.join(bytes([len(label)]) + label.encode('idna') for label in name.rstrip('.').split('.')) + b'\0'
+    return query_id, struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack('!HH', DNS_TYPES[record_type], 1)
+
+
+# Function to read the answer to a DNS query, returns the rcode and the number of answers
+def parse_dns_response(query_id, packet):
+    if len(packet) < 12:
+        raise ValueError("short dns response")
+    response_id, flags, _, answers, _, _ = struct.unpack('!HHHHHH', packet[:12])
+    if response_id != query_id or not flags & 0x8000:
+        raise ValueError("not an answer to the query")
+    return flags & 0xF, answers
+
+
+# Application probes of ProbeTargets: HTTP(S) GET, TCP banners and DNS queries.
+# HTTP connections are kept alive between check runs, so a probe measures the
+# request and not the TCP and TLS handshakes every time. A kept connection that
+# was closed by the server in the meantime is opened again once.
+class ApplicationProber:
+    def __init__(self):
+        self._connections = {}      # target name -> ((kind, host, port), connection)
+        self._lock = threading.Lock()
+        self._tls_context = ssl.create_default_context()
+
+    # Function to probe one target, returns a ProbeResult
+    def probe(self, target, timeout=5):
+        if target.kind in ('http', 'https'):
+            return self._probe_http(target, timeout)
+        if target.kind == 'dns':
+            return self._probe_dns(target, timeout)
+        return self._probe_banner(target, timeout)
+
+    # Function to close the connections of targets that are not listed anymore
+    def keep(self, names):
+        with self._lock:
+            gone = [name for name in self._connections if name not in names]
+            connections = [self._connections.pop(name)[1] for name in gone]
+        for connection in connections:
+            connection.close()
+
+    def _result(self, target, state, latency_ms=None, error=None):
+        return ProbeResult(target.name, target.host, target.port, state, latency_ms, error)
+
+    def _probe_http(self, target, timeout):
+        key = (target.kind, target.host, target.port)
+        with self._lock:
+            kept = self._connections.pop(target.name, None)
+        connection = kept[1] if kept is not None and kept[0] == key else None
+        if kept is not None and connection is None:
+            kept[1].close()
+
+        for attempt in range(2):
+            reused = connection is not None
+            if connection is None:
+                if target.kind == 'https':
+                    connection = http.client.HTTPSConnection(target.host, target.port, timeout=timeout, context=self._tls_context)
+                else:
+                    connection = http.client.HTTPConnection(target.host, target.port, timeout=timeout)
+            elif connection.sock is not None:
+                connection.sock.settimeout(timeout)
+
+            started = time.monotonic()
+            try:
+                connection.request('GET', target.path, headers={'User-Agent': 'linux-monitoring', 'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                body = response.read(MAX_BODY_BYTES + 1)
+                if len(body) <= MAX_BODY_BYTES and not response.isclosed():
+                    response.read()
+            except ssl.SSLError as e:
+                connection.close()
+                return self._result(target, 'unhealthy', None, f"TLS: {str(e)}")
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                connection = None
+                if reused:
+                    continue
+                if isinstance(e, socket.gaierror):
+                    return self._result(target, 'unknown', None, str(e))
+                return self._result(target, 'offline', None, 'timed out' if isinstance(e, socket.timeout) else str(e) or type(e).__name__)
+            latency_ms = (time.monotonic() - started) * 1000
+            break
+        else:
+            return self._result(target, 'offline', None, 'connection closed')
+
+        # Only a connection with the whole response read can be used again
+        if response.will_close or len(body) > MAX_BODY_BYTES or not response.isclosed():
+            connection.close()
+        else:
+            with self._lock:
+                self._connections[target.name] = (key, connection)
+
+        if not status_matches(response.status, target.options.get('status')):
+            return self._result(target, 'unhealthy', latency_ms, f"HTTP {response.status} {response.reason}")
+        contains = target.options.get('contains')
+        if contains and contains.encode() not in body[:MAX_BODY_BYTES]:
+            return self._result(target, 'unhealthy', latency_ms, f"HTTP {response.status}, the response does not contain {contains!r}")
+        return self._result(target, 'online', latency_ms, None)
+
+    def _probe_banner(self, target, timeout):
+        started = time.monotonic()
+        try:
+            with socket.create_connection((target.host, target.port), timeout=timeout) as sock:
+                banner = b''
+                while b'\n' not in banner and len(banner) < 1024:
+                    data = sock.recv(1024)
+                    if not data:
+                        break
+                    banner += data
+        except socket.gaierror as e:
+            return self._result(target, 'unknown', None, str(e))
+        except OSError as e:
+            return self._result(target, 'offline', None, 'timed out' if isinstance(e, socket.timeout) else str(e))
+        latency_ms = (time.monotonic() - started) * 1000
+
+        expected = target.options.get('banner', '')
+        text = banner.decode(errors='replace').strip()
+        if expected not in text:
+            return self._result(target, 'unhealthy', latency_ms, f"unexpected banner {text[:80]!r}")
+        return self._result(target, 'online', latency_ms, None)
+
+    def _probe_dns(self, target, timeout):
+        record_type = target.options.get('type', 'A')
+        try:
+            family, _, _, _, address = socket.getaddrinfo(target.host, target.port, type=socket.SOCK_DGRAM)[0]
+        except socket.gaierror as e:
+            return self._result(target, 'unknown', None, str(e))
+
+        query_id, query = build_dns_query(target.path, record_type)
+        started = time.monotonic()
+        try:
+            with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                sock.settimeout(timeout)
+                sock.sendto(query, address)
+                # Skip packets that are not the answer, until the timeout
+                while True:
+                    packet, _ = sock.recvfrom(4096)
+                    try:
+                        rcode, answers = parse_dns_response(query_id, packet)
+                        break
+                    except ValueError:
+                        if time.monotonic() - started > timeout:
+                            raise socket.timeout()
+        except OSError as e:
+            return self._result(target, 'offline', None, 'timed out' if isinstance(e, socket.timeout) else str(e))
+        latency_ms = (time.monotonic() - started) * 1000
+
+        if rcode:
+            return self._result(target, 'unhealthy', latency_ms, f"DNS {DNS_RCODES.get(rcode, rcode)} for {target.path} {record_type}")
+        if not answers:
+            return self._result(target, 'unhealthy', latency_ms, f"DNS has no {record_type} record for {target.path}")
+        return self._result(target, 'online', latency_ms, None)
+
+
+# Function to probe ProbeTargets of every kind. Plain TCP connects all run in one
+# selector loop, application probes on a pool of threads, next to each other.
+def probe_targets(targets, prober, timeout=5, concurrency=64):
+    connects = [target for target in targets if target.kind == 'tcp' and 'banner' not in target.options]
+    applications = [target for target in targets if target not in connects]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(applications)))) as executor:
+        futures = [executor.submit(prober.probe, target, timeout) for target in applications]
+        if connects:
+            for result in probe_servers([(target.name, target.host, target.port) for target in connects], timeout, concurrency):
+                results[result.name] = result
+        for future in futures:
+            result = future.result()
+            results[result.name] = result
+    return [results[target.name] for target in targets]
+
+
+# Rolling latency samples of every target, for percentiles over a recent period
+class LatencyWindow:
+    def __init__(self, window=3600):
+        self.window = window
+        self._samples = {}          # target name -> deque of (monotonic time, latency in ms)
+        self._lock = threading.Lock()
+
+    def add(self, name, latency_ms, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            samples = self._samples.setdefault(name, deque())
+            samples.append((now, latency_ms))
+            while samples and samples[0][0] < now - self.window:
+                samples.popleft()
+
+    # Function to forget the targets that are not listed anymore
+    def keep(self, names):
+        with self._lock:
+            for name in set(self._samples) - set(names):
+                del self._samples[name]
+
+    # Function to get the percentiles of the last seconds (default the whole window),
+    # with the number of samples and the seconds they cover, None without samples
+    def percentiles(self, name, seconds=None, now=None):
+        now = time.monotonic() if now is None else now
+        since = now - (seconds or self.window)
+        with self._lock:
+            samples = [sample for sample in self._samples.get(name, ()) if sample[0] >= since]
+        if not samples:
+            return None
+        latencies = sorted(latency for _, latency in samples)
+        return LatencyPercentiles(len(latencies), percentile(latencies, 0.5), percentile(latencies, 0.95),
+                                  percentile(latencies, 0.99), now - samples[0][0])
+
+    # Function to get the percentiles of every target with samples, by name
+    def all_percentiles(self, seconds=None, now=None):
+        with self._lock:
+            names = sorted(self._samples)
+        latencies = {}
+        for name in names:
+            percentiles = self.percentiles(name, seconds, now)
+            if percentiles is not None:
+                latencies[name] = percentiles
+        return latencies
+
+    # Function to save the percentiles of every target for another process, like the bot
+    def save(self, path, now=None):
+        latencies = {name: percentiles._asdict() for name, percentiles in self.all_percentiles(now=now).items()}
+        snapshot = {'saved': time.time(), 'window': self.window, 'latencies': latencies}
+        with open(f"{path}.tmp", 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(f"{path}.tmp", path)
+
+
+# Function to read latencies saved by another process, returns them by target name with the window and save time
+def load_latencies(path):
+    with open(path, 'r') as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    latencies = {name: LatencyPercentiles(**percentiles) for name, percentiles in snapshot['latencies'].items()}
+    return latencies, snapshot['window'], snapshot['saved']
+
+
+# Function to format latencies as a table in milliseconds
+def format_latencies(latencies):
+    lines = [f"{'server':<16} {'n':>4} {'p50':>7} {'p95':>7} {'p99':>7}"]
+    for name, percentiles in sorted(latencies.items()):
+        lines.append(f"{name[:16]:<16} {percentiles.count:>4} {percentiles.p50:>7.1f} {percentiles.p95:>7.1f} {percentiles.p99:>7.1f}")
+    return '\n'.join(lines)
@@ -0,0 +1,143 @@
+import os
+import re
+import time
+from collections import namedtuple
+
+# Per-process CPU and memory, read from /proc/[pid]/stat and statm. The CPU
+# usage is the CPU time a process used between two readings, so a daemon
+# that just spiked ranks above one that was busy since boot (which is what
+# the %CPU of ps shows). Processes are grouped by their systemd unit or
+# container, taken from /proc/[pid]/cgroup.
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+ProcessTimes = namedtuple('ProcessTimes', ['pid', 'name', 'start_ticks', 'cpu_ticks', 'threads', 'rss_bytes', 'group'])
+ProcessUsage = namedtuple('ProcessUsage', ['pid', 'name', 'cpu_percent', 'rss_bytes', 'threads', 'group'])
+GroupUsage = namedtuple('GroupUsage', ['group', 'cpu_percent', 'rss_bytes', 'threads', 'processes'])
+
+# Container ids in cgroup paths, like /system.slice/docker-<id>.scope or /docker/<id>
+CONTAINER_PATTERN = re.compile(r'(?:docker|libpod|cri-containerd|crio)[-/]([0-9a-f]{64})')
+
+
+# Function to get the group of a process from the lines of /proc/[pid]/cgroup:
+# "docker:<short id>" for a container, the unit (like "nginx.service") for a
+# systemd unit, None for a process in no unit (like a kernel thread)
+def cgroup_group(cgroup_text):
+    path = None
+    for line in cgroup_text.splitlines():
+        _, controllers, cgroup_path = line.split(':', 2)
+        # The unified hierarchy (cgroup v2), or the systemd one of cgroup v1
+        if controllers in ('', 'name=systemd'):
+            path = cgroup_path
+            break
+    if not path or path == '/':
+        return None
+
+    container = CONTAINER_PATTERN.search(path)
+    if container:
+        return f"docker:{container.group(1)[:12]}"
+    for part in reversed(path.split('/')):
+        if part.endswith(('.service', '.scope')):
+            return part
+    return path.rsplit('/', 1)[-1] or None
+
+
+# Function to read one process, None when it is gone
+def read_process(pid, proc='/proc'):
+    try:
+        with open(f"{proc}/{pid}/stat", 'r') as stat_file:
+            stat = stat_file.read()
+        with open(f"{proc}/{pid}/statm", 'r') as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        with open(f"{proc}/{pid}/cgroup", 'r') as cgroup_file:
+            group = cgroup_group(cgroup_file.read())
+    except (OSError, ValueError, IndexError):
+        return None
+
+    # The name is between parentheses and can contain spaces and parentheses itself
+    name = stat[stat.index('(') + 1:stat.rindex(')')]
+    fields = stat[stat.rindex(')') + 2:].split()
+    # Fields after the name, counted from state: utime 11, stime 12, num_threads 17, starttime 19
+    return ProcessTimes(pid, name, int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[17]),
+                        resident_pages * PAGE_SIZE, group)
+
+
+# Function to read all processes, keyed by pid
+def read_processes(proc='/proc'):
+    processes = {}
+    for entry in os.listdir(proc):
+        if entry.isdigit():
+            process = read_process(int(entry), proc)
+            if process is not None:
+                processes[process.pid] = process
+    return processes
+
+
+# Function to calculate the usage of every process between two readings. The
+# CPU percent is of one core, like top shows it, so it can go above 100.
+def process_usage(previous, current, seconds):
+    usages = []
+    for pid, process in current.items():
+        before = previous.get(pid)
+        # A process that started in between (or got a reused pid) used all its CPU time in the window
+        if before is None or before.start_ticks != process.start_ticks:
+            cpu_ticks = process.cpu_ticks
+        else:
+            cpu_ticks = process.cpu_ticks - before.cpu_ticks
+        cpu_percent = round(cpu_ticks * 100 / CLOCK_TICKS / seconds, 1) if seconds > 0 else 0.0
+        usages.append(ProcessUsage(pid, process.name, cpu_percent, process.rss_bytes, process.threads, process.group))
+    return usages
+
+
+# Function to measure the usage of every process over a short window
+def sample_processes(window=1):
+    previous = read_processes()
+    started = time.monotonic()
+    time.sleep(window)
+    current = read_processes()
+    return process_usage(previous, current, time.monotonic() - started)
+
+
+# Function to add up the processes of every group, processes without a group are grouped by name
+def group_usage(usages, names=None):
+    groups = {}
+    for usage in usages:
+        group = usage.group or usage.name
+        if names and group in names:
+            group = names[group]
+        total = groups.get(group)
+        if total is None:
+            groups[group] = GroupUsage(group, usage.cpu_percent, usage.rss_bytes, usage.threads, 1)
+        else:
+            groups[group] = GroupUsage(group, round(total.cpu_percent + usage.cpu_percent, 1), total.rss_bytes + usage.rss_bytes,
+                                       total.threads + usage.threads, total.processes + 1)
+    return list(groups.values())
+
+
+# Function to get the top consumers, by CPU or by memory ('rss')
+def top(usages, count=10, by='cpu'):
+    if by == 'rss':
+        return sorted(usages, key=lambda usage: usage.rss_bytes, reverse=True)[:count]
+    return sorted(usages, key=lambda usage: (usage.cpu_percent, usage.rss_bytes), reverse=True)[:count]
+
+
+# Function to format the top processes and groups as a table
+def format_top(usages, count=10, by='cpu', names=None):
+    mb = 1024 * 1024
+    lines = [f"{'pid':>7} {'cpu%':>6} {'rss MB':>7} {'thr':>4} {'name':<16} group"]
+    for usage in top(usages, count, by):
+        group = usage.group or '-'
+        if names and group in names:
+            group = names[group]
+        lines.append(f"{usage.pid:>7} {usage.cpu_percent:>6.1f} {usage.rss_bytes / mb:>7.1f} {usage.threads:>4} {usage.name[:16]:<16} {group}")
+    lines.append('')
+    lines.append(f"{'cpu%':>6} {'rss MB':>7} {'procs':>5} group")
+    for group in top(group_usage(usages, names), count, by):
+        lines.append(f"{group.cpu_percent:>6.1f} {group.rss_bytes / mb:>7.1f} {group.processes:>5} {group.group}")
+    return '\n'.join(lines)
+
+
+# Function to get the names of the running containers by short id, for the docker:<short id> groups
+def container_names(docker_client):
+    return {f"docker:{container.id[:12]}": f"docker:{container.name}" for container in docker_client.list_containers(all=False)}
@@ -0,0 +1,260 @@
+import functools
+import io
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Timings of the hot paths (checks, check phases and bot handlers). The last
+# durations of every name are kept in memory for p50/p95/max. On request a
+# sampling profile is taken while the next runs are done: a background thread
+# reads the stacks of all threads every few milliseconds, so the work that a
+# run hands to worker threads (restarts, probes) shows up as well. The profile
+# is handed to a callback as text.
+
+Timing = namedtuple('Timing', ['name', 'count', 'p50', 'p95', 'max', 'last'])
+
+# Seconds between two samples of the stacks
+SAMPLE_INTERVAL = 0.005
+
+# Code of this repository, a stack without it (like an idle worker of a pool) is not counted
+SOURCE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Innermost frames of a thread that waits for work, like the notifier waiting for a message
+IDLE_FRAMES = {('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get')}
+
+
+# Function to get a percentile of sorted values (nearest rank)
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+# Samples the stacks of all threads while it runs. A stack is a tuple of (file, first line, function)
+# from the outermost to the innermost frame.
+class Sampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stack = _stack(frame)
+                    if stack is not None:
+                        self.stacks[stack] += 1
+            self.samples += 1
+
+
+# Function to get the stack of a frame, None when the thread is idle or not running code of this repository
+def _stack(frame):
+    leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+    if leaf in IDLE_FRAMES:
+        return None
+    stack = []
+    in_source = False
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+        if code.co_filename.startswith(SOURCE_DIRECTORY) and code.co_name != '<module>':
+            in_source = True
+        frame = frame.f_back
+    if not in_source:
+        return None
+    return tuple(reversed(stack))
+
+
+class Profiler:
+    def __init__(self, window=500):
+        self.window = window
+        self._durations = {}  # name -> deque of the last durations
+        self._counts = {}
+        self._lock = threading.Lock()
+
+        # Profile that is being taken
+        self._profile_runs = 0    # runs that still have to start
+        self._profile_active = 0  # runs that are being profiled
+        self._profile_done = None
+        self._sampler = None
+
+    # Function to record one duration in seconds
+    def record(self, name, seconds):
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = deque(maxlen=self.window)
+            durations.append(seconds)
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    # Context manager to time a phase, for example "with profiler.timed('servers.probe'):"
+    @contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    # Function to wrap a function so every call is timed, and profiled while a profile is taken
+    def wrap(self, name, function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            profiled = self._start_run()
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - started)
+                if profiled:
+                    self._finish_run()
+
+        return timed_function
+
+    # Function to profile the next runs, on_done gets the profile as text
+    def start_profile(self, runs, on_done):
+        with self._lock:
+            if self._profile_runs > 0 or self._profile_active > 0:
+                return False
+            self._profile_runs = runs
+            self._profile_done = on_done
+            self._sampler = None
+        logger.info(f"Profiling the next {runs} run(s).")
+        return True
+
+    def is_profiling(self):
+        return self._profile_runs > 0 or self._profile_active > 0
+
+    # Function to count a run that starts, returns True when it is part of the profile.
+    # The sampler starts with the first run.
+    def _start_run(self):
+        with self._lock:
+            if self._profile_runs <= 0:
+                return False
+            self._profile_runs -= 1
+            self._profile_active += 1
+            if self._sampler is None:
+                self._sampler = Sampler()
+                self._sampler.start()
+        return True
+
+    def _finish_run(self):
+        with self._lock:
+            self._profile_active -= 1
+            finished = self._profile_runs <= 0 and self._profile_active == 0 and self._profile_done is not None
+            if finished:
+                sampler, on_done = self._sampler, self._profile_done
+                self._profile_done = None
+        if finished:
+            sampler.stop()
+            on_done(format_profile(sampler))
+
+    # Function to forget all timings
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+
+    # Function to get the timings, slowest (by p95) first
+    def timings(self):
+        with self._lock:
+            items = [(name, sorted(durations), durations[-1], self._counts[name]) for name, durations in self._durations.items()]
+        timings = [Timing(name, count, percentile(durations, 0.5), percentile(durations, 0.95), durations[-1], last)
+                   for name, durations, last, count in items]
+        return sorted(timings, key=lambda timing: timing.p95, reverse=True)
+
+    # Function to write the timings to a JSON file, so another process can show them
+    def save(self, path):
+        snapshot = {'saved': time.time(), 'timings': [timing._asdict() for timing in self.timings()]}
+        with open(f"{path}.tmp", 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(f"{path}.tmp", path)
+
+
+# Function to read timings saved by another process
+def load_timings(path):
+    with open(path, 'r') as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    return [Timing(**timing) for timing in snapshot['timings']], snapshot['saved']
+
+
+# Function to format timings as a table with durations in milliseconds
+def format_timings(timings, limit=15):
+    lines = [f"{'name':<28} {'count':>6} {'p50':>8} {'p95':>8} {'max':>8}"]
+    for timing in timings[:limit]:
+        lines.append(f"{timing.name[:28]:<28} {timing.count:>6} {timing.p50 * 1000:>8.1f} {timing.p95 * 1000:>8.1f} {timing.max * 1000:>8.1f}")
+    return '\n'.join(lines)
+
+
+# Function to get the name of a function in a stack, like "probes.py:42(probe_servers)"
+def _function_name(function):
+    filename, line, name = function
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+# Function to format a sampling profile: the functions that were running (self) and the
+# functions that were running or waiting for what they called (total), most samples first
+def format_profile(sampler, limit=40):
+    output = io.StringIO()
+    output.write(f"Profile started at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sampler.started))}\n")
+    counted = sum(sampler.stacks.values())
+    if not counted:
+        output.write("Nothing was profiled.\n")
+        return output.getvalue()
+    output.write(f"{sampler.samples} samples every {sampler.interval * 1000:.0f} ms, {counted} thread stacks running code of the bot or the monitoring\n")
+
+    own, total = Counter(), Counter()
+    for stack, count in sampler.stacks.items():
+        own[stack[-1]] += count
+        for function in set(stack):
+            total[function] += count
+    for title, counter in (('total', total), ('self', own)):
+        output.write(f"\n{title:>7} {'%':>6}  function\n")
+        for function, count in counter.most_common(limit):
+            output.write(f"{count:>7} {count * 100 / counted:>6.1f}  {_function_name(function)}\n")
+    return output.getvalue()
+
+
+# Function to ask another process to profile its next runs, through a file next to it
+def request_profile(path, runs):
+    with open(f"{path}.tmp", 'w') as request_file:
+        request_file.write(str(runs))
+    os.replace(f"{path}.tmp", path)
+
+
+# Function to take a profile request, returns the number of runs or None when there is none
+def take_profile_request(path):
+    try:
+        with open(path, 'r') as request_file:
+            content = request_file.read().strip()
+        os.remove(path)
+    except FileNotFoundError:
+        return None
+    try:
+        return max(1, int(content))
+    except ValueError:
+        return 1
@@ -0,0 +1,51 @@
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Restarting many targets at once and waiting for them to come back, instead
+# of restarting them one by one with a fixed sleep in between.
+
+Readiness = namedtuple('Readiness', ['ready', 'seconds', 'state'])
+
+
+# Function to poll a target until it is ready or the deadline has passed.
+# probe returns (ready, state): ready is True when the target is up, False to
+# keep waiting and None when it will not come up (for example "failed").
+def wait_until_ready(probe, timeout=30, first_delay=0.2, max_delay=2):
+    started = time.monotonic()
+    deadline = started + timeout
+    delay = first_delay
+    state = None
+    while True:
+        try:
+            ready, state = probe()
+        except Exception as e:
+            ready, state = False, f"error: {str(e)}"
+        if ready:
+            return Readiness(True, time.monotonic() - started, state)
+        if ready is None or time.monotonic() + delay > deadline:
+            return Readiness(False, time.monotonic() - started, state)
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+# Function to run a recovery function for every target on a bounded pool of workers
+def run_in_parallel(function, targets, max_workers=4):
+    targets = list(targets)
+    if not targets:
+        return []
+    if len(targets) == 1:
+        return [function(targets[0])]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets)), thread_name_prefix='remediation') as executor:
+        futures = [executor.submit(function, target) for target in targets]
+        results = []
+        for target, future in zip(targets, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.exception(f"Recovering {target} failed: {str(e)}")
+                results.append(None)
+        return results
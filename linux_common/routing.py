@@ -0,0 +1,101 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Routing of the text messages of the bot. The chat is authorized once
+# against a set, commands and exact button labels are found in a dict and
+# labels with an argument (like "⏯ Start service: nginx") in a prefix trie.
+# When several routes match, the one that was added first wins, the same as
+# the chain of message handlers of telebot. Messages that match nothing, or
+# come from a chat that is not allowed, go to the fallback.
+
+# Key of the route in a node of the prefix trie, a character is never None
+_ROUTE = None
+
+
+# Function to get the command of a text like "/perf@my_bot bot 20", like telebot does
+def extract_command(text):
+    if not text or not text.startswith('/'):
+        return None
+    return text.split()[0].split('@')[0][1:]
+
+
+class Router:
+    def __init__(self, allowed_chat_ids):
+        self.allowed_chat_ids = set(allowed_chat_ids)
+        self.routes = []       # every route in the order it was added, a dict with 'function'
+        self._commands = {}    # command -> route
+        self._exact = {}       # text -> route
+        self._prefixes = {}    # trie of characters, a route is kept under _ROUTE
+        self._fallback = None
+
+    def _add(self, function):
+        route = {'function': function, 'order': len(self.routes)}
+        self.routes.append(route)
+        return route
+
+    # Decorator for a function that handles /<name>
+    def command(self, *names):
+        def decorator(function):
+            route = self._add(function)
+            for name in names:
+                self._commands.setdefault(name, route)
+            return function
+        return decorator
+
+    # Decorator for a function that handles one exact text, like a button label
+    def exact(self, text):
+        def decorator(function):
+            self._exact.setdefault(text, self._add(function))
+            return function
+        return decorator
+
+    # Decorator for a function that handles every text starting with prefix
+    def prefix(self, prefix):
+        def decorator(function):
+            route = self._add(function)
+            node = self._prefixes
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(_ROUTE, route)
+            return function
+        return decorator
+
+    # Decorator for the function that handles everything else
+    def fallback(self, function):
+        self._fallback = self._add(function)
+        return function
+
+    # Function to find the route of a message, or None when there is no fallback
+    def resolve(self, message):
+        text = message.text
+        if message.chat.id not in self.allowed_chat_ids or text is None:
+            return self._fallback
+
+        candidates = []
+        command = extract_command(text)
+        if command is not None and command in self._commands:
+            candidates.append(self._commands[command])
+        if text in self._exact:
+            candidates.append(self._exact[text])
+        node = self._prefixes
+        if _ROUTE in node:
+            candidates.append(node[_ROUTE])
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            if _ROUTE in node:
+                candidates.append(node[_ROUTE])
+
+        if not candidates:
+            return self._fallback
+        return min(candidates, key=lambda route: route['order'])
+
+    # Function to call the function of the route of a message
+    def dispatch(self, message):
+        route = self.resolve(message)
+        if route is None:
+            logger.debug(f"No route for a message from chat {message.chat.id}.")
+            return None
+        return route['function'](message)
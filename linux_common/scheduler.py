@@ -0,0 +1,126 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Interval scheduler on the monotonic clock. Every check has its own interval
+# and jitter and runs in its own thread, so a slow check does not delay the
+# others. A check never overlaps itself: a run that comes due while the
+# previous one is still busy is skipped and counted as missed.
+
+
+class Check:
+    def __init__(self, name, function, interval, jitter=0):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.jitter = jitter
+        self.due = None       # when the check is due without jitter
+        self.next_run = None  # when it actually runs
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.missed = 0
+        self.last_duration = None
+        self.last_success = None  # wall clock time, for display
+
+    def __repr__(self):
+        return f"Check({self.name!r}, interval={self.interval}, runs={self.runs}, missed={self.missed})"
+
+
+class Scheduler:
+    # on_finish(check, duration, success) is called after every run, for metrics
+    def __init__(self, on_finish=None):
+        self.on_finish = on_finish
+        self.checks = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    # Function to add a check. It first runs right away, or after one interval.
+    def add(self, name, function, interval, jitter=0, run_now=True):
+        check = Check(name, function, interval, jitter)
+        check.due = time.monotonic() + (0 if run_now else interval)
+        check.next_run = check.due + random.uniform(0, jitter)
+        with self._lock:
+            self.checks.append(check)
+        self._wakeup.set()
+        return check
+
+    # Function to run one check and record how it went
+    def _run(self, check):
+        started = time.monotonic()
+        success = False
+        try:
+            check.function()
+            check.last_success = time.time()
+            success = True
+        except Exception as e:
+            check.failures += 1
+            logger.exception(f"Check {check.name} failed: {str(e)}")
+        finally:
+            check.last_duration = time.monotonic() - started
+            check.runs += 1
+            logger.info(f"Check {check.name} finished in {check.last_duration:.2f} seconds.")
+            with self._lock:
+                check.running = False
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(check, check.last_duration, success)
+                except Exception as e:
+                    logger.error(f"Reporting check {check.name} failed: {str(e)}")
+
+    # Function to start every check that is due, returns the seconds until the next one
+    def run_pending(self):
+        now = time.monotonic()
+        with self._lock:
+            for check in self.checks:
+                if check.next_run > now:
+                    continue
+
+                # Runs that were due while we slept (or while the check was busy) are missed
+                late_runs = int((now - check.due) // check.interval)
+                check.due += (late_runs + 1) * check.interval
+                check.next_run = check.due + random.uniform(0, check.jitter)
+                if check.running:
+                    late_runs += 1
+                if late_runs:
+                    check.missed += late_runs
+                    logger.warning(f"Check {check.name} missed {late_runs} run(s).")
+
+                if not check.running:
+                    check.running = True
+                    threading.Thread(target=self._run, args=(check,), name=f"check-{check.name}", daemon=True).start()
+
+            if not self.checks:
+                return None
+            return max(0, min(check.next_run for check in self.checks) - time.monotonic())
+
+    # Function to run the checks once right away and wait until they are done, returns the seconds it took.
+    # The checks still run at the same time, like they do on schedule.
+    def run_all(self, names=None):
+        started = time.monotonic()
+        threads = []
+        with self._lock:
+            for check in self.checks:
+                if check.running or (names and check.name not in names):
+                    continue
+                check.running = True
+                thread = threading.Thread(target=self._run, args=(check,), name=f"check-{check.name}", daemon=True)
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started
+
+    def run_forever(self):
+        while not self._stopped:
+            timeout = self.run_pending()
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
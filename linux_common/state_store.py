@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# State shared by the monitoring and the bot, in SQLite with write-ahead
+# logging: every update is its own transaction on one key, readers never
+# block the writer, and each change of state is kept in the history.
+
+Transition = namedtuple('Transition', ['kind', 'key', 'old_state', 'new_state', 'at'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS states (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    changed_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    old_state TEXT,
+    new_state TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_by_key ON transitions (kind, key, at);
+"""
+
+
+class StateStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+
+    def get(self, kind, key):
+        with self._lock:
+            row = self._connection.execute('SELECT state FROM states WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return row[0] if row else None
+
+    # Function to get all states of a kind, as a dict of key to state
+    def all(self, kind):
+        with self._lock:
+            rows = self._connection.execute('SELECT key, state FROM states WHERE kind = ?', (kind,)).fetchall()
+        return dict(rows)
+
+    # Function to get the state and since when it is in that state
+    def get_with_time(self, kind, key):
+        with self._lock:
+            return self._connection.execute('SELECT state, changed_at FROM states WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+
+    # Function to update the state of one key, returns the previous state.
+    # The read and the write are one transaction, so concurrent writers do not lose updates.
+    def set(self, kind, key, state):
+        now = time.time()
+        with self._lock:
+            connection = self._connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT state FROM states WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+                previous = row[0] if row else None
+                if previous == state:
+                    connection.execute('UPDATE states SET updated_at = ? WHERE kind = ? AND key = ?', (now, kind, key))
+                else:
+                    connection.execute('INSERT OR REPLACE INTO states (kind, key, state, changed_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                                       (kind, key, state, now, now))
+                    connection.execute('INSERT INTO transitions (kind, key, old_state, new_state, at) VALUES (?, ?, ?, ?, ?)',
+                                       (kind, key, previous, state, now))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        return previous
+
+    # Function to get the latest state changes, newest first
+    def history(self, kind, key=None, limit=20):
+        query = 'SELECT kind, key, old_state, new_state, at FROM transitions WHERE kind = ?'
+        params = [kind]
+        if key is not None:
+            query += ' AND key = ?'
+            params.append(key)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            return [Transition(*row) for row in self._connection.execute(query, params).fetchall()]
+
+    # Function to drop history older than the given number of days
+    def prune(self, days=30):
+        with self._lock:
+            self._connection.execute('DELETE FROM transitions WHERE at < ?', (time.time() - days * 86400,))
+
+    # Function to take over the states of the old server_states.json once
+    def import_json(self, kind, json_path):
+        if not os.path.exists(json_path) or self.all(kind):
+            return
+        try:
+            with open(json_path, 'r') as json_file:
+                states = json.load(json_file)
+        except ValueError:
+            return
+        for key, state in states.items():
+            self.set(kind, key, state)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# State of all configured systemd units, fetched with a single systemctl call.
+# Point SYSTEMCTL_BIN at a stand-in (see fakes/fake_systemctl.py) to run without systemd.
+SYSTEMCTL_BIN = os.environ.get('SYSTEMCTL_BIN', 'systemctl')
+JOURNALCTL_BIN = os.environ.get('JOURNALCTL_BIN', 'journalctl')
+
+UNIT_SUFFIXES = ('.service', '.socket', '.target', '.timer', '.mount', '.automount', '.path', '.slice', '.scope', '.device', '.swap')
+
+UNIT_PROPERTIES = ['Id', 'LoadState', 'ActiveState', 'SubState', 'MainPID', 'StateChangeTimestamp', 'ActiveEnterTimestamp', 'InactiveEnterTimestamp']
+
+UnitState = namedtuple('UnitState', ['name', 'load_state', 'active_state', 'sub_state', 'main_pid', 'state_change', 'active_enter', 'inactive_enter'])
+
+
+# Function to parse the output of systemctl show, one block of key=value lines per unit
+def parse_show_output(output):
+    blocks = []
+    properties = {}
+    for line in output.splitlines():
+        if not line.strip():
+            if properties:
+                blocks.append(properties)
+                properties = {}
+            continue
+        key, _, value = line.partition('=')
+        properties[key] = value
+    if properties:
+        blocks.append(properties)
+    return blocks
+
+
+# Function to get the state of many units with one systemctl show call.
+# Returns a dict of unit name (as given) to UnitState.
+def query_units(units, systemctl=None):
+    units = list(units)
+    if not units:
+        return {}
+
+    command = [systemctl or SYSTEMCTL_BIN, 'show', '--no-pager', f"--property={','.join(UNIT_PROPERTIES)}", '--'] + units
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+
+    # systemctl prints the blocks in the order the units were given
+    unit_states = {}
+    for unit, properties in zip(units, parse_show_output(output)):
+        main_pid = int(properties.get('MainPID') or 0)
+        unit_states[unit] = UnitState(
+            unit,
+            properties.get('LoadState', 'unknown'),
+            properties.get('ActiveState', 'unknown'),
+            properties.get('SubState', 'unknown'),
+            main_pid or None,
+            properties.get('StateChangeTimestamp') or None,
+            properties.get('ActiveEnterTimestamp') or None,
+            properties.get('InactiveEnterTimestamp') or None,
+        )
+    for unit in units:
+        if unit not in unit_states:
+            unit_states[unit] = UnitState(unit, 'unknown', 'unknown', 'unknown', None, None, None, None)
+    return unit_states
+
+
+# Function to run a lifecycle action (start, stop, restart) on a unit
+def unit_action(action, unit, systemctl=None):
+    return subprocess.run([systemctl or SYSTEMCTL_BIN, action, '--', unit], capture_output=True, text=True)
+
+
+# Function to format a unit state like the "Active:" line of systemctl status
+def format_unit_state(state):
+    text = f"{state.name}: {state.active_state} ({state.sub_state})"
+    if state.state_change:
+        text += f" since {state.state_change}"
+    return text
+
+
+# Function to get the full unit name, "nginx" becomes "nginx.service"
+def unit_id(unit):
+    return unit if unit.endswith(UNIT_SUFFIXES) else f"{unit}.service"
+
+
+# Function to follow state changes of units. systemd (PID 1) logs every start,
+# stop and failure of a unit to the journal, so this yields the unit name (as
+# given) as soon as something happened to it. The caller checks the new state.
+# With idle_seconds, None is yielded whenever nothing happened for that long.
+def follow_unit_changes(units, journalctl=None, idle_seconds=None):
+    ids = {unit_id(unit): unit for unit in units}
+    if not ids:
+        return
+
+    command = [journalctl or JOURNALCTL_BIN, '--follow', '--lines=0', '--output=json', '_PID=1'] + [f"UNIT={id}" for id in ids]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    buffer = b''
+    try:
+        while True:
+            if idle_seconds is not None and not select.select([process.stdout], [], [], idle_seconds)[0]:
+                yield None
+                continue
+            chunk = os.read(process.stdout.fileno(), 65536)
+            if not chunk:
+                return
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                unit = ids.get(entry.get('UNIT'))
+                if unit is not None:
+                    yield unit
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# Function to follow the state changes of the units listed in a ConfigFile and call on_change
+# with the unit name. The journal is followed again when the list changes, nothing is followed
+# while it is empty, and a stream that stops is followed again with backoff. Runs until stop is set.
+def watch_unit_changes(config, on_change, stop=None, journalctl=None, idle_seconds=5):
+    stop = stop or threading.Event()
+    backoff = 1
+    while not stop.is_set():
+        try:
+            units = config.get()
+        except OSError as e:
+            logger.error(f"Could not read {config.path}: {str(e)}")
+            stop.wait(idle_seconds)
+            continue
+        if not units:
+            stop.wait(idle_seconds)
+            continue
+
+        version = config.version
+        reloaded = False
+        connected_at = time.monotonic()
+        changes = follow_unit_changes(units, journalctl, idle_seconds)
+        try:
+            logger.info(f"Following the state changes of {len(units)} systemd unit(s).")
+            for unit in changes:
+                if unit is not None:
+                    on_change(unit)
+                if stop.is_set():
+                    return
+                try:
+                    config.get()
+                except OSError:
+                    pass
+                if config.version != version:
+                    logger.info(f"{config.path} changed, following the new list of units.")
+                    reloaded = True
+                    break
+            else:
+                logger.warning("Systemd unit state stream ended.")
+        except OSError as e:
+            logger.error(f"Systemd unit state stream failed: {str(e)}")
+        finally:
+            changes.close()
+
+        if reloaded:
+            continue
+        if time.monotonic() - connected_at > 60:
+            backoff = 1
+        logger.info(f"Following systemd unit state changes again in {backoff} seconds.")
+        stop.wait(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+# Recovers units after a state change, each in its own thread. A unit is recovered by one thread
+# at a time, and a unit that was restarted less than cooldown seconds ago is left to the periodic
+# check, so a unit that keeps failing right after a restart is not restarted in a loop.
+# recover(unit) returns True when it restarted the unit.
+class UnitEventHandler:
+    def __init__(self, recover, cooldown=60, settle_seconds=1):
+        self.recover = recover
+        self.cooldown = cooldown
+        self.settle_seconds = settle_seconds
+        self._recovering = set()
+        self._last_recovery = {}
+        self._lock = threading.Lock()
+
+    # Function to handle a state change of a unit, returns the recovery thread or None when it is skipped
+    def handle(self, unit):
+        with self._lock:
+            if unit in self._recovering:
+                return None
+            if time.monotonic() - self._last_recovery.get(unit, -self.cooldown) < self.cooldown:
+                return None
+            self._recovering.add(unit)
+        thread = threading.Thread(target=self._recover, args=(unit,), daemon=True)
+        thread.start()
+        return thread
+
+    def _recover(self, unit):
+        try:
+            # Let a restart or reload that is in progress settle first
+            time.sleep(self.settle_seconds)
+            started = time.monotonic()
+            if self.recover(unit):
+                with self._lock:
+                    self._last_recovery[unit] = started
+        except Exception as e:
+            logger.error(f"Error while recovering {unit}: {str(e)}")
+        finally:
+            with self._lock:
+                self._recovering.discard(unit)
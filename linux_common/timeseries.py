@@ -0,0 +1,246 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# Fixed-size time-series store in a memory-mapped file. Every metric has a ring
+# buffer per tier. A sample is folded into the bucket of each tier, so the
+# coarser tiers are downsampled on write and nothing needs to be compacted.
+# The monitoring writes, the bot maps the same file read-only. The store can
+# grow to more metrics (the history is kept): the larger file is written next
+# to it and moved into place, and a reader maps it again when it notices. The
+# slot of a metric that is removed is used again.
+
+# (resolution in seconds, number of buckets)
+TIERS = [
+    (10, 2160),     # 10 seconds for 6 hours
+    (300, 2016),    # 5 minutes for 7 days
+    (3600, 720),    # 1 hour for 30 days
+]
+
+MAGIC = b'LTSDB001'
+HEADER = struct.Struct('<8sII')  # magic, max metrics, buckets per metric
+NAME_SIZE = 64
+BUCKET = struct.Struct('<IIfff')  # bucket number, count, sum, min, max
+GROW_METRICS = 32
+
+Sample = namedtuple('Sample', ['timestamp', 'avg', 'min', 'max', 'count'])
+
+
+class TimeSeriesStore:
+    def __init__(self, path, max_metrics=32, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.buckets_per_metric = sum(buckets for _, buckets in TIERS)
+        self._metric_size = self.buckets_per_metric * BUCKET.size
+        self._names_offset = HEADER.size
+        self._lock = threading.Lock()
+
+        if readonly:
+            self._open_for_reading()
+        else:
+            self.max_metrics = max_metrics
+            self._map = self._open_for_writing(path)
+            self._set_layout()
+
+    def _set_layout(self):
+        self._data_offset = self._names_offset + self.max_metrics * NAME_SIZE
+        self._index = {}
+
+    def _file_size(self):
+        return HEADER.size + self.max_metrics * (NAME_SIZE + self.buckets_per_metric * BUCKET.size)
+
+    def _open_for_reading(self):
+        with open(self.path, 'rb') as store_file:
+            stat = os.fstat(store_file.fileno())
+            store_map = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, max_metrics, buckets = HEADER.unpack_from(store_map, 0)
+        if magic != MAGIC or buckets != self.buckets_per_metric:
+            store_map.close()
+            raise ValueError(f"{self.path} is not a compatible metrics store")
+        self._map = store_map
+        self._signature = (stat.st_ino, stat.st_size)
+        self.max_metrics = max_metrics
+        self._set_layout()
+
+    # Function to map the file again when the monitoring replaced it with a larger one
+    def _refresh(self):
+        if not self.readonly:
+            return
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if (stat.st_ino, stat.st_size) != self._signature:
+            old_map = self._map
+            self._open_for_reading()
+            old_map.close()
+
+    # Function to write a file with the current layout under a temporary name and move it into
+    # place, so a reader that has the old file mapped keeps a complete file and a crash keeps the old one
+    def _write_file(self, names=b'', data=b''):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as store_file:
+            store_file.write(HEADER.pack(MAGIC, self.max_metrics, self.buckets_per_metric))
+            store_file.write(names)
+            store_file.seek(self._names_offset + self.max_metrics * NAME_SIZE)
+            store_file.write(data)
+            store_file.truncate(self._file_size())
+            store_file.flush()
+            os.fsync(store_file.fileno())
+        os.replace(temp_path, self.path)
+
+    # Function to open (or create) the file. A file for fewer metrics is moved to the larger
+    # layout, a file for more metrics keeps its size, and a file with other tiers is started over.
+    def _open_for_writing(self, path):
+        header = b''
+        if os.path.exists(path):
+            with open(path, 'rb') as store_file:
+                header = store_file.read(HEADER.size)
+                magic, stored_metrics, buckets = HEADER.unpack(header) if len(header) == HEADER.size else (None, 0, 0)
+                valid = magic == MAGIC and buckets == self.buckets_per_metric
+                if valid and stored_metrics >= self.max_metrics:
+                    self.max_metrics = stored_metrics
+                elif valid:
+                    names = store_file.read(stored_metrics * NAME_SIZE)
+                    data = store_file.read(stored_metrics * self._metric_size)
+                    self._write_file(names, data)
+                else:
+                    self._write_file()
+        else:
+            self._write_file()
+
+        with open(path, 'r+b') as store_file:
+            size = self._file_size()
+            if os.fstat(store_file.fileno()).st_size < size:
+                store_file.truncate(size)
+            return mmap.mmap(store_file.fileno(), size)
+
+    # Function to make room for at least count metrics, the file is grown in steps of GROW_METRICS
+    def reserve(self, count):
+        if self.readonly or count <= self.max_metrics:
+            return
+        with self._lock:
+            if count <= self.max_metrics:
+                return
+            names = self._map[self._names_offset:self._data_offset]
+            data = self._map[self._data_offset:self._data_offset + self.max_metrics * self._metric_size]
+            index = self._index
+            self.max_metrics = -(-count // GROW_METRICS) * GROW_METRICS
+            self._write_file(names, data)
+            self._map.close()
+            with open(self.path, 'r+b') as store_file:
+                self._map = mmap.mmap(store_file.fileno(), self._file_size())
+            self._set_layout()
+            self._index = index
+
+    def metrics(self):
+        self._refresh()
+        names = []
+        for slot in range(self.max_metrics):
+            offset = self._names_offset + slot * NAME_SIZE
+            name = self._map[offset:offset + NAME_SIZE].rstrip(b'\0')
+            if name:
+                names.append(name.decode())
+        return names
+
+    # Function to find the slot of a metric, optionally adding it
+    def _slot(self, name, create=False):
+        if name in self._index:
+            return self._index[name]
+        encoded = name.encode()[:NAME_SIZE]
+        free = None
+        for slot in range(self.max_metrics):
+            offset = self._names_offset + slot * NAME_SIZE
+            stored = self._map[offset:offset + NAME_SIZE].rstrip(b'\0')
+            if stored == encoded:
+                self._index[name] = slot
+                return slot
+            if not stored and free is None:
+                free = slot
+        if not create:
+            return None
+        if free is None:
+            raise ValueError(f"Metrics store {self.path} is full ({self.max_metrics} metrics)")
+        offset = self._names_offset + free * NAME_SIZE
+        self._map[offset:offset + NAME_SIZE] = encoded.ljust(NAME_SIZE, b'\0')
+        self._index[name] = free
+        return free
+
+    # Function to remove a metric and its samples, so its slot can be used again
+    def remove(self, name):
+        with self._lock:
+            slot = self._slot(name)
+            if slot is None:
+                return
+            offset = self._names_offset + slot * NAME_SIZE
+            self._map[offset:offset + NAME_SIZE] = bytes(NAME_SIZE)
+            offset = self._data_offset + slot * self._metric_size
+            self._map[offset:offset + self._metric_size] = bytes(self._metric_size)
+            self._index.pop(name, None)
+
+    # Function to remove the metrics that start with prefix and are not in keep
+    def remove_prefix(self, prefix, keep=()):
+        for name in self.metrics():
+            if name.startswith(prefix) and name not in keep:
+                self.remove(name)
+
+    # Function to record a sample in every tier
+    def record(self, name, value, timestamp=None):
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        value = float(value)
+        with self._lock:
+            offset = self._data_offset + self._slot(name, create=True) * self._metric_size
+            for resolution, buckets in TIERS:
+                number = timestamp // resolution
+                bucket_offset = offset + (number % buckets) * BUCKET.size
+                stored_number, count, total, minimum, maximum = BUCKET.unpack_from(self._map, bucket_offset)
+                if stored_number != number or count == 0:
+                    count, total, minimum, maximum = 0, 0.0, value, value
+                BUCKET.pack_into(self._map, bucket_offset, number, count + 1, total + value, min(minimum, value), max(maximum, value))
+                offset += buckets * BUCKET.size
+
+    # Function to get the samples of a metric since start, from the finest tier that covers it
+    def query(self, name, start=None, end=None):
+        end = int(end if end is not None else time.time())
+        start = int(start if start is not None else end - TIERS[0][0] * TIERS[0][1])
+        self._refresh()
+        slot = self._slot(name)
+        if slot is None:
+            return []
+
+        offset = self._data_offset + slot * self._metric_size
+        for tier, (resolution, buckets) in enumerate(TIERS):
+            if end - start <= resolution * buckets or tier == len(TIERS) - 1:
+                break
+            offset += buckets * BUCKET.size
+
+        samples = []
+        for number in range(start // resolution, end // resolution + 1):
+            stored_number, count, total, minimum, maximum = BUCKET.unpack_from(self._map, offset + (number % buckets) * BUCKET.size)
+            if stored_number == number and count:
+                samples.append(Sample(number * resolution, total / count, minimum, maximum, count))
+        return samples
+
+    # Function to summarize a metric over the last seconds
+    def summary(self, name, seconds):
+        samples = self.query(name, time.time() - seconds)
+        if not samples:
+            return None
+        count = sum(sample.count for sample in samples)
+        return Sample(samples[-1].timestamp, sum(sample.avg * sample.count for sample in samples) / count,
+                      min(sample.min for sample in samples), max(sample.max for sample in samples), count)
+
+    # Function to get the most recent sample, from the finest tier that has one
+    def latest(self, name):
+        now = time.time()
+        for resolution, buckets in TIERS:
+            samples = self.query(name, now - resolution * buckets + 1, now)
+            if samples:
+                return samples[-1]
+        return None
+
+    def close(self):
+        self._map.close()
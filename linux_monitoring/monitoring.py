@@ -4,305 +4,841 @@ import subprocess
 import telebot
 from dotenv import load_dotenv
 import logging
-from logging.handlers import TimedRotatingFileHandler
 from datetime import datetime
-import schedule
-import json
+import html
+import socket
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linux_common.alerts import AlertPipeline
+from linux_common.config import LATENCY_OPTIONS, ConfigFile, parse_probe_targets, parse_storage_thresholds
+from linux_common.docker_api import DockerClient, DockerError
+from linux_common.fleet import FleetAgent
+from linux_common.notifier import Notifier
+from linux_common.processes import container_names, format_top, process_usage, read_processes
+from linux_common.profiling import Profiler, take_profile_request
+from linux_common.logs import setup_logging
+from linux_common.hysteresis import TargetTracker
+from linux_common.host_metrics import CounterRate, CpuSampler, FillRate, format_bytes, format_pressures, mounted_disk_usage, read_memory, read_pressures, read_vmstat
+from linux_common.metrics import Registry, add_process_metrics, instrument_telebot, start_metrics_server
+from linux_common.remediation import run_in_parallel, wait_until_ready
+from linux_common.scheduler import Scheduler
+from linux_common.state_store import StateStore
+from linux_common.timeseries import TimeSeriesStore
+from linux_common.probes import ApplicationProber, LatencyWindow, probe_targets
+from linux_common.systemd_units import UnitEventHandler, query_units, unit_action, watch_unit_changes
 
 # ENV VARIABLES
 # Load environment variables from .env
 load_dotenv(dotenv_path='../.env')
 
-# Telegram bot setup
-SECRET_TOKEN = os.environ.get('SECRET_TOKEN')
-bot = telebot.TeleBot(SECRET_TOKEN)
-CHAT_ID_PERSON1 = int(os.environ.get('CHAT_ID_PERSON1'))
-
 # LOGGING
+# Set up first, so the stores and clients below can log when they fail to open
 log_directory = './logs/'
 log_file_path = os.path.join(log_directory, 'monitoring.log')
 
-# Ensure the log directory exists
-os.makedirs(log_directory, exist_ok=True)
+# One writer thread writes the log as JSON lines, see linux_common/logs.py. LOG_LEVEL is the
+# default level, LOG_LEVELS sets it per component (like "monitoring=DEBUG,telebot=WARNING"), and
+# LOG_CONSOLE=true writes the log to stdout as well (always with --once).
+log_handler = setup_logging(log_file_path, os.environ.get('LOG_LEVEL', 'INFO'), os.environ.get('LOG_LEVELS', ''),
+                            console=os.environ.get('LOG_CONSOLE', 'false').lower() == 'true' or '--once' in sys.argv,
+                            debug_per_minute=int(os.environ.get('LOG_DEBUG_PER_MINUTE', 10)))
+logger = logging.getLogger('monitoring')
+
+# FLEET
+# With FLEET_URL set the monitoring runs as an agent: its alerts and state are pushed to the
+# bot of another host (the one with FLEET_PORT) instead of to Telegram, every FLEET_PUSH_SECONDS.
+FLEET_URL = os.environ.get('FLEET_URL')
+FLEET_TOKEN = os.environ.get('FLEET_TOKEN')
+FLEET_AGENT_NAME = os.environ.get('FLEET_AGENT_NAME') or socket.gethostname()
+FLEET_PUSH_SECONDS = int(os.environ.get('FLEET_PUSH_SECONDS', 15))
+fleet_agent = FleetAgent(FLEET_URL, FLEET_AGENT_NAME, FLEET_TOKEN, FLEET_PUSH_SECONDS) if FLEET_URL else None
+
+# Telegram bot setup, an agent sends nothing to Telegram itself and needs no token
+SECRET_TOKEN = os.environ.get('SECRET_TOKEN')
+if os.environ.get('TELEGRAM_API_URL'):
+    # For example a local Bot API server, see fakes/fake_bot_api.py
+    telebot.apihelper.API_URL = os.environ.get('TELEGRAM_API_URL')
+bot = telebot.TeleBot(SECRET_TOKEN) if fleet_agent is None else None
+CHAT_ID_PERSON1 = int(os.environ.get('CHAT_ID_PERSON1') or 0)
+
+# Docker Engine API client, talks to /var/run/docker.sock
+docker_client = DockerClient()
+
+# React to docker events (die, oom, unhealthy) instead of waiting for the next check
+DOCKER_EVENTS = os.environ.get('DOCKER_EVENTS', 'false').lower() == 'true'
+
+# React to failed or stopped services as soon as systemd reports them
+SYSTEMD_EVENTS = os.environ.get('SYSTEMD_EVENTS', 'false').lower() == 'true'
+
+# Alerts are deduplicated and sent as one digest per batch window, problems
+# that are still there are repeated as a reminder (0 turns reminders off)
+ALERT_BATCH_SECONDS = int(os.environ.get('ALERT_BATCH_SECONDS', 5))
+ALERT_REMINDER_MINUTES = int(os.environ.get('ALERT_REMINDER_MINUTES', 60))
+
+# Time-series store for the measured values, the bot reads it as well. It has room for
+# HOST_METRICS metrics of the host and the SERVER_METRICS of every server.
+HOST_METRICS = 16
+SERVER_METRICS = ('online', 'latency_ms')
+try:
+    metrics_store = TimeSeriesStore('metrics.tsdb')
+except (OSError, ValueError) as e:
+    logger.error(f"Could not open the metrics store: {str(e)}")
+    metrics_store = None
+
+# State shared with the bot, like whether a server is online
+state_store = StateStore('state.db')
+state_store.import_json('server', 'server_states.json')
+state_store.prune(days=30)
+
+# Number of services or containers that are restarted at the same time, and
+# how many seconds to wait for one to be up again
+REMEDIATION_WORKERS = int(os.environ.get('REMEDIATION_WORKERS', 4))
+REMEDIATION_TIMEOUT = int(os.environ.get('REMEDIATION_TIMEOUT', 30))
+
+# Maximum number of servers that are probed at the same time
+PROBE_CONCURRENCY = int(os.environ.get('PROBE_CONCURRENCY', 64))
+
+# A server only goes offline or back online when SERVERS_CONFIRM_PROBES of its last
+# SERVERS_CONFIRM_WINDOW probes agree. Healthy servers are probed less often, up to every
+# SERVERS_MAX_INTERVAL seconds, and servers with an unconfirmed change every SERVERS_MIN_INTERVAL.
+SERVERS_CONFIRM_PROBES = int(os.environ.get('SERVERS_CONFIRM_PROBES', 2))
+SERVERS_CONFIRM_WINDOW = int(os.environ.get('SERVERS_CONFIRM_WINDOW', 3))
+SERVERS_MIN_INTERVAL = int(os.environ.get('SERVERS_MIN_INTERVAL', 60))
+SERVERS_MAX_INTERVAL = int(os.environ.get('SERVERS_MAX_INTERVAL', 1200))
 
-# Use TimedRotatingFileHandler to create a new log file every day
-handler = TimedRotatingFileHandler(log_file_path, when="midnight", interval=1, backupCount=7)
-handler.suffix = "%Y-%m-%d.log"  # Add a suffix with the date format
+# HTTP connections of the servers in monitoring_servers.txt are kept open between probes. The
+# p50/p95/p99 limits of a server are checked over the last LATENCY_ALERT_MINUTES, and the
+# percentiles of the last hour are saved for the ping view of the bot.
+LATENCY_ALERT_MINUTES = int(os.environ.get('LATENCY_ALERT_MINUTES', 10))
+LATENCY_SNAPSHOT_FILE = 'latency.json'
+application_prober = ApplicationProber()
+latency_window = LatencyWindow(window=max(3600, LATENCY_ALERT_MINUTES * 60))
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
+# Default storage and inode thresholds in percent, monitoring_storage.txt can set them per mount.
+# A mount that will be full within STORAGE_FULL_WITHIN_HOURS at the fill rate of the last
+# STORAGE_FILL_WINDOW_HOURS is alerted as well (0 turns the forecast off).
+STORAGE_THRESHOLD = int(os.environ.get('STORAGE_THRESHOLD', 90))
+INODES_THRESHOLD = int(os.environ.get('INODES_THRESHOLD', 90))
+STORAGE_FULL_WITHIN_HOURS = float(os.environ.get('STORAGE_FULL_WITHIN_HOURS', 24))
+STORAGE_FILL_WINDOW_HOURS = float(os.environ.get('STORAGE_FILL_WINDOW_HOURS', 6))
 
-# Set the logging level
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+# Memory in use in percent (without the cache the kernel can free), and the percent of time tasks
+# were stalled waiting for memory or IO (pressure stall information) averaged over the last
+# PRESSURE_WINDOW_MINUTES. SWAP_IN_THRESHOLD is in pages swapped in per second over that window.
+MEMORY_THRESHOLD = int(os.environ.get('MEMORY_THRESHOLD', 90))
+MEMORY_PRESSURE_THRESHOLD = float(os.environ.get('MEMORY_PRESSURE_THRESHOLD', 10))
+IO_PRESSURE_THRESHOLD = float(os.environ.get('IO_PRESSURE_THRESHOLD', 20))
+SWAP_IN_THRESHOLD = float(os.environ.get('SWAP_IN_THRESHOLD', 256))
+PRESSURE_WINDOW_MINUTES = int(os.environ.get('PRESSURE_WINDOW_MINUTES', 5))
 
-# Add the handler to the logger
-logger.addHandler(handler)
+# METRICS
+# Served on http://127.0.0.1:METRICS_PORT/metrics when METRICS_PORT is set
+METRICS_PORT = int(os.environ.get('METRICS_PORT') or 0)
+metrics_registry = Registry()
+if METRICS_PORT:
+    add_process_metrics(metrics_registry)
+    instrument_telebot(metrics_registry)
+check_duration_metric = metrics_registry.histogram('monitoring_check_duration_seconds', 'Duration of check runs.', ['check'])
+restarts_metric = metrics_registry.counter('monitoring_restarts_total', 'Restarts of services and containers, by result.', ['kind', 'target', 'result'])
+probe_latency_metric = metrics_registry.gauge('monitoring_probe_latency_seconds', 'Connect or response time of the last successful probe of a server.', ['server'])
+server_up_metric = metrics_registry.gauge('monitoring_server_up', 'Whether a server was online at the last probe.', ['server'])
+metrics_registry.gauge('monitoring_probe_latency_p95_seconds', 'p95 latency of the probes of a server over the last hour.', ['server'],
+                       function=lambda: {name: percentiles.p95 / 1000 for name, percentiles in latency_window.all_percentiles().items()})
+memory_used_metric = metrics_registry.gauge('monitoring_memory_used_percent', 'Memory in use in percent, without the cache that can be freed.')
+pressure_metric = metrics_registry.gauge('monitoring_pressure_stall_percent', 'Percent of time tasks were stalled on a resource over the pressure window.', ['resource', 'kind'])
+swap_in_metric = metrics_registry.gauge('monitoring_swap_in_pages_per_second', 'Pages swapped in per second over the pressure window.')
+disk_used_metric = metrics_registry.gauge('monitoring_disk_used_percent', 'Used space of a mount in percent.', ['mount'])
+inodes_used_metric = metrics_registry.gauge('monitoring_disk_inodes_used_percent', 'Used inodes of a mount in percent.', ['mount'])
+hours_to_full_metric = metrics_registry.gauge('monitoring_disk_hours_to_full', 'Forecast hours until a mount is full, only for mounts that are filling up.', ['mount'])
+
+# PROFILING
+# Timings of the checks and their phases, saved for /perf in the bot. The bot
+# asks for a profile of the next check runs by writing the request file.
+profiler = Profiler()
+PERF_SNAPSHOT_FILE = 'perf.json'
+PROFILE_REQUEST_FILE = 'profile_request'
+PROFILE_DUMP_FILE = 'profile.txt'
 
 # SERVICES
 # Function to check and restart services
 def check_and_restart_services(service_list):
-    logging.info("Checking and restarting services.")
-    for service in service_list:        
-        if not is_service_running(service):
-            print(f"Service {service} is not running.")
-            logging.info(f"Service {service} is not running.")
-            restart_service(service)
+    logger.info("Checking and restarting services.")
+    try:
+        # One systemctl call for all services
+        with profiler.timed('services.query'):
+            unit_states = query_units(service_list)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Error while checking services: {str(e)}")
+        alerts.alert('services', '*', 'error', f"Error while checking services: {str(e)}")
+        return
+    alerts.resolve('services', '*')
+
+    forget_states('state.service.', service_list)
+    down_services = []
+    for service in service_list:
+        unit_state = unit_states[service]
+        report_state(f"state.service.{service}", unit_state.active_state)
+        logger.debug(f"{service} is {unit_state.active_state} ({unit_state.sub_state})")
+        if unit_state.active_state != 'active':
+            logger.info(f"Service {service} is not running.")
+            down_services.append(service)
         else:
-            print(f"Service {service} is running. No need to restart.")
-            logging.info(f"Service {service} is running. No need to restart.")
-        
+            logger.debug(f"Service {service} is running. No need to restart.")
+            alerts.resolve('services', service)
 
-# Function to check if a service is running
-def is_service_running(service_name):
-    try:
-        print(f"Checking {service_name}...")
-        logging.info(f"Checking {service_name}...")
-        
-        service_status_output = subprocess.run(f'systemctl status {service_name} | grep "Active:" | awk \'{{print "{service_name}:", $2, $3}}\'', shell=True, capture_output=True, text=True)
-        service_status = service_status_output.stdout.split(' ')[1]
+    # Restart the services that are down at the same time
+    with profiler.timed('services.remediate'):
+        run_in_parallel(restart_service, down_services, REMEDIATION_WORKERS)
         
-        print(f"{service_name} is {service_status}")
-        logging.info(f"{service_name} is {service_status}")
-        
-        if service_status == 'active':
-            return True
-        else:
-            return False
-    except subprocess.CalledProcessError as e:
-        print(f"Error while checking service {service_name}: {str(e)}")
-        logging.error(f"Error while checking service {service_name}: {str(e)}")
-        send_telegram_message(f"Error while checking service {service_name}: {str(e)}")
-        return False
 
-# Function to restart a service
+# Function to check a service while waiting for it to come back
+def probe_service(service_name):
+    service_status = query_units([service_name])[service_name].active_state
+    if service_status == 'active':
+        return True, service_status
+    if service_status == 'failed':
+        return None, service_status
+    return False, service_status
+
+# Function to restart a service and wait until it is running, returns the seconds it took or None
 def restart_service(service_name):
     try:
-        print(f"Restarting {service_name}...")
-        logging.info(f"Restarting {service_name}...")
+        logger.info(f"Restarting {service_name}...")
         
-        subprocess.run(f'systemctl restart {service_name}', shell=True, text=True)
+        started = time.monotonic()
+        result = unit_action('restart', service_name)
+        if result.returncode != 0:
+            # systemctl already knows the restart failed (like a unit that does not exist), do not wait for it
+            error = result.stderr.strip() or f"systemctl exited with code {result.returncode}"
+            logger.error(f"Error while restarting service {service_name}: {error}")
+            alerts.alert('services', service_name, 'error', f"😨 📦 Service {service_name} is down, but while restarting it, I encountered an error: {error}")
+            restarts_metric.inc(kind='service', target=service_name, result='error')
+            return None
+        readiness = wait_until_ready(lambda: probe_service(service_name), REMEDIATION_TIMEOUT)
+        recovery_time = time.monotonic() - started
                 
-        if is_service_running(service_name):
-            print(f"Service {service_name} was down, but was restarted successfully.")
-            logging.info(f"Service {service_name} was restarted successfully.")
-            send_telegram_message(f"🦾 📦 Service {service_name}  was down, but I have restarted it successfully.")
+        if readiness.ready:
+            logger.info(f"Service {service_name} was restarted successfully in {recovery_time:.1f} seconds.")
+            alerts.resolve('services', service_name, f"🦾 📦 Service {service_name}  was down, but I have restarted it successfully in {recovery_time:.1f} seconds.")
+            restarts_metric.inc(kind='service', target=service_name, result='recovered')
+            return recovery_time
         else:
-            print(f"Service {service_name} was down, and could not be restarted.")
-            logging.info(f"Service {service_name} was down, and could not be restarted.")
-            send_telegram_message(f"😓 📦 Service {service_name} is down, and I was not able to restart it. Please help me!")
+            logger.info(f"Service {service_name} was down, and could not be restarted ({readiness.state} after {recovery_time:.1f} seconds).")
+            alerts.alert('services', service_name, 'down', f"😓 📦 Service {service_name} is down, and I was not able to restart it. Please help me!")
+            restarts_metric.inc(kind='service', target=service_name, result='failed')
     except Exception as e:
-        print(f"Error while restarting service {service_name}: {str(e)}")
-        logging.error(f"Error while restarting service {service_name}: {str(e)}")
-        send_telegram_message(f"😨 📦 Service {service_name} is down, but while restarting it, I encountered an error: {str(e)}")
+        logger.error(f"Error while restarting service {service_name}: {str(e)}")
+        alerts.alert('services', service_name, 'error', f"😨 📦 Service {service_name} is down, but while restarting it, I encountered an error: {str(e)}")
+        restarts_metric.inc(kind='service', target=service_name, result='error')
+    return None
+
+# SERVICE EVENTS
+# Function to recover a service after a state change, returns True when it was restarted
+def recover_service(service_name):
+    try:
+        service_status = query_units([service_name])[service_name].active_state
+        logger.info(f"Service event for {service_name}: {service_status}")
+        if service_status in ('failed', 'inactive'):
+            logger.info(f"Service {service_name} is {service_status}.")
+            restart_service(service_name)
+            return True
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Error while recovering service {service_name}: {str(e)}")
+    return False
+
+# A unit that keeps failing right after a restart is left to the periodic check
+SERVICE_RECOVERY_COOLDOWN = 60
+service_events = UnitEventHandler(recover_service, SERVICE_RECOVERY_COOLDOWN)
+
+# Function to follow the state changes of the listed services, also after the list changed
+def watch_service_events():
+    watch_unit_changes(services_config, service_events.handle)
 
 #DOCKER
 # Function to check and restart Docker containers
 def check_and_restart_containers(container_list):
-    logging.info("Checking and restarting containers.")
-    for container in container_list:        
-        if not is_container_running(container):
-            print(f"Container {container} is not running.")
-            logging.info(f"Container {container} is not running.")
-            restart_container(container)
+    logger.info("Checking and restarting containers.")
+    try:
+        # One API request for the state of all containers
+        with profiler.timed('containers.query'):
+            container_states = docker_client.container_states(container_list)
+    except (DockerError, OSError) as e:
+        logger.error(f"Error while checking containers: {str(e)}")
+        alerts.alert('containers', '*', 'error', f"😨 🐳 Could not check the containers, is Docker running? Error: {str(e)}")
+        return
+    alerts.resolve('containers', '*')
+
+    forget_states('state.container.', container_list)
+    down_containers = []
+    for container in container_list:
+        container_state = container_states.get(container)
+        container_status = container_state.state if container_state else 'unknown'
+        report_state(f"state.container.{container}", container_status)
+        logger.debug(f"{container} is {container_status}")
+        if container_status != 'running':
+            logger.info(f"Container {container} is not running.")
+            down_containers.append(container)
         else:
-            print(f"{container} is running. No need to restart.")
-            logging.info(f"{container} is running. No need to restart.")
+            logger.debug(f"{container} is running. No need to restart.")
+            alerts.resolve('containers', container)
+
+    # Restart the containers that are down at the same time
+    with profiler.timed('containers.remediate'):
+        run_in_parallel(restart_container, down_containers, REMEDIATION_WORKERS)
 
 # Function to check if a Docker container is running
 def is_container_running(container_name):
     try:
-        print(f"Checking {container_name} running...")
-        logging.info(f"Checking {container_name}...")
-        command = f'docker ps -a --filter "name={container_name}"'
-        
-        container_status_output = subprocess.run(command, shell=True, capture_output=True, text=True).stdout.strip()
-        status_line = container_status_output.split('\n')[-1]
-        # Split the line into columns
-        columns = status_line.split()
+        logger.debug(f"Checking {container_name}...")
         
-        # Check if "Up" is present in the list
-        if 'Up' in columns:
-            container_status = 'Up'
-        elif 'Exited' in columns:
-            container_status = 'Exited'
-        else:
-            container_status = 'unknown'
+        container_state = docker_client.container_states([container_name]).get(container_name)
+        container_status = container_state.state if container_state else 'unknown'
                 
-        print(f"{container_name} is {container_status}")
+        logger.debug(f"{container_name} is {container_status}")
                 
-        if container_status == 'Up':
+        if container_status == 'running':
             return True
         else:
             return False
-    except subprocess.CalledProcessError as e:
-        print(f"Error while checking container {container_name}: {str(e)}")
-        logging.error(f"Error while checking container {container_name}: {str(e)}")
-        # You may want to handle the error and notify accordingly (e.g., send_telegram_message)
+    except (DockerError, OSError) as e:
+        logger.error(f"Error while checking container {container_name}: {str(e)}")
         return False
 
 
-# Function to restart a Docker container
-def restart_container(container_name):
+# Function to check a container while waiting for it to come back
+def probe_container(container_name):
+    container_state = docker_client.container_states([container_name]).get(container_name)
+    if container_state is None:
+        return None, 'missing'
+    if container_state.state == 'running' and container_state.health in (None, 'healthy'):
+        return True, container_state.status
+    if container_state.state in ('exited', 'dead'):
+        return None, container_state.status
+    return False, container_state.status
+
+# Function to restart a Docker container and wait until it is running, returns the seconds it took or None.
+# With force a running container is restarted as well.
+def restart_container(container_name, force=False):
     try:
-        print(f"Restarting {container_name}...")
-        logging.info(f"Restarting {container_name}...")
+        logger.info(f"Restarting {container_name}...")
         
-        subprocess.run(f'docker start {container_name}', shell=True, text=True)
-        time.sleep(5)
-        if is_container_running(container_name):
-            print(f"Container {container_name} was down, but was restarted successfully.")
-            logging.info(f"Container {container_name} was restarted successfully.")
-            send_telegram_message(f"🦾 🐳 Container {container_name} was down, but I have restarted it successfully.")
+        started = time.monotonic()
+        if force:
+            docker_client.restart(container_name)
+        else:
+            docker_client.start(container_name)
+        readiness = wait_until_ready(lambda: probe_container(container_name), REMEDIATION_TIMEOUT)
+        recovery_time = time.monotonic() - started
+
+        if readiness.ready:
+            logger.info(f"Container {container_name} was restarted successfully in {recovery_time:.1f} seconds.")
+            alerts.resolve('containers', container_name, f"🦾 🐳 Container {container_name} was down, but I have restarted it successfully in {recovery_time:.1f} seconds.")
+            restarts_metric.inc(kind='container', target=container_name, result='recovered')
+            return recovery_time
         else:
-            print(f"Container {container_name} was down, and could not be restarted.")
-            logging.info(f"Container {container_name} was down, and could not be restarted.")
-            send_telegram_message(f"😓 🐳 container {container_name} is down, and I was not able to restart it. Please help me!")
+            logger.info(f"Container {container_name} was down, and could not be restarted ({readiness.state} after {recovery_time:.1f} seconds).")
+            alerts.alert('containers', container_name, 'down', f"😓 🐳 container {container_name} is down, and I was not able to restart it. Please help me!")
+            restarts_metric.inc(kind='container', target=container_name, result='failed')
     except Exception as e:
-        print(f"Error while restarting container {container_name}: {str(e)}")
-        logging.error(f"Error while restarting container {container_name}: {str(e)}")
-        send_telegram_message(f"😨 🐳 Container {container_name} is down, but while restarting it, I encountered an error: {str(e)}")
+        logger.error(f"Error while restarting container {container_name}: {str(e)}")
+        alerts.alert('containers', container_name, 'error', f"😨 🐳 Container {container_name} is down, but while restarting it, I encountered an error: {str(e)}")
+        restarts_metric.inc(kind='container', target=container_name, result='error')
+    return None
+
+# DOCKER EVENTS
+containers_recovering = set()
+containers_recovering_lock = threading.Lock()
 
-# Function to ping server
-def are_servers_online(server_list):
+# Function to recover a container after an event, runs in its own thread
+def recover_container(container_name, action):
     try:
-        with open('server_states.json', 'r') as json_file:
-            previous_server_states = json.load(json_file)
-    except FileNotFoundError:
-        previous_server_states = {}
-        
-    current_server_states = {}    
-    
-    for server in server_list:
-        server_name = server.split('=')[0]
-        server_ip_port = server.split('=')[1]
-        server_ip = server_ip_port.split(':')[0]
-        port = server_ip_port.split(':')[1]
-        
-        logging.info(f"Pinging {server_name} at port {port}...")
-        time_out = 5
-        ping_output = subprocess.run(f'nc -zv -w {time_out} {server_ip} {port}', shell=True, capture_output=True, text=True)
-        
-        # Check if output contains 'failed' or 'succeeded'    
-        if 'succeeded' in str(ping_output):
-            print(f"Server {server_name} is online.")
-            logging.info(f"Server {server_name} is online.")
-            logging.info(f"Output: {str(ping_output)}")
-            
-            if server_name in previous_server_states:
-                if previous_server_states[server_name] == 'offline' or previous_server_states[server_name] == 'unknown':
-                    send_telegram_message(f"✅ Server {server_name} is back online.")
-                    
-            current_server_states[server_name] = 'online'
+        if action.startswith('health_status'):
+            restart_container(container_name, force=True)
         else:
-            time.sleep(5)
-            time_out2 = 10
-            ping_output2 = subprocess.run(f'nc -zv -w {time_out2} {server_ip} {port}', shell=True, capture_output=True, text=True)
-            if 'succeeded' in str(ping_output2):
-                print(f"Server {server_name} is online.")
-                logging.info(f"Server {server_name} is online.")
-                logging.info(f"Output: {str(ping_output2)}")
-                
-                if server_name in previous_server_states:
-                    if previous_server_states[server_name] == 'offline' or previous_server_states[server_name] == 'unknown':
-                        send_telegram_message(f"✅ Server {server_name} is back online.")                
-                current_server_states[server_name] = 'online'
-                
-            elif 'failed' in str(ping_output2):      
-                print(f"Server {server_name} is offline.")
-                logging.info(f"Server {server_name} is offline.")
-                logging.info(f"Output: {str(ping_output2)}")
-                current_server_states[server_name] = 'offline'
-                send_telegram_message(f"⚠️ Server {server_name} is offline!") 
-            else:
-                print(f"Status of server {server_name} is unknown.")
-                logging.info(f"Status of server {server_name} is unknown.")
-                logging.info(f"Output: {str(ping_output2)}")
-                current_server_states[server_name] = 'unknown'
-                send_telegram_message(f"⚠️ Status of server {server_name} is unknown!")
-                send_telegram_message(f"Output: {str(ping_output2)}")
-
-    save_server_states_to_json(current_server_states)
-    
-def save_server_states_to_json(server_states):
-    logging.info(f"Saving server states to JSON file: {server_states}")
-    with open('server_states.json', 'w') as json_file:
-        json.dump(server_states, json_file)
+            # Give a restart policy or a manual "docker restart" a moment to bring it back
+            time.sleep(1)
+            if not is_container_running(container_name):
+                restart_container(container_name)
+    finally:
+        with containers_recovering_lock:
+            containers_recovering.discard(container_name)
+
+# Function to handle one docker event for the monitored containers
+def handle_container_event(event, container_list):
+    container_name = event.get('Actor', {}).get('Attributes', {}).get('name')
+    action = event.get('Action', event.get('status', ''))
+    if container_name not in container_list:
+        return
+    if action not in ('die', 'oom', 'health_status: unhealthy'):
+        return
+
+    logger.info(f"Docker event for {container_name}: {action}")
+    with containers_recovering_lock:
+        # An oom is followed by a die, only recover once
+        if container_name in containers_recovering:
+            return
+        containers_recovering.add(container_name)
+    threading.Thread(target=recover_container, args=(container_name, action), daemon=True).start()
+
+# Function to follow the docker event stream, reconnects with backoff when it drops
+def watch_container_events():
+    backoff = 1
+    while True:
+        connected_at = time.monotonic()
+        try:
+            logger.info("Subscribing to docker events.")
+            for event in docker_client.events({'type': ['container'], 'event': ['die', 'oom', 'health_status']}):
+                handle_container_event(event, containers_config.get())
+            logger.warning("Docker event stream ended.")
+        except (DockerError, OSError, ValueError) as e:
+            logger.error(f"Docker event stream failed: {str(e)}")
+
+        if time.monotonic() - connected_at > 60:
+            backoff = 1
+        logger.info(f"Reconnecting to docker events in {backoff} seconds.")
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+# Function to probe the servers that are due. All of them are probed concurrently, the ones that
+# did not respond get a second chance with a longer timeout. A change of state is only reported
+# once it is confirmed, and a server that keeps changing state is muted while it is flapping.
+def are_servers_online(servers):
+    server_names = [server.name for server in servers]
+    server_tracker.keep(server_names)
+    application_prober.keep(server_names)
+    latency_window.keep(server_names)
+    forget_states('state.server.', server_names)
+    keep_server_metrics(server_names)
+    # The state that was saved before is where a new server starts, also after a restart
+    for server_name in server_names:
+        if server_name not in server_tracker.targets:
+            server_tracker.get(server_name, state_store.get('server', server_name))
+    due = set(server_tracker.due(server_names))
+    servers = [server for server in servers if server.name in due]
+    if not servers:
+        return
+    for server in servers:
+        logger.debug(f"Probing {server.name} ({server.kind}) at port {server.port}...")
+
+    with profiler.timed('servers.probe'):
+        results = probe_targets(servers, application_prober, timeout=5, concurrency=PROBE_CONCURRENCY)
+    retry = [server for server, result in zip(servers, results) if result.state in ('offline', 'unknown')]
+    if retry:
+        with profiler.timed('servers.retry'):
+            retried = {result.name: result for result in probe_targets(retry, application_prober, timeout=10, concurrency=PROBE_CONCURRENCY)}
+        results = [retried.get(result.name, result) for result in results]
+
+    for server, result in zip(servers, results):
+        server_name = result.name
+        record_metric(f"server.{server_name}.online", 1 if result.state == 'online' else 0)
+        server_up_metric.set(1 if result.state == 'online' else 0, server=server_name)
+        if result.state == 'online':
+            record_metric(f"server.{server_name}.latency_ms", result.latency_ms)
+            probe_latency_metric.set(result.latency_ms / 1000, server=server_name)
+            latency_window.add(server_name, result.latency_ms)
+
+        if result.state == 'online':
+            logger.debug(f"Server {server_name} is online ({result.latency_ms:.1f} ms).")
+        else:
+            logger.info(f"Server {server_name} is {result.state}.")
+            logger.info(f"Output: {result.error}")
+
+        # A server with latency limits needs enough samples in every alert window
+        max_interval = LATENCY_ALERT_MINUTES * 60 // 5 if has_latency_limits(server) else None
+        transition = server_tracker.record(server_name, result.state, max_interval=max_interval)
+        target = transition.target
+        save_server_state(server_name, target.state)
+        logger.debug(f"Server {server_name} is {target.state}{' (flapping)' if target.flapping else ''}, next probe in {target.interval} seconds.")
+        report_server_state(result, transition)
+        if target.state == 'online' and not target.flapping:
+            check_server_latency(server)
+
+    try:
+        latency_window.save(LATENCY_SNAPSHOT_FILE)
+    except OSError as e:
+        logger.error(f"Could not save the latencies: {str(e)}")
+
+# Function to check whether a server has p50, p95 or p99 limits
+def has_latency_limits(server):
+    return any(option in server.options for option in LATENCY_OPTIONS)
+
+# Function to alert when a latency percentile of a server is above its limit over the last
+# LATENCY_ALERT_MINUTES. Only a window that is (almost) fully covered by samples counts.
+def check_server_latency(server):
+    if not has_latency_limits(server):
+        alerts.resolve('latency', server.name)
+        return
+    window = LATENCY_ALERT_MINUTES * 60
+    percentiles = latency_window.percentiles(server.name, window)
+    if percentiles is None or percentiles.count < 3 or percentiles.covered_seconds < window * 0.8:
+        return
+
+    slow = [(option, getattr(percentiles, option), server.options[option])
+            for option in LATENCY_OPTIONS if option in server.options and getattr(percentiles, option) > server.options[option]]
+    if slow:
+        details = ', '.join(f"{option} {value:.0f} ms (limit {limit:.0f} ms)" for option, value, limit in slow)
+        alerts.alert('latency', server.name, 'slow',
+                     f"🐢 Server {server.name} is slow over the last {LATENCY_ALERT_MINUTES} minutes: {details}.")
+    elif alerts.is_active('latency', server.name):
+        alerts.resolve('latency', server.name, f"✅ Latency of server {server.name} is back within its limits.")
+
+# Function to send the alert for the confirmed state of a server
+def report_server_state(result, transition):
+    target = transition.target
+    server_name = target.name
+    if target.flapping:
+        if transition.flapping_changed:
+            alerts.alert('servers', server_name, 'flapping',
+                         f"🔀 Server {server_name} is flapping (it changed state {target.flap_changes} times in the last {len(target.probes)} probes). "
+                         f"Its alerts are muted until it is stable again.")
+        else:
+            logger.info(f"Server {server_name} is flapping, the alert is muted.")
+        return
+
+    if target.state == 'online':
+        if transition.flapping_changed:
+            alerts.resolve('servers', server_name, f"✅ Server {server_name} is stable again and online.")
+        elif transition.state_changed and transition.previous_state in ('offline', 'unknown', 'unhealthy'):
+            alerts.resolve('servers', server_name, f"✅ Server {server_name} is back online.")
+        else:
+            alerts.resolve('servers', server_name)
+    elif target.state == 'offline':
+        alerts.alert('servers', server_name, 'offline', f"⚠️ Server {server_name} is offline!")
+    elif target.state == 'unhealthy':
+        alerts.alert('servers', server_name, 'unhealthy', f"⚠️ Server {server_name} answers, but is unhealthy!\nOutput: {result.error}")
+    else:
+        alerts.alert('servers', server_name, 'unknown', f"⚠️ Status of server {server_name} is unknown!\nOutput: {result.error}")
+
+# Function to save the state of one server, returns the previous state
+def save_server_state(server_name, server_state):
+    report_state(f"state.server.{server_name}", server_state)
+    previous_state = state_store.set('server', server_name, server_state)
+    if previous_state != server_state:
+        logger.info(f"Server {server_name} went from {previous_state} to {server_state}.")
+    return previous_state
         
-# Function to check storage usage        
+# Function to check the storage and inode usage of every mount, and when it will be full
+fill_rate = FillRate(window=STORAGE_FILL_WINDOW_HOURS * 3600)
+
 def check_storage_usage():
-    command = 'df -h / | awk \'NR==2{print $5}\''
-    storage_threshold = 90
-    
-    storage_usage = subprocess.run(command, shell=True, capture_output=True, text=True).stdout.strip().split('%')[0]
-    print(f"Storage usage: {storage_usage}%")
-    logging.info(f"Storage usage: {storage_usage}%")
-    
-    if int(storage_usage) > storage_threshold:
-        send_telegram_message(f"💾 Storage usage is high (> {storage_threshold}%).")
+    try:
+        thresholds = storage_config.get()
+    except OSError as e:
+        logger.error(f"Could not read {storage_config.path}, using the default thresholds: {str(e)}")
+        thresholds = {}
+
+    usages = mounted_disk_usage()
+    fill_rate.keep([usage.mount for usage in usages])
+    for usage in usages:
+        mount = usage.mount
+        threshold = thresholds.get(mount)
+        if threshold is not None and threshold.percent is None:
+            continue
+        storage_threshold = threshold.percent if threshold is not None else STORAGE_THRESHOLD
+        inodes_threshold = threshold.inodes_percent if threshold is not None and threshold.inodes_percent is not None else INODES_THRESHOLD
+
+        if mount == '/':
+            record_metric('storage.percent', usage.percent)
+        disk_used_metric.set(usage.percent, mount=mount)
+        report_state(f"storage.{mount}.percent", usage.percent)
+        inodes_used_metric.set(usage.inodes_percent, mount=mount)
+        logger.debug(f"Storage usage of {mount}: {usage.percent}%, inodes: {usage.inodes_percent if usage.inodes_percent is not None else '-'}%")
+
+        fill_rate.add(mount, usage.used_bytes)
+        hours_to_full = fill_rate.hours_to_full(mount, usage.free_bytes)
+        hours_to_full_metric.set(hours_to_full, mount=mount)
+
+        if usage.percent > storage_threshold:
+            alerts.alert('storage', mount, 'high', f"💾 Storage usage of {mount} is high ({usage.percent}% > {storage_threshold}%).")
+            alerts.resolve('storage_forecast', mount)
+        else:
+            alerts.resolve('storage', mount)
+            if STORAGE_FULL_WITHIN_HOURS and hours_to_full is not None and hours_to_full < STORAGE_FULL_WITHIN_HOURS:
+                logger.info(f"{mount} will be full in {hours_to_full:.1f} hours.")
+                alerts.alert('storage_forecast', mount, 'filling',
+                             f"💾 {mount} will be full in about {hours_to_full:.1f} hours at the current rate "
+                             f"({usage.percent}% used, {format_bytes(usage.free_bytes)} free).")
+            else:
+                alerts.resolve('storage_forecast', mount)
+
+        if usage.inodes_percent is not None and usage.inodes_percent > inodes_threshold:
+            alerts.alert('inodes', mount, 'high', f"💾 Inode usage of {mount} is high ({usage.inodes_percent}% > {inodes_threshold}%).")
+        else:
+            alerts.resolve('inodes', mount)
         
 # Function to check CPU usage
-def check_cpu_usage():
-    command = 'top -bn 1 | awk \'/Cpu\(s\):/ {print "%Cpu: " $2}\''
+cpu_sampler = CpuSampler()
 
-    cpu_usage = subprocess.run(command, shell=True, capture_output=True, text=True).stdout.strip().split(': ')[1]
-    print(f"CPU usage: {cpu_usage}%")
-    logging.info(f"CPU usage: {cpu_usage}%")
-    if (float(cpu_usage) > 80):
+def check_cpu_usage():
+    cpu_usage = cpu_sampler.sample(window=1)
+    record_metric('cpu.percent', cpu_usage)
+    logger.info(f"CPU usage: {cpu_usage}%")
+    if (cpu_usage > 80):
+        # Read the processes before and after the 5 seconds, so the top consumers are the ones that used the CPU in between
+        processes_before = read_processes()
+        processes_read_at = time.monotonic()
         time.sleep(5)
         
-        cpu_usage2 = subprocess.run(command, shell=True, capture_output=True, text=True).stdout.strip().split(': ')[1]
-        if (float(cpu_usage2) > 80):
-            top_consumers = subprocess.run('ps -eo pid,%cpu,%mem,comm --sort=-%cpu | head -n 11', shell=True, capture_output=True, text=True).stdout
+        # Usage over the 5 seconds since the first sample
+        cpu_usage2 = cpu_sampler.sample()
+        if (cpu_usage2 > 80):
+            usages = process_usage(processes_before, read_processes(), time.monotonic() - processes_read_at)
+            top_consumers = format_top(usages, 10, names=get_container_names())
             
-            print(f"CPU usage: {cpu_usage2}%")
-            logging.info(f"CPU usage: {cpu_usage2}%")
-            logging.info(f"Top consumers: \n{top_consumers}")
-            send_telegram_message(f"🔥 CPU usage is high (> 80%). First time it was {cpu_usage}% and after 30 seconds it was {cpu_usage2}%. These are the top consumers: \n<pre>{top_consumers}</pre>", "HTML")
+            logger.info(f"CPU usage: {cpu_usage2}%")
+            logger.info(f"Top consumers: \n{top_consumers}")
+            alerts.alert('cpu', 'host', 'high', f"🔥 CPU usage is high (> 80%). First time it was {cpu_usage}% and after 5 seconds it was {cpu_usage2}%. These are the top consumers over those 5 seconds: \n<pre>{html.escape(top_consumers)}</pre>", "HTML")
+            return
+    alerts.resolve('cpu', 'host')
+
+# Function to check the memory usage, swap activity and memory and IO pressure. The pressure and
+# swap rates come from the counters of the kernel, so they are exact averages over the window
+# however often the check runs. Processes killed for memory are reported right away.
+memory_counters = CounterRate(window=PRESSURE_WINDOW_MINUTES * 60)
+
+def check_memory_usage():
+    memory = read_memory()
+    vmstat = read_vmstat()
+    pressures = read_pressures()
+    now = time.monotonic()
+
+    used_percent = round((memory.total_mb - memory.available_mb) * 100 / memory.total_mb, 1) if memory.total_mb else 0.0
+    record_metric('memory.percent', used_percent)
+    memory_used_metric.set(used_percent)
+    for counter, value in vmstat.items():
+        memory_counters.add(counter, value, now)
+    for resource, pressure in pressures.items():
+        memory_counters.add(f"{resource}.some", pressure.some.total_us, now)
+        if pressure.full is not None:
+            memory_counters.add(f"{resource}.full", pressure.full.total_us, now)
+    logger.info(f"Memory usage: {used_percent}%, swap: {memory.swap_used_mb} of {memory.swap_total_mb}MB, pressure: {format_pressures(pressures) or '-'}")
+
+    # Stall time in microseconds per second, as a percent of the time
+    stalls = {}
+    for counter in ('cpu.some', 'memory.some', 'memory.full', 'io.some', 'io.full'):
+        rate = memory_counters.rate(counter)
+        if rate is not None:
+            stalls[counter] = round(rate / 10000, 1)
+            pressure_metric.set(stalls[counter], resource=counter.split('.')[0], kind=counter.split('.')[1])
+    for counter in ('memory.some', 'io.some'):
+        if counter in stalls:
+            record_metric(f"pressure.{counter}", stalls[counter])
+    swap_in = memory_counters.rate('pswpin')
+    if swap_in is not None:
+        swap_in_metric.set(round(swap_in, 1))
+
+    killed = memory_counters.increase('oom_kill')
+    if killed:
+        alerts.alert('oom', 'host', str(vmstat['oom_kill']),
+                     f"💀 The kernel killed {killed} process{'es' if killed != 1 else ''} because the memory ran out "
+                     f"(memory {used_percent}% in use, {format_bytes(memory.available_mb * 1024 * 1024)} available).")
+    elif killed is not None:
+        alerts.resolve('oom', 'host')
+
+    window = f"the last {PRESSURE_WINDOW_MINUTES} minutes"
+    memory_problems = {}
+    if used_percent > MEMORY_THRESHOLD:
+        memory_problems['usage'] = f"{used_percent}% of the memory is in use (> {MEMORY_THRESHOLD}%)"
+    if 'memory.some' in stalls and stalls['memory.some'] > MEMORY_PRESSURE_THRESHOLD:
+        memory_problems['pressure'] = (f"tasks waited for memory {stalls['memory.some']}% of {window} "
+                                       f"(> {MEMORY_PRESSURE_THRESHOLD:g}%, all tasks at once {stalls.get('memory.full', 0)}%)")
+    if swap_in is not None and swap_in > SWAP_IN_THRESHOLD:
+        memory_problems['swap'] = f"{swap_in:.0f} pages per second were swapped in over {window} (> {SWAP_IN_THRESHOLD:g})"
+    if memory_problems:
+        top_consumers = format_top(process_usage({}, read_processes(), 0), 10, by='rss', names=get_container_names())
+        alerts.alert('memory', 'host', '+'.join(memory_problems),
+                     f"🧠 Memory is running low: {'; '.join(memory_problems.values())}. "
+                     f"Swap: {memory.swap_used_mb} of {memory.swap_total_mb}MB in use. These use the most memory: \n"
+                     f"<pre>{html.escape(top_consumers)}</pre>", "HTML")
+    else:
+        alerts.resolve('memory', 'host')
+
+    if 'io.some' in stalls and stalls['io.some'] > IO_PRESSURE_THRESHOLD:
+        alerts.alert('io_pressure', 'host', 'high',
+                     f"🐌 Tasks waited for IO {stalls['io.some']}% of {window} (> {IO_PRESSURE_THRESHOLD:g}%, "
+                     f"all tasks at once {stalls.get('io.full', 0)}%). A disk is too slow for the load.")
+    else:
+        alerts.resolve('io_pressure', 'host')
+
+# Function to get the names of the containers for the process groups, empty when docker cannot be reached
+def get_container_names():
+    try:
+        return container_names(docker_client)
+    except (DockerError, OSError) as e:
+        logger.error(f"Could not get the container names: {str(e)}")
+        return {}
 
 
-# Function to send messages to Telegram
+# Function to keep a measured value in the metrics store
+def record_metric(name, value):
+    report_state(name, round(value, 1))
+    if metrics_store is None:
+        return
+    try:
+        metrics_store.record(name, value)
+    except ValueError as e:
+        logger.error(f"Could not record metric {name}: {str(e)}")
+
+
+# Function to remove the stored metrics of the servers that are not listed anymore, and to
+# grow the store when the listed servers (two metrics each) and the host metrics do not fit
+def keep_server_metrics(server_names):
+    if metrics_store is None:
+        return
+    try:
+        metrics_store.remove_prefix('server.', keep={f"server.{name}.{metric}" for name in server_names for metric in SERVER_METRICS})
+        metrics_store.reserve(HOST_METRICS + len(SERVER_METRICS) * len(server_names))
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not resize the metrics store: {str(e)}")
+
+
+# Function to report a value to the fleet aggregator, does nothing when the monitoring is not an agent
+def report_state(key, value):
+    if fleet_agent is not None:
+        fleet_agent.set(key, value)
+
+# Function to stop reporting the targets that are not listed anymore
+def forget_states(prefix, names):
+    if fleet_agent is not None:
+        fleet_agent.remove_prefix(prefix, keep={f"{prefix}{name}" for name in names})
+
+
+# Function to deliver a message to Telegram, raises when it fails so the notifier can retry.
+# An agent pushes it to the fleet aggregator instead, and raises until the aggregator has it.
+def deliver_telegram_message(message, parse_mode=None):
+    if fleet_agent is not None:
+        fleet_agent.deliver(message, parse_mode)
+        return
+    bot.send_message(CHAT_ID_PERSON1, message, parse_mode=parse_mode)
+
+
+# Outgoing messages are spooled to disk and delivered in the background
+notifier = Notifier(deliver_telegram_message, 'spool')
+
+# Function to send messages to Telegram, returns right away
 def send_telegram_message(message, parse_mode=None):
     try:
-        bot.send_message(CHAT_ID_PERSON1, message, parse_mode=parse_mode)
-    except Exception as e:
-        print(f"Error while sending Telegram message: {str(e)}")
-        logging.error(f"Error while sending Telegram message: {str(e)}")
+        notifier.submit(message, parse_mode)
+    except OSError as e:
+        logger.error(f"Error while queueing Telegram message: {str(e)}")
 
 
-# Run every 5 minutes
-def job():
-    # Read service and container lists from files
-    with open('monitoring_services.txt', 'r') as services_file:
-        services_list = services_file.read().splitlines()
+alerts = AlertPipeline(send_telegram_message, ALERT_BATCH_SECONDS, ALERT_REMINDER_MINUTES * 60)
 
-    with open('monitoring_containers.txt', 'r') as containers_file:
-        containers_list = containers_file.read().splitlines()
-        
-    with open('monitoring_servers.txt', 'r') as servers_file:
-        servers_list = servers_file.read().splitlines()
-    
-    print("Starting monitoring...")
-    logging.info("Starting monitoring...")
-    check_and_restart_services(services_list)
-    check_and_restart_containers(containers_list)
-    are_servers_online(servers_list)
-    check_cpu_usage()
-    check_storage_usage()
-    print("Monitoring finished. See you in 5 minutes.")
-    logging.info("Monitoring finished. See you in 5 minutes.")
+metrics_registry.gauge('monitoring_telegram_queue_depth', 'Messages waiting to be sent to Telegram.', function=lambda: notifier.pending)
+metrics_registry.counter('monitoring_telegram_sent_total', 'Messages delivered to Telegram.', function=lambda: notifier.sent)
+metrics_registry.counter('monitoring_telegram_failed_attempts_total', 'Attempts to deliver a message that failed.', function=lambda: notifier.failed_attempts)
+metrics_registry.counter('monitoring_telegram_dropped_total', 'Messages that Telegram refused or that could not be read.', function=lambda: notifier.dropped)
+metrics_registry.gauge('monitoring_telegram_delivery_latency_seconds', 'Time from queueing to delivery of the last message.', function=lambda: notifier.last_latency)
+metrics_registry.counter('monitoring_alerts_suppressed_total', 'Repeated alerts that were not sent.', function=lambda: alerts.suppressed)
+metrics_registry.counter('monitoring_log_records_dropped_total', 'Log records dropped because the writer could not keep up.', function=lambda: log_handler.dropped)
+
+
+# Lists of what to monitor, read again when a file changes
+services_config = ConfigFile('monitoring_services.txt')
+containers_config = ConfigFile('monitoring_containers.txt')
+servers_config = ConfigFile('monitoring_servers.txt', parse_probe_targets)
+storage_config = ConfigFile('monitoring_storage.txt', parse_storage_thresholds)
+
+
+# CHECKS
+# Function to read the interval and jitter (in seconds) of a check from the environment,
+# for example SERVERS_INTERVAL=600 and SERVERS_JITTER=30
+def check_timing(name, interval, jitter):
+    return (int(os.environ.get(f"{name.upper()}_INTERVAL", interval)),
+            int(os.environ.get(f"{name.upper()}_JITTER", jitter)))
+
+def check_services():
+    check_and_restart_services(services_config.get())
+
+def check_containers():
+    check_and_restart_containers(containers_config.get())
+
+def check_servers():
+    are_servers_online(servers_config.get())
+
+# Every server has its own probe interval, starting at SERVERS_INTERVAL. The check itself
+# runs every SERVERS_MIN_INTERVAL and only probes the servers that are due.
+servers_interval, servers_jitter = check_timing('servers', 300, 15)
+server_tracker = TargetTracker(servers_interval, SERVERS_MIN_INTERVAL, SERVERS_MAX_INTERVAL,
+                               SERVERS_CONFIRM_PROBES, SERVERS_CONFIRM_WINDOW)
+
+# Every check runs on its own interval, default every 5 minutes
+CHECKS = [
+    ('services', check_services, *check_timing('services', 300, 5)),
+    ('containers', check_containers, *check_timing('containers', 300, 5)),
+    ('servers', check_servers, server_tracker.min_interval, servers_jitter),
+    ('cpu', check_cpu_usage, *check_timing('cpu', 300, 5)),
+    ('storage', check_storage_usage, *check_timing('storage', 300, 5)),
+    ('memory', check_memory_usage, *check_timing('memory', 60, 5)),
+]
+
+
+# Function to write a finished profile for the bot
+def write_profile(profile_text):
+    try:
+        with open(f"{PROFILE_DUMP_FILE}.tmp", 'w') as profile_file:
+            profile_file.write(profile_text)
+        os.replace(f"{PROFILE_DUMP_FILE}.tmp", PROFILE_DUMP_FILE)
+        logger.info(f"Profile written to {PROFILE_DUMP_FILE}.")
+    except OSError as e:
+        logger.error(f"Could not write the profile: {str(e)}")
+
+# Function to record how long a check run took, and to start a profile when the bot asked for one
+def record_check_run(check, duration, success):
+    check_duration_metric.observe(duration, check=check.name)
+    report_state(f"check.{check.name}.ok", success)
+    try:
+        profiler.save(PERF_SNAPSHOT_FILE)
+        profile_runs = take_profile_request(PROFILE_REQUEST_FILE)
+    except OSError as e:
+        logger.error(f"Could not save the timings: {str(e)}")
+        return
+    if profile_runs:
+        profiler.start_profile(profile_runs, write_profile)
+
+scheduler = Scheduler(on_finish=record_check_run)
+metrics_registry.counter('monitoring_check_runs_total', 'Runs of a check.', ['check'],
+                         function=lambda: {check.name: check.runs for check in scheduler.checks})
+metrics_registry.counter('monitoring_check_failures_total', 'Runs of a check that raised an error.', ['check'],
+                         function=lambda: {check.name: check.failures for check in scheduler.checks})
+metrics_registry.counter('monitoring_check_missed_total', 'Runs of a check that were skipped because it was still busy.', ['check'],
+                         function=lambda: {check.name: check.missed for check in scheduler.checks})
+metrics_registry.gauge('monitoring_check_last_success_timestamp_seconds', 'Time of the last successful run of a check.', ['check'],
+                       function=lambda: {check.name: check.last_success for check in scheduler.checks})
 
+for name, function, interval, jitter in CHECKS:
+    logger.info(f"Scheduling {name} check every {interval} seconds (jitter {jitter} seconds).")
+    scheduler.add(name, profiler.wrap(name, function), interval, jitter)
 
-job()
+# "monitoring.py --once [check ...]" runs the (given) checks one time, sends the alerts and exits.
+# For cron, or to measure a whole cycle like benchmarks/bench_monitoring.py does.
+if len(sys.argv) > 1 and sys.argv[1] == '--once':
+    cycle_seconds = scheduler.run_all(sys.argv[2:])
+    logger.info(f"Ran the checks in {cycle_seconds:.2f} seconds.")
+    alerts.flush()
+    notifier.wait_until_empty(timeout=60)
+    if fleet_agent is not None:
+        fleet_agent.push()
+else:
+    # The periodic checks stay as a reconciliation pass for the event watchers
+    if DOCKER_EVENTS:
+        threading.Thread(target=watch_container_events, daemon=True).start()
 
-# Schedule the job to run at the specified intervals (5 minute intervals, 00:00, 00:05 etc.)
-five_minute_intervals = ["{:02d}:{:02d}".format(hour, minute) for hour in range(24) for minute in range(0, 60, 5)]
+    if SYSTEMD_EVENTS:
+        threading.Thread(target=watch_service_events, daemon=True).start()
 
-for interval in five_minute_intervals:
-    schedule.every().day.at(interval).do(job)
+    if METRICS_PORT:
+        try:
+            start_metrics_server(metrics_registry, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Could not serve metrics on port {METRICS_PORT}: {str(e)}")
 
-# Run the scheduler
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+    if fleet_agent is not None:
+        logger.info(f"Pushing to the fleet aggregator {FLEET_URL} as {FLEET_AGENT_NAME} every {FLEET_PUSH_SECONDS} seconds.")
+        fleet_agent.start()
 
+    logger.info("Starting monitoring...")
+    scheduler.run_forever()
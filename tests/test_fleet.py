@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from linux_common.fleet import FleetAgent, FleetAggregator, decode_batch, start_fleet_server
+from linux_common.notifier import Notifier
+
+TOKEN = 'secret'
+
+
+@pytest.fixture
+def fleet():
+    received = []
+    batches = []
+    aggregator = FleetAggregator(TOKEN, lambda name, message, parse_mode: received.append((name, message)))
+    apply = aggregator.apply
+
+    def recording_apply(batch, address=None, size=0):
+        batches.append(batch)
+        return apply(batch, address, size)
+
+    aggregator.apply = recording_apply
+    server = start_fleet_server(aggregator, 0, '127.0.0.1')
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    agents = [FleetAgent(url, name, TOKEN, timeout=5) for name in ('alpha', 'beta')]
+    yield aggregator, agents, batches, received
+    server.shutdown()
+    server.server_close()
+
+
+def states(aggregator):
+    return {agent.name: agent.state for agent in aggregator.snapshot()}
+
+
+def test_agents_push_only_what_changed(fleet):
+    aggregator, (alpha, beta), batches, _ = fleet
+    alpha.set('cpu.percent', 10)
+    alpha.set('state.server.nas', 'online')
+    beta.set('cpu.percent', 50)
+    assert alpha.push() and beta.push()
+    assert [batch['base'] for batch in batches] == [0, 0]
+
+    alpha.set('cpu.percent', 20)
+    alpha.remove_prefix('state.server.')
+    assert alpha.push()
+    assert batches[-1]['changed'] == {'cpu.percent': 20}
+    assert batches[-1]['removed'] == ['state.server.nas']
+    assert states(aggregator) == {'alpha': {'cpu.percent': 20}, 'beta': {'cpu.percent': 50}}
+
+
+def test_agent_sends_its_whole_state_when_the_aggregator_lost_it(fleet):
+    aggregator, (alpha, beta), batches, _ = fleet
+    alpha.set('cpu.percent', 10)
+    alpha.set('storage.percent', 70)
+    beta.set('cpu.percent', 50)
+    assert alpha.push() and beta.push()
+
+    # Like an aggregator that restarted
+    aggregator.agents.clear()
+    alpha.set('cpu.percent', 11)
+    assert alpha.push()
+    assert aggregator.rejected == 1
+    # The delta was refused, then the whole state was sent
+    assert batches[-2]['base'] != 0 and batches[-1]['base'] == 0
+    assert alpha.full_pushes == 2
+    assert states(aggregator) == {'alpha': {'cpu.percent': 11, 'storage.percent': 70}}
+
+    assert beta.push()
+    assert states(aggregator)['beta'] == {'cpu.percent': 50}
+
+
+def test_alert_is_delivered_once_when_the_acknowledgement_got_lost(fleet):
+    aggregator, (alpha, beta), _, received = fleet
+    post = alpha._post
+    lost = []
+
+    def post_without_answer(body):
+        status = post(body)
+        if not lost and decode_batch(body)['alerts']:
+            lost.append(status)
+            raise OSError('connection reset')
+        return status
+
+    alpha._post = post_without_answer
+    with pytest.raises(OSError):
+        alpha.deliver('⚠️ Server nas is offline!')
+    alpha.deliver('⚠️ Server nas is offline!')
+    beta.deliver('⚠️ Server nas is offline!')
+    alpha.deliver('✅ Server nas is online again.')
+
+    assert received == [('alpha', '⚠️ Server nas is offline!'), ('beta', '⚠️ Server nas is offline!'),
+                        ('alpha', '✅ Server nas is online again.')]
+    assert alpha.push()
+    assert len(received) == 3
+
+
+def test_spooled_alert_is_kept_until_the_aggregator_has_it(fleet, tmp_path):
+    aggregator, (alpha, _), _, received = fleet
+    aggregator.token = 'other'
+    notifier = Notifier(alpha.deliver, str(tmp_path / 'spool'))
+    notifier.submit('⚠️ Service nginx is down!')
+    assert not notifier.wait_until_empty(timeout=1.5)
+    assert notifier.failed_attempts >= 1
+    assert len(os.listdir(tmp_path / 'spool')) == 1
+    assert received == []
+
+    aggregator.token = TOKEN
+    assert notifier.wait_until_empty(timeout=10)
+    assert received == [('alpha', '⚠️ Service nginx is down!')]
+    assert os.listdir(tmp_path / 'spool') == []
@@ -0,0 +1,43 @@
+from linux_common.hysteresis import TargetTracker
+
+
+def record_all(tracker, name, states):
+    now = 0
+    transitions = []
+    for state in states:
+        transitions.append(tracker.record(name, state, now=now))
+        now += 300
+    return transitions
+
+
+def test_single_blip_on_a_new_target_is_not_flapping():
+    tracker = TargetTracker(300, 60, 1200)
+    transitions = record_all(tracker, 'nas', ['online', 'offline', 'online'])
+    target = transitions[-1].target
+    assert not target.flapping
+    assert not any(transition.flapping_changed for transition in transitions)
+    assert target.state == 'online'
+
+
+def test_outage_after_a_blip_is_confirmed():
+    tracker = TargetTracker(300, 60, 1200)
+    transitions = record_all(tracker, 'nas', ['online', 'offline', 'online', 'offline', 'offline'])
+    assert transitions[-1].target.state == 'offline'
+    assert [transition.state_changed for transition in transitions] == [True, False, False, True, False]
+    assert not transitions[-1].target.flapping
+
+
+def test_target_that_keeps_changing_is_flapping():
+    tracker = TargetTracker(300, 60, 1200)
+    transitions = record_all(tracker, 'nas', ['online', 'offline'] * 3)
+    assert transitions[-1].target.flapping
+    assert transitions[-1].flapping_changed
+    assert not any(transition.flapping_changed for transition in transitions[:-1])
+
+
+def test_flapping_ends_when_stable():
+    tracker = TargetTracker(300, 60, 1200)
+    record_all(tracker, 'nas', ['online', 'offline'] * 3)
+    transitions = record_all(tracker, 'nas', ['online'] * 10)
+    assert not transitions[-1].target.flapping
+    assert any(transition.flapping_changed for transition in transitions)
@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from linux_common.notifier import Notifier
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fakes'))
+from fake_bot_api import FakeBotAPIServer  # noqa: E402
+
+CHAT_ID = 42
+
+
+# Raised like the ApiTelegramException of telebot, with the error code and the answer of the API
+class ApiError(Exception):
+    def __init__(self, result_json):
+        super().__init__(result_json.get('description'))
+        self.error_code = result_json['error_code']
+        self.result_json = result_json
+
+
+@pytest.fixture
+def api():
+    server = FakeBotAPIServer()
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# Function to get a send function for the notifier that posts to the fake Bot API
+def sender(api, gate=None):
+    def send(message, parse_mode=None):
+        if gate is not None:
+            gate.wait()
+        body = json.dumps({'chat_id': CHAT_ID, 'text': message, 'parse_mode': parse_mode}).encode()
+        request = urllib.request.Request(api.api_url.format('TOKEN', 'sendMessage'), data=body,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            raise ApiError(json.load(e))
+    return send
+
+
+def texts(api):
+    return [message['text'] for message in api.messages]
+
+
+def test_messages_are_delivered_in_order(api, tmp_path):
+    notifier = Notifier(sender(api), str(tmp_path / 'spool'))
+    for number in range(20):
+        notifier.submit(f"message {number}", 'Markdown' if number % 2 else None)
+    assert notifier.wait_until_empty(timeout=10)
+
+    assert texts(api) == [f"message {number}" for number in range(20)]
+    assert [message['parse_mode'] for message in api.messages[:2]] == [None, 'Markdown']
+    assert notifier.sent == 20 and notifier.failed_attempts == 0
+    assert os.listdir(tmp_path / 'spool') == []
+
+
+def test_waits_as_long_as_telegram_asks_on_429(api, tmp_path):
+    api.flood_requests = 1
+    api.retry_after = 1
+    notifier = Notifier(sender(api), str(tmp_path / 'spool'))
+    started = time.monotonic()
+    notifier.submit('first')
+    notifier.submit('second')
+    assert notifier.wait_until_empty(timeout=10)
+
+    assert time.monotonic() - started >= 1
+    assert texts(api) == ['first', 'second']
+    assert api.requests == 3
+    assert notifier.failed_attempts == 1 and notifier.dropped == 0
+
+
+def test_message_refused_with_4xx_is_dropped(api, tmp_path):
+    api.bad_requests = 1
+    notifier = Notifier(sender(api), str(tmp_path / 'spool'))
+    notifier.submit('*broken markdown', 'Markdown')
+    notifier.submit('next')
+    assert notifier.wait_until_empty(timeout=10)
+
+    assert texts(api) == ['next']
+    assert api.requests == 2
+    assert notifier.dropped == 1 and notifier.failed_attempts == 1 and notifier.sent == 1
+    assert os.listdir(tmp_path / 'spool') == []
+
+
+def test_spooled_messages_are_delivered_after_a_restart(api, tmp_path):
+    spool = str(tmp_path / 'spool')
+    # The first run never gets a message out, like a process that is killed while sending
+    stuck = threading.Event()
+    first_run = Notifier(sender(api, gate=stuck), spool)
+    for text in ('a', 'b', 'c'):
+        first_run.submit(text)
+    assert len(os.listdir(spool)) == 3
+
+    second_run = Notifier(sender(api), spool)
+    assert second_run.pending == 3
+    second_run.submit('d')
+    assert second_run.wait_until_empty(timeout=10)
+
+    assert texts(api) == ['a', 'b', 'c', 'd']
+    stuck.set()
+
+
+def test_messages_that_overflow_the_queue_are_delivered_from_the_spool(api, tmp_path):
+    gate = threading.Event()
+    notifier = Notifier(sender(api, gate=gate), str(tmp_path / 'spool'), max_queue=2)
+    for number in range(10):
+        notifier.submit(f"message {number}")
+    assert notifier.pending == 10
+    assert notifier._overflow
+    assert len(os.listdir(tmp_path / 'spool')) == 10
+
+    gate.set()
+    assert notifier.wait_until_empty(timeout=15)
+    assert texts(api) == [f"message {number}" for number in range(10)]
+    assert notifier.dropped == 0
@@ -0,0 +1,68 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from linux_common import probes
+from linux_common.probes import probe_servers, resolve_servers
+
+
+@pytest.fixture
+def listening_port():
+    with socket.socket() as server:
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        yield server.getsockname()[1]
+
+
+# Replaces getaddrinfo with one that takes delay seconds for a host name, and records the looked up names
+@pytest.fixture
+def slow_dns(monkeypatch):
+    getaddrinfo = socket.getaddrinfo
+    looked_up = []
+    lock = threading.Lock()
+
+    def slow_getaddrinfo(host, port, *args, flags=0, **kwargs):
+        if not flags & socket.AI_NUMERICHOST:
+            with lock:
+                looked_up.append(host)
+            time.sleep(0.2)
+            host = '127.0.0.1'
+        return getaddrinfo(host, port, *args, flags=flags, **kwargs)
+
+    monkeypatch.setattr(probes.socket, 'getaddrinfo', slow_getaddrinfo)
+    return looked_up
+
+
+def test_literal_addresses_are_not_looked_up(slow_dns):
+    addresses = resolve_servers([('a', '127.0.0.1', 80), ('b', '::1', 80)])
+    assert slow_dns == []
+    assert addresses[('127.0.0.1', 80)][0][4] == ('127.0.0.1', 80)
+    assert addresses[('::1', 80)][0][4][:2] == ('::1', 80)
+
+
+def test_host_names_are_looked_up_concurrently_and_once(slow_dns):
+    servers = [(f"server{number}", f"host{number}.example", 80) for number in range(8)]
+    started = time.monotonic()
+    addresses = resolve_servers(servers + [('again', 'host0.example', 80)])
+    assert time.monotonic() - started < 0.2 * 4
+    assert sorted(slow_dns) == sorted(host for _, host, _ in servers)
+    assert len(addresses) == 8
+
+
+def test_probe_servers_with_names_and_addresses(slow_dns, listening_port):
+    results = probe_servers([('by_address', '127.0.0.1', listening_port),
+                             ('by_name', 'app.example', listening_port)], timeout=2)
+    assert [result.state for result in results] == ['online', 'online']
+    # The lookup is not part of the connect time
+    assert results[1].latency_ms < 200
+
+
+def test_name_that_does_not_resolve_is_unknown(monkeypatch):
+    def failing_getaddrinfo(host, port, *args, **kwargs):
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+
+    monkeypatch.setattr(probes.socket, 'getaddrinfo', failing_getaddrinfo)
+    result, = probe_servers([('missing', 'missing.example', 80)], timeout=1)
+    assert result.state == 'unknown' and 'not known' in result.error
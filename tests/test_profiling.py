@@ -0,0 +1,81 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from linux_common.profiling import Profiler
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def restart_in_worker():
+    busy(0.1)
+
+
+def check_with_workers():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda _: restart_in_worker(), range(2)))
+
+
+def test_profile_includes_the_work_of_worker_threads():
+    profiler = Profiler()
+    profiles = []
+    wrapped = profiler.wrap('check', check_with_workers)
+    assert profiler.start_profile(1, profiles.append)
+    wrapped()
+
+    assert len(profiles) == 1
+    assert 'restart_in_worker' in profiles[0] and 'busy' in profiles[0]
+    assert not profiler.is_profiling()
+
+
+def test_parallel_runs_are_all_timed_and_profiled_together():
+    profiler = Profiler()
+    profiles = []
+    calls = []
+
+    def check():
+        calls.append(1)
+        busy(0.05)
+
+    wrapped = profiler.wrap('check', check)
+    assert profiler.start_profile(4, profiles.append)
+    threads = [threading.Thread(target=wrapped) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 6
+    assert profiler.timings()[0].count == 6
+    assert len(profiles) == 1 and 'check' in profiles[0]
+    assert not profiler.is_profiling()
+
+
+def test_profile_is_done_after_the_requested_runs():
+    profiler = Profiler()
+    profiles = []
+    wrapped = profiler.wrap('check', lambda: busy(0.02))
+    assert profiler.start_profile(2, profiles.append)
+    assert not profiler.start_profile(2, profiles.append)
+    wrapped()
+    assert not profiles
+    wrapped()
+    assert len(profiles) == 1 and 'samples every' in profiles[0]
+    assert not profiler.is_profiling()
+
+
+def test_idle_threads_are_not_counted():
+    profiler = Profiler()
+    profiles = []
+    stop = threading.Event()
+    idle = threading.Thread(target=stop.wait, daemon=True)
+    idle.start()
+    wrapped = profiler.wrap('check', lambda: busy(0.05))
+    profiler.start_profile(1, profiles.append)
+    wrapped()
+    stop.set()
+    assert '(wait)' not in profiles[0]
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+
+from linux_common.routing import Router, extract_command
+
+ALLOWED_CHAT = 42
+
+
+def message(text, chat_id=ALLOWED_CHAT):
+    return SimpleNamespace(text=text, chat=SimpleNamespace(id=chat_id))
+
+
+def handler(name):
+    def function(message):
+        return name
+    function.__name__ = name
+    return function
+
+
+@pytest.fixture
+def router():
+    router = Router([ALLOWED_CHAT])
+    router.command('start', 'help')(handler('start'))
+    router.command('perf')(handler('perf'))
+    router.exact('🖥 System info')(handler('sysinfo'))
+    router.prefix('⏯ Start service: ')(handler('start_service'))
+    router.exact('⏯ Start service: nginx')(handler('start_nginx'))
+    router.prefix('⏯ ')(handler('any_action'))
+    router.fallback(handler('fallback'))
+    return router
+
+
+def resolved(router, text, chat_id=ALLOWED_CHAT):
+    return router.resolve(message(text, chat_id))['function'].__name__
+
+
+@pytest.mark.parametrize('text, command', [
+    ('/perf', 'perf'),
+    ('/perf@my_bot', 'perf'),
+    ('/perf@my_bot bot 20', 'perf'),
+    ('/perf 20', 'perf'),
+    ('perf', None),
+    ('', None),
+    (None, None),
+])
+def test_extract_command(text, command):
+    assert extract_command(text) == command
+
+
+def test_commands_with_bot_name_and_arguments(router):
+    assert resolved(router, '/perf') == 'perf'
+    assert resolved(router, '/perf@my_bot') == 'perf'
+    assert resolved(router, '/perf@my_bot bot 20') == 'perf'
+    assert resolved(router, '/help') == 'start'
+
+
+def test_unknown_command_goes_to_the_fallback(router):
+    assert resolved(router, '/unknown') == 'fallback'
+
+
+def test_exact_text(router):
+    assert resolved(router, '🖥 System info') == 'sysinfo'
+    assert resolved(router, '🖥 System info now') == 'fallback'
+
+
+def test_route_added_first_wins_between_exact_and_prefix(router):
+    # The prefix route was added before the exact one, like the handler chain of telebot
+    assert resolved(router, '⏯ Start service: nginx') == 'start_service'
+    assert resolved(router, '⏯ Start service: redis') == 'start_service'
+    # A shorter prefix that was added later does not win over a longer one added earlier
+    assert resolved(router, '⏯ Stop service: redis') == 'any_action'
+
+
+def test_exact_route_added_first_wins_over_prefix():
+    router = Router([ALLOWED_CHAT])
+    router.exact('⏯ Start service: nginx')(handler('start_nginx'))
+    router.prefix('⏯ Start service: ')(handler('start_service'))
+    assert resolved(router, '⏯ Start service: nginx') == 'start_nginx'
+    assert resolved(router, '⏯ Start service: redis') == 'start_service'
+
+
+def test_foreign_chat_goes_to_the_fallback(router):
+    assert resolved(router, '/perf', chat_id=7) == 'fallback'
+    assert resolved(router, '🖥 System info', chat_id=7) == 'fallback'
+
+
+def test_message_without_text_goes_to_the_fallback(router):
+    assert resolved(router, None) == 'fallback'
+
+
+def test_unknown_text_goes_to_the_fallback(router):
+    assert resolved(router, 'hello') == 'fallback'
+    assert router.dispatch(message('hello')) == 'fallback'
+
+
+def test_no_fallback_resolves_to_none():
+    router = Router([ALLOWED_CHAT])
+    router.command('perf')(handler('perf'))
+    assert router.resolve(message('hello')) is None
+    assert router.resolve(message('/perf', chat_id=7)) is None
+    assert router.dispatch(message('hello')) is None
@@ -0,0 +1,163 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from linux_common.config import ConfigFile
+from linux_common.systemd_units import UnitEventHandler, follow_unit_changes, query_units, unit_action, watch_unit_changes
+
+FAKES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fakes')
+FAKE_SYSTEMCTL = os.path.join(FAKES, 'fake_systemctl.py')
+FAKE_JOURNALCTL = os.path.join(FAKES, 'fake_journalctl.py')
+
+
+@pytest.fixture
+def fake_systemd(tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_SYSTEMCTL_STATE', str(tmp_path / 'fake_systemctl.json'))
+    monkeypatch.setenv('FAKE_SYSTEMCTL_JOURNAL', str(tmp_path / 'fake_systemctl.journal'))
+    with open(tmp_path / 'fake_systemctl.json', 'w') as state_file:
+        json.dump({'nginx': {'ActiveState': 'active', 'SubState': 'running'},
+                   'redis': {'ActiveState': 'active', 'SubState': 'running'}}, state_file)
+    return tmp_path
+
+
+def systemctl(*args):
+    subprocess.run([sys.executable, FAKE_SYSTEMCTL] + list(args), check=True)
+
+
+# Function to wait until condition() is true, making a unit fail every half second until then,
+# because fake_journalctl only follows what is written after it started
+def kill_until(unit, condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        systemctl('kill', unit)
+        for _ in range(10):
+            if condition():
+                return True
+            time.sleep(0.05)
+    return False
+
+
+# Function to wait until condition() is true
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_follow_unit_changes_yields_the_unit_that_failed(fake_systemd):
+    changes = follow_unit_changes(['nginx', 'redis.service'], journalctl=FAKE_JOURNALCTL, idle_seconds=0.1)
+    events = []
+    try:
+        deadline = time.monotonic() + 10
+        while 'redis.service' not in events and time.monotonic() < deadline:
+            systemctl('kill', 'redis')
+            systemctl('kill', 'postgres')
+            events.append(next(changes))
+    finally:
+        changes.close()
+    assert 'redis.service' in events
+    assert set(events) <= {'redis.service', None}
+    assert query_units(['redis'], systemctl=FAKE_SYSTEMCTL)['redis'].active_state == 'failed'
+
+
+def test_follow_unit_changes_without_units_returns_at_once():
+    assert list(follow_unit_changes([], journalctl=FAKE_JOURNALCTL)) == []
+
+
+# Watches the services file with an event handler that restarts a failed unit, like the monitoring does
+@pytest.fixture
+def watcher(fake_systemd):
+    services_file = fake_systemd / 'monitoring_services.txt'
+    services_file.write_text('nginx\n')
+    events = []
+    restarts = []
+
+    def recover(unit):
+        if query_units([unit], systemctl=FAKE_SYSTEMCTL)[unit].active_state != 'failed':
+            return False
+        restarts.append(unit)
+        unit_action('restart', unit, systemctl=FAKE_SYSTEMCTL)
+        return True
+
+    handler = UnitEventHandler(recover, cooldown=60, settle_seconds=0)
+
+    def on_change(unit):
+        events.append(unit)
+        handler.handle(unit)
+
+    stop = threading.Event()
+    thread = threading.Thread(target=watch_unit_changes, args=(ConfigFile(str(services_file)), on_change, stop),
+                              kwargs={'journalctl': FAKE_JOURNALCTL, 'idle_seconds': 0.1}, daemon=True)
+    thread.start()
+    yield services_file, events, restarts
+    stop.set()
+    thread.join(5)
+
+
+def test_failed_service_is_restarted_once_per_cooldown(watcher):
+    _, events, restarts = watcher
+    assert kill_until('nginx', lambda: restarts)
+    assert query_units(['nginx'], systemctl=FAKE_SYSTEMCTL)['nginx'].active_state == 'active'
+
+    # Failing again right after the restart is left to the periodic check
+    seen = len(events)
+    assert kill_until('nginx', lambda: len(events) > seen + 1)
+    time.sleep(0.2)
+    assert restarts == ['nginx']
+    assert query_units(['nginx'], systemctl=FAKE_SYSTEMCTL)['nginx'].active_state == 'failed'
+
+
+def test_units_added_to_the_list_are_followed(watcher):
+    services_file, events, restarts = watcher
+    assert kill_until('nginx', lambda: 'nginx' in events)
+    assert 'redis' not in events
+
+    services_file.write_text('nginx\nredis\n')
+    assert kill_until('redis', lambda: 'redis' in restarts)
+
+
+def test_empty_list_is_not_followed_until_units_are_listed(watcher):
+    services_file, events, restarts = watcher
+    services_file.write_text('')
+    time.sleep(0.5)
+    systemctl('kill', 'nginx')
+    time.sleep(0.3)
+    events.clear()
+    restarts.clear()
+    systemctl('kill', 'nginx')
+    time.sleep(0.5)
+    assert events == []
+
+    services_file.write_text('nginx\n')
+    assert kill_until('nginx', lambda: restarts == ['nginx'])
+
+
+def test_event_handler_runs_one_recovery_per_unit_at_a_time():
+    release = threading.Event()
+    calls = []
+
+    def recover(unit):
+        calls.append(unit)
+        release.wait(5)
+        return False
+
+    handler = UnitEventHandler(recover, cooldown=60, settle_seconds=0)
+    first = handler.handle('nginx')
+    assert handler.handle('nginx') is None
+    other = handler.handle('redis')
+    release.set()
+    first.join(5)
+    other.join(5)
+    assert sorted(calls) == ['nginx', 'redis']
+
+    # Nothing was restarted, so there is no cooldown
+    handler.handle('nginx').join(5)
+    assert calls.count('nginx') == 2
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from linux_common.timeseries import TimeSeriesStore
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / 'metrics.tsdb')
+
+
+def test_store_is_full_at_max_metrics(store_path):
+    store = TimeSeriesStore(store_path, max_metrics=2)
+    store.record('a', 1, 1000)
+    store.record('b', 2, 1000)
+    with pytest.raises(ValueError):
+        store.record('c', 3, 1000)
+    store.close()
+
+
+def test_removed_metric_frees_its_slot(store_path):
+    store = TimeSeriesStore(store_path, max_metrics=2)
+    store.record('server.old.online', 1, 1000)
+    store.record('cpu.percent', 5, 1000)
+    store.remove_prefix('server.', keep={'server.new.online'})
+    assert store.metrics() == ['cpu.percent']
+
+    store.record('server.new.online', 0, 1000)
+    assert store.metrics() == ['server.new.online', 'cpu.percent']
+    assert store.query('server.new.online', 990, 1010)[0].avg == 0
+    assert store.query('server.old.online', 990, 1010) == []
+    store.close()
+
+
+def test_reserve_grows_the_store_and_keeps_the_history(store_path):
+    store = TimeSeriesStore(store_path, max_metrics=2)
+    store.record('a', 1, 1000)
+    store.record('b', 2, 1000)
+    store.reserve(3)
+    assert store.max_metrics >= 3
+    store.record('c', 3, 1000)
+    assert [store.query(name, 990, 1010)[0].avg for name in ('a', 'b', 'c')] == [1, 2, 3]
+    store.close()
+
+    # Opening it again with the default size keeps the larger layout and the samples
+    reader = TimeSeriesStore(store_path, readonly=True)
+    assert reader.metrics() == ['a', 'b', 'c']
+    reader.close()
+    store = TimeSeriesStore(store_path, max_metrics=2)
+    assert store.query('c', 990, 1010)[0].avg == 3
+    store.close()
+
+
+def test_smaller_file_is_moved_to_the_larger_layout(store_path):
+    store = TimeSeriesStore(store_path, max_metrics=2)
+    store.record('a', 1, 1000)
+    store.close()
+
+    store = TimeSeriesStore(store_path, max_metrics=8)
+    assert store.max_metrics == 8
+    assert store.query('a', 990, 1010)[0].avg == 1
+    store.close()
+
+
+def test_reader_sees_the_metrics_after_the_store_grew(store_path):
+    store = TimeSeriesStore(store_path, max_metrics=32)
+    for number in range(31):
+        store.record(f"m{number}", number, 1000)
+    reader = TimeSeriesStore(store_path, readonly=True)
+    assert reader.query('m30', 990, 1010)[0].avg == 30
+
+    store.reserve(40)
+    store.record('m31', 31, 1000)
+    store.record('m39', 39, 1000)
+    assert store.query('m39', 990, 1010)[0].avg == 39
+    assert reader.query('m31', 990, 1010)[0].avg == 31
+    assert reader.query('m0', 990, 1010)[0].avg == 0
+    assert len(reader.metrics()) == 33
+    reader.close()
+    store.close()
+
+
+def test_growing_leaves_no_temporary_file(store_path, tmp_path):
+    store = TimeSeriesStore(store_path, max_metrics=2)
+    store.record('a', 1, 1000)
+    store.reserve(3)
+    assert sorted(os.listdir(tmp_path)) == ['metrics.tsdb']
+    store.close()